@@ -8,7 +8,7 @@ PKG="$WORK/pkg"
 CTRL="$WORK/control"
 mkdir -p "$OUT" "$PKG/usr/lib/enigma2/python/Plugins/Extensions/PiconUpdater" "$CTRL"
 DEST="$PKG/usr/lib/enigma2/python/Plugins/Extensions/PiconUpdater"
-for f in __init__.py plugin.py ui.py catalog.py storage.py version icon.png catalog_fallback.json custom_sources.json LICENSE changelog README.md THIRD_PARTY.md; do
+for f in __init__.py plugin.py ui.py catalog.py storage.py jobs.py perf.py version icon.png catalog_fallback.json custom_sources.json LICENSE changelog README.md THIRD_PARTY.md; do
     [ ! -e "$ROOT/$f" ] || cp -a "$ROOT/$f" "$DEST/"
 done
 for d in assets previews_local; do
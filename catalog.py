@@ -1,27 +1,42 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
+import calendar
+import codecs
 import datetime
 import json
 import os
 import re
+import socket
 import ssl
 import hashlib
 import tempfile
+import threading
+import time
+import zlib
 
 try:
-    from urllib.request import Request, urlopen
+    import http.client as httplib
+    from urllib.request import Request, HTTPHandler, HTTPSHandler, build_opener
     from urllib.parse import urlparse
+    from urllib.error import HTTPError
 except ImportError:  # Python 2 fallback for a few older images
-    from urllib2 import Request, urlopen
+    import httplib
+    from urllib2 import Request, HTTPHandler, HTTPSHandler, build_opener, HTTPError
     from urlparse import urlparse
 
+try:
+    from . import perf
+except ImportError:
+    import perf
+
 PLUGIN_VERSION = "2.0.1"
 GITHUB_RELEASES_API = "https://api.github.com/repos/picons/picons/releases?per_page=20"
 PLUGIN_VERSION_URL = "https://raw.githubusercontent.com/OliOli2013/PiconUpdater/main/version"
 CACHE_FILE = "/etc/enigma2/piconupdater_catalog.json"
 STATE_FILE = "/etc/enigma2/piconupdater_state.json"
 CACHE_TTL = 3600  # 1 h; Blue button can force immediate refresh
+MAX_INCREMENTAL_PAGES = 5
 USER_AGENT = "PiconUpdater/%s Enigma2" % PLUGIN_VERSION
 ALLOWED_HOSTS = (
     "api.github.com",
@@ -91,10 +106,24 @@ def scope_satellites(scope):
     return out
 
 
+def satellite_set(value):
+    """Satellite tokens of a selection; several are joined with "," and "*" is none."""
+    value = (value or "").lower()
+    if value == "*":
+        return []
+    return sorted(set(x.strip() for x in value.split(",") if x.strip()))
+
+
+def join_satellites(values):
+    return ",".join(sorted(set(values))) or "*"
+
+
 def satellite_label(value):
     value = (value or "").lower()
     if not value:
         return "—"
+    if "," in value:
+        return " + ".join(satellite_label(x) for x in satellite_set(value))
     return SATELLITE_LABELS.get(value, value.upper())
 
 
@@ -113,6 +142,8 @@ def item_supports_satellite(item, satellite):
     satellite = (satellite or "*").lower()
     if satellite == "*":
         return True
+    if "," in satellite:
+        return all(item_supports_satellite(item, x) for x in satellite_set(satellite))
     if (item or {}).get("type") != "srp":
         # Satellite-safe filtering is deterministic for SRP because the namespace is
         # encoded in every service-reference filename. Name based SNP variants do not
@@ -167,15 +198,63 @@ def _safe_url(url):
         return False
 
 
-def _open_https(url, timeout=15):
+_CONNECT = threading.local()
+
+
+class _TimedHTTPConnection(httplib.HTTPConnection):
+    def connect(self):
+        started = time.time()
+        httplib.HTTPConnection.connect(self)
+        _CONNECT.seconds = time.time() - started
+
+
+class _TimedHTTPSConnection(httplib.HTTPSConnection):
+    def connect(self):
+        started = time.time()
+        httplib.HTTPSConnection.connect(self)
+        _CONNECT.seconds = time.time() - started
+
+
+class _TimedHTTPHandler(HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_TimedHTTPConnection, req)
+
+
+class _TimedHTTPSHandler(HTTPSHandler):
+    def https_open(self, req):
+        context = getattr(self, "_context", None)
+        if context is None:
+            return self.do_open(_TimedHTTPSConnection, req)
+        return self.do_open(_TimedHTTPSConnection, req, context=context)
+
+
+def urlopen(req, timeout=15, context=None):
+    """urllib's urlopen that splits the time to the response into connect and TTFB spans."""
+    https = _TimedHTTPSHandler(context=context) if context is not None else _TimedHTTPSHandler()
+    opener = build_opener(_TimedHTTPHandler(), https)
+    _CONNECT.seconds = 0.0
+    started = time.time()
+    response = opener.open(req, timeout=timeout)
+    connect = _CONNECT.seconds
+    perf.add("connect", connect)
+    perf.add("ttfb", time.time() - started - connect)
+    return response
+
+
+def _open_https(url, timeout=15, headers=None):
     if not _safe_url(url):
         raise ValueError("Blocked URL: %s" % url)
-    req = Request(url, headers={
+    all_headers = {
         "User-Agent": USER_AGENT,
         "Accept": "application/vnd.github+json, application/json;q=0.9, */*;q=0.1",
-    })
+    }
+    all_headers.update(headers or {})
+    req = Request(url, headers=all_headers)
     try:
         return urlopen(req, timeout=timeout)
+    except HTTPError:
+        # The server answered (304, 403, 404, ...); retrying cannot change that.
+        raise
     except Exception as first_error:
         # Older Enigma2 images can ship an outdated CA bundle. Retry only HTTPS
         # to GitHub hosts with TLS verification disabled rather than disabling it globally.
@@ -204,6 +283,247 @@ def fetch_json(url, timeout=15):
     return json.loads(fetch_text(url, timeout=timeout))
 
 
+class _GunzipReader(object):
+    """Decompress a gzip Content-Encoding response while it is being read."""
+
+    def __init__(self, fileobj):
+        self._f = fileobj
+        self._z = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._buf = b""
+        self._eof = False
+
+    def read(self, n=-1):
+        while not self._eof and (n is None or n < 0 or len(self._buf) < n):
+            data = self._f.read(1024 * 64)
+            if not data:
+                self._buf += self._z.flush()
+                self._eof = True
+                break
+            self._buf += self._z.decompress(data)
+        if n is None or n < 0:
+            out, self._buf = self._buf, b""
+        else:
+            out, self._buf = self._buf[:n], self._buf[n:]
+        return out
+
+    def close(self):
+        try:
+            self._f.close()
+        except Exception:
+            pass
+
+
+_JSON_SPECIAL_RE = re.compile(r'["\[\]{}]')
+_JSON_STRING_TAIL_RE = re.compile(r'(?:[^"\\]|\\.)*"', re.S)
+_JSON_STRING_BODY_RE = re.compile(r'(?:[^"\\]|\\.)*', re.S)
+_RELEASE_FIELDS = ("tag_name", "published_at", "created_at", "draft")
+_ASSET_FIELDS = ("name", "browser_download_url", "size", "id", "digest")
+
+
+class _JsonReleaseStream(object):
+    """Yield slim release records from a GitHub releases JSON array as it is read.
+
+    Only the release fields used by the catalog are kept. An asset object is
+    buffered only after its name matched ASSET_RE, so peak memory is one asset
+    record plus one read chunk regardless of the response size; release notes,
+    authors and foreign assets are scanned over without being decoded.
+    """
+
+    def __init__(self, fileobj, chunk_size=1024 * 16):
+        self._f = fileobj
+        self._chunk = chunk_size
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._buf = ""
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            return False
+        data = self._f.read(self._chunk)
+        if not data:
+            self._eof = True
+            self._buf += self._decoder.decode(b"", True)
+            return False
+        self._buf += self._decoder.decode(data) if isinstance(data, bytes) else data
+        return True
+
+    def _string_end(self, start, skip=False):
+        # start points just past the opening quote; returns the index past the closing one.
+        while True:
+            m = _JSON_STRING_TAIL_RE.match(self._buf, start)
+            if m is not None:
+                return m.end()
+            if skip:
+                # Nobody needs this string (release notes), so its scanned part
+                # is cut out instead of accumulating in the buffer.
+                safe = _JSON_STRING_BODY_RE.match(self._buf, start).end()
+                self._buf = self._buf[:start] + self._buf[safe:]
+            if not self._fill():
+                raise ValueError("Niekompletna odpowiedź JSON")
+
+    def _next_nonspace(self, pos):
+        while True:
+            while pos < len(self._buf) and self._buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(self._buf) or not self._fill():
+                return self._buf[pos:pos + 1]
+
+    def __iter__(self):
+        stack = []
+        key = None
+        release = None
+        asset_start = None
+        asset_ok = False
+        pos = 0
+        while True:
+            keep = pos if asset_start is None else min(pos, asset_start)
+            if keep > self._chunk:
+                self._buf = self._buf[keep:]
+                pos -= keep
+                if asset_start is not None:
+                    asset_start -= keep
+            m = _JSON_SPECIAL_RE.search(self._buf, pos)
+            if m is None:
+                if not self._fill():
+                    return
+                continue
+            i = m.start()
+            ch = self._buf[i]
+            depth = len(stack)
+            if key is not None and depth in (2, 4):
+                literal = self._buf[pos:i].strip(" \t\r\n:,")
+                if literal:
+                    if depth == 2 and key in _RELEASE_FIELDS and release is not None:
+                        release[key] = json.loads(literal)
+                    key = None
+            pos = i + 1
+            if ch == '"':
+                level = "release" if depth == 2 and release is not None else (
+                    "asset" if depth == 4 and asset_start is not None else "")
+                wanted = level == "asset" or (level == "release" and (key is None or key in _RELEASE_FIELDS))
+                end = self._string_end(pos, skip=not wanted and asset_start is None)
+                if wanted:
+                    text = self._buf[i:end]
+                    value = text[1:-1] if "\\" not in text else json.loads(text)
+                    if key is None and self._next_nonspace(end) == ":":
+                        key = value
+                    elif level == "release":
+                        if key in _RELEASE_FIELDS:
+                            release[key] = value
+                        key = None
+                    else:
+                        if key == "name":
+                            asset_ok = bool(ASSET_RE.match(value))
+                            if not asset_ok:
+                                asset_start = None
+                        key = None
+                elif level:
+                    key = None
+                pos = end
+            elif ch in "[{":
+                if ch == "[" and depth == 2 and key == "assets" and release is not None:
+                    stack.append("A")
+                else:
+                    stack.append(ch)
+                if ch == "{" and stack == ["[", "{"]:
+                    release = {"assets": []}
+                elif ch == "{" and depth == 3 and stack[2] == "A":
+                    asset_start, asset_ok, key = i, False, None
+            else:
+                if not stack:
+                    raise ValueError("Niepoprawna odpowiedź JSON")
+                stack.pop()
+                if ch == "}" and stack == ["["] and release is not None:
+                    yield release
+                    release = None
+                elif ch == "}" and len(stack) == 3 and stack[2] == "A":
+                    if asset_start is not None and asset_ok:
+                        asset = json.loads(self._buf[asset_start:i + 1])
+                        release["assets"].append(dict((k, asset[k]) for k in _ASSET_FIELDS if k in asset))
+                    asset_start = None
+                # A nested value just ended; the next string is a key again.
+                key = None
+                if not stack:
+                    return
+
+
+def iter_releases(fileobj):
+    """Iterate slim release records from a (decompressed) releases response."""
+    return iter(_JsonReleaseStream(fileobj))
+
+
+class RateLimited(IOError):
+    def __init__(self, until):
+        IOError.__init__(self, "GitHub API rate limit until %s" % time.strftime("%H:%M", time.localtime(until)))
+        self.until = until
+
+
+def _rate_limit_until(headers):
+    """Epoch seconds until which GitHub asked us not to call the API again, or 0."""
+    now = time.time()
+    try:
+        retry_after = int((headers or {}).get("Retry-After") or 0)
+    except Exception:
+        retry_after = 0
+    if retry_after > 0:
+        return int(now + retry_after)
+    try:
+        remaining = int((headers or {}).get("X-RateLimit-Remaining"))
+    except Exception:
+        return 0
+    if remaining > 0:
+        return 0
+    try:
+        reset = int((headers or {}).get("X-RateLimit-Reset") or 0)
+    except Exception:
+        reset = 0
+    return reset if reset > now else int(now + 60)
+
+
+def fetch_releases(etag="", last_modified="", timeout=15, page=1):
+    """Conditional, gzip-compressed fetch of one page of the releases list.
+
+    Returns (releases, http) where releases is None when GitHub answered 304 Not
+    Modified. ``http`` carries the validators for the next request and the
+    rate-limit deadline announced by the server.
+    """
+    headers = {"Accept-Encoding": "gzip"}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    url = GITHUB_RELEASES_API
+    if page > 1:
+        url += ("&" if "?" in url else "?") + "page=%d" % page
+    try:
+        response = _open_https(url, timeout=timeout, headers=headers)
+    except HTTPError as e:
+        if e.code == 304:
+            return None, {"etag": etag, "last_modified": last_modified,
+                          "rate_limited_until": _rate_limit_until(e.headers)}
+        until = _rate_limit_until(e.headers)
+        if until and e.code in (403, 429):
+            raise RateLimited(until)
+        raise
+    try:
+        info = response.headers
+        reader = response
+        if (info.get("Content-Encoding") or "").lower() == "gzip":
+            reader = _GunzipReader(response)
+        releases = list(iter_releases(reader))
+    finally:
+        try:
+            response.close()
+        except Exception:
+            pass
+    return releases, {
+        "etag": info.get("ETag") or "",
+        "last_modified": info.get("Last-Modified") or "",
+        "rate_limited_until": _rate_limit_until(info),
+    }
+
+
+
 def parse_asset_name(name):
     m = ASSET_RE.match(name or "")
     if not m:
@@ -308,7 +628,11 @@ def _fallback_items(plugin_path):
 
 
 def _catalog_from_releases(releases):
-    by_variant = {}
+    return list(_merge_release_assets({}, releases).values())
+
+
+def _merge_release_assets(by_variant, releases):
+    """Fold release assets into a variant_key -> newest item map and return it."""
     for rel in releases or []:
         if not isinstance(rel, dict) or rel.get("draft"):
             continue
@@ -339,9 +663,39 @@ def _catalog_from_releases(releases):
             item = normalize_item(item)
             key = item["variant_key"]
             old = by_variant.get(key)
-            if old is None or _parse_iso(item["published_at"]) > _parse_iso(old.get("published_at")):
+            if old is None or _parse_iso(item["published_at"]) >= _parse_iso(old.get("published_at")):
                 by_variant[key] = item
-    return list(by_variant.values())
+    return by_variant
+
+
+def _newest_release(releases):
+    for rel in releases or []:
+        if isinstance(rel, dict) and not rel.get("draft"):
+            return str(rel.get("tag_name") or ""), str(rel.get("published_at") or rel.get("created_at") or "")
+    return "", ""
+
+
+def _releases_until_known(releases, meta, out):
+    """Append releases newer than the cached marker to out; True once it was reached.
+
+    The marker release itself is processed again because assets are uploaded
+    to a new release one by one and the previous refresh may have seen only
+    part of them.
+    """
+    known_tag = meta.get("newest_release_tag") or ""
+    known_published = _parse_iso(meta.get("newest_published_at") or "")
+    for rel in releases or []:
+        if not isinstance(rel, dict):
+            continue
+        tag = str(rel.get("tag_name") or "")
+        published = _parse_iso(str(rel.get("published_at") or rel.get("created_at") or ""))
+        if tag == known_tag:
+            out.append(rel)
+            return True
+        if known_published != datetime.datetime.min and published <= known_published:
+            return True
+        out.append(rel)
+    return False
 
 
 def newest_published(items):
@@ -353,13 +707,23 @@ def newest_published(items):
     return best
 
 
-def save_cache(items, source="github"):
-    _atomic_json_write(CACHE_FILE, {
+CACHE_META_KEYS = (
+    "etag", "last_modified", "rate_limited_until",
+    "newest_release_tag", "newest_published_at", "history_page",
+)
+
+
+def save_cache(items, source="github", extra=None, fetched_at=None):
+    data = {
         "schema": 2,
-        "fetched_at": _now_iso(),
+        "fetched_at": fetched_at or _now_iso(),
         "source": source,
         "items": items,
-    })
+    }
+    for key in CACHE_META_KEYS:
+        if (extra or {}).get(key):
+            data[key] = extra[key]
+    _atomic_json_write(CACHE_FILE, data)
 
 
 def load_cache():
@@ -379,6 +743,46 @@ def cache_is_fresh(meta):
     return (datetime.datetime.utcnow() - fetched).total_seconds() < CACHE_TTL
 
 
+def local_catalog(plugin_path):
+    """Return (items, status) from the cache or the bundled manifest without network.
+
+    Used to paint the main screen at once; ``status["stale"]`` tells whether a
+    background refresh against GitHub is due.
+    """
+    meta, cached = load_cache()
+    custom = _custom_items(plugin_path)
+    if cached:
+        return _merge_catalog(cached, custom), {
+            "online": False,
+            "cached": True,
+            "message": "cache",
+            "fetched_at": meta.get("fetched_at", ""),
+            "stale": not cache_is_fresh(meta),
+        }
+    return _merge_catalog(_fallback_items(plugin_path), custom), {
+        "online": False,
+        "cached": False,
+        "message": "fallback",
+        "fetched_at": "",
+        "stale": True,
+    }
+
+
+def catalog_diff(old_items, new_items):
+    """Return (added, updated) variant keys between two catalog snapshots."""
+    old = dict((x.get("variant_key"), x) for x in old_items or [])
+    added = []
+    updated = []
+    for item in new_items or []:
+        key = item.get("variant_key")
+        prev = old.get(key)
+        if prev is None:
+            added.append(key)
+        elif (prev.get("published_at"), prev.get("name")) != (item.get("published_at"), item.get("name")):
+            updated.append(key)
+    return added, updated
+
+
 def get_catalog(plugin_path, force=False):
     """Return (items, status_dict). Network failure falls back to cache / bundled manifest."""
     meta, cached = load_cache()
@@ -392,12 +796,47 @@ def get_catalog(plugin_path, force=False):
         }
 
     try:
-        releases = fetch_json(GITHUB_RELEASES_API, timeout=15)
-        online_items = _catalog_from_releases(releases)
+        if time.time() < float(meta.get("rate_limited_until") or 0):
+            raise RateLimited(float(meta["rate_limited_until"]))
+        # Validators are only useful when we still hold the items they describe.
+        releases, http = fetch_releases(
+            meta.get("etag", "") if cached else "",
+            meta.get("last_modified", "") if cached else "",
+            timeout=15,
+        )
+        if releases is None:
+            # 304: the cached catalog is still current; only renew its timestamp.
+            save_cache(cached, meta.get("source") or "github", dict(meta, **http))
+            return _merge_catalog(cached, custom), {
+                "online": True,
+                "cached": True,
+                "message": "github 304",
+                "fetched_at": _now_iso(),
+            }
+        extra = dict(http)
+        extra["newest_release_tag"], extra["newest_published_at"] = _newest_release(releases)
+        if cached and meta.get("newest_release_tag"):
+            # Incremental refresh: only releases newer than the cached marker are
+            # parsed; further pages are requested only while every release is new.
+            fresh = []
+            reached = _releases_until_known(releases, meta, fresh)
+            page = 1
+            while not reached and page < MAX_INCREMENTAL_PAGES:
+                page += 1
+                more, _http = fetch_releases(timeout=15, page=page)
+                if not more:
+                    break
+                reached = _releases_until_known(more, meta, fresh)
+            by_variant = dict((x["variant_key"], x) for x in cached)
+            online_items = list(_merge_release_assets(by_variant, fresh).values())
+            extra["history_page"] = meta.get("history_page") or 1
+        else:
+            online_items = _catalog_from_releases(releases)
+            extra["history_page"] = 1
         if not online_items:
             raise ValueError("GitHub catalog is empty")
         merged_remote = _merge_catalog(online_items, [])
-        save_cache(merged_remote, "github")
+        save_cache(merged_remote, "github", extra)
         return _merge_catalog(merged_remote, custom), {
             "online": True,
             "cached": False,
@@ -405,6 +844,12 @@ def get_catalog(plugin_path, force=False):
             "fetched_at": _now_iso(),
         }
     except Exception as e:
+        if isinstance(e, RateLimited) and e.until != meta.get("rate_limited_until"):
+            try:
+                save_cache(cached, meta.get("source") or "github", dict(meta, rate_limited_until=e.until),
+                           fetched_at=meta.get("fetched_at") or "1970-01-01T00:00:00Z")
+            except Exception:
+                pass
         if cached:
             return _merge_catalog(cached, custom), {
                 "online": False,
@@ -421,6 +866,30 @@ def get_catalog(plugin_path, force=False):
         }
 
 
+def load_older_releases(plugin_path, timeout=15):
+    """Fetch the next page of release history into the cache.
+
+    Returns (items, status, added) where added counts variants that only exist
+    in older releases; newer packages of known variants are never replaced.
+    """
+    meta, cached = load_cache()
+    page = int(meta.get("history_page") or 1) + 1
+    releases, _http = fetch_releases(timeout=timeout, page=page)
+    by_variant = dict((x["variant_key"], x) for x in cached)
+    before = set(by_variant)
+    _merge_release_assets(by_variant, releases)
+    items = _merge_catalog(list(by_variant.values()), [])
+    if releases:
+        save_cache(items, meta.get("source") or "github", dict(meta, history_page=page),
+                   fetched_at=meta.get("fetched_at"))
+    return _merge_catalog(items, _custom_items(plugin_path)), {
+        "online": True,
+        "cached": True,
+        "message": "github page %d" % page,
+        "fetched_at": meta.get("fetched_at", ""),
+    }, len(set(by_variant) - before)
+
+
 def _merge_catalog(primary, extra):
     by_key = {}
     for item in list(primary or []) + list(extra or []):
@@ -438,6 +907,72 @@ def _merge_catalog(primary, extra):
     return items
 
 
+FILTER_KEYS = ("type", "scope", "canvas", "logotype", "background")
+
+
+class FilterIndex(object):
+    """Inverted index of a merged catalog over the filter keys and satellites.
+
+    Built once per catalog snapshot. Applying filters is a set intersection and
+    the filter screen can ask how many packages each option would leave.
+    """
+
+    def __init__(self, items):
+        self.items = list(items or [])
+        self.postings = dict((key, {}) for key in FILTER_KEYS)
+        self.satellites = {}
+        srp_full = set()
+        for idx, item in enumerate(self.items):
+            for key in FILTER_KEYS:
+                self.postings[key].setdefault(item.get(key), set()).add(idx)
+            if item.get("type") == "srp":
+                if (item.get("scope") or "").lower() == "full":
+                    srp_full.add(idx)
+                else:
+                    for sat in scope_satellites(item.get("scope")):
+                        self.satellites.setdefault(sat, set()).add(idx)
+        # A full SRP package can always be reduced to any concrete satellite.
+        for sat in self.satellites:
+            self.satellites[sat] |= srp_full
+        self.everything = set(range(len(self.items)))
+
+    def options(self, key):
+        """Sorted non-empty values present for a filter key ("satellite" included)."""
+        values = self.satellites if key == "satellite" else self.postings.get(key, {})
+        return sorted(str(v) for v in values if v)
+
+    def _posting(self, key, value):
+        if key == "satellite":
+            # A multi-satellite selection needs packages covering every position.
+            postings = [self.satellites.get(x, set()) for x in satellite_set(value)] or [set()]
+            return set.intersection(*postings)
+        return self.postings.get(key, {}).get(value, set())
+
+    def _match_set(self, filters, skip=None):
+        result = None
+        for key in FILTER_KEYS + ("satellite",):
+            value = (filters or {}).get(key, "*")
+            if key == skip or value == "*":
+                continue
+            posting = self._posting(key, value)
+            result = set(posting) if result is None else result & posting
+            if not result:
+                return set()
+        return self.everything if result is None else result
+
+    def match(self, filters):
+        """Items passing all filters, in catalog order."""
+        return [self.items[i] for i in sorted(self._match_set(filters))]
+
+    def counts(self, filters, key):
+        """Map option -> number of packages left when only ``key`` is changed to it."""
+        base = self._match_set(filters, skip=key)
+        out = {"*": len(base)}
+        for value in self.options(key):
+            out[value] = len(base & self._posting(key, value))
+        return out
+
+
 def load_state():
     default = {
         "schema": 2,
@@ -479,6 +1014,56 @@ def remote_plugin_version():
         return ""
 
 
+def iso_epoch(value):
+    """Seconds since the epoch for an ISO timestamp; 0 when missing or invalid."""
+    parsed = _parse_iso(value)
+    if parsed == datetime.datetime.min:
+        return 0
+    return calendar.timegm(parsed.timetuple())
+
+
+class CatalogView(object):
+    """Flags and counters of one catalog snapshot against one state, computed once.
+
+    Timestamps are parsed a single time into epochs. Rebuild the view whenever
+    the catalog or the state (installed packages, seen marker) changes; list
+    rows, details and the status line then only look values up.
+    """
+
+    def __init__(self, items, state):
+        self.items = list(items or [])
+        state = state or {}
+        installed = state.get("installed", {})
+        seen_raw = state.get("seen_published_at", "")
+        seen = iso_epoch(seen_raw)
+        epochs = [iso_epoch(x.get("published_at")) for x in self.items]
+        newest = max(epochs) if epochs else 0
+        self.flags = {}
+        self.new_count = 0
+        self.update_count = 0
+        for item, epoch in zip(self.items, epochs):
+            key = item.get("variant_key") or variant_key(item)
+            flags = []
+            inst = installed.get(key)
+            if inst:
+                if inst.get("name") == item.get("name"):
+                    flags.append("INSTALLED")
+                elif epoch > iso_epoch(inst.get("published_at")):
+                    flags.append("UPDATE")
+                    self.update_count += 1
+            if item.get("source") == "picons/picons":
+                if seen_raw and epoch > seen:
+                    flags.append("NEW")
+                    self.new_count += 1
+                elif not seen_raw and epoch == newest:
+                    flags.append("LATEST")
+                    self.new_count += 1
+            self.flags[key] = flags
+
+    def item_flags(self, item):
+        return self.flags.get(item.get("variant_key") or variant_key(item), [])
+
+
 def item_flags(item, state, newest=""):
     flags = []
     key = item.get("variant_key") or variant_key(item)
@@ -497,39 +1082,325 @@ def item_flags(item, state, newest=""):
     return flags
 
 
-def download_file(url, dest_path, progress=None, timeout=60, expected_digest=""):
-    response = _open_https(url, timeout=timeout)
-    hasher = hashlib.sha256()
-    try:
+def _sha256_hex(expected_digest):
+    digest = (expected_digest or "").strip().lower()
+    if digest.startswith("sha256:"):
+        digest = digest.split(":", 1)[1]
+    return digest if re.match(r"^[0-9a-f]{64}$", digest) else ""
+
+
+class DownloadStream(object):
+    """HTTPS download exposed as a readable file that hashes what passes through.
+
+    Consumers such as download_file() or the streaming installer read from it
+    like from a file; SHA256 and byte count are updated on the fly and progress is
+    reported roughly every 128 KB. When a Range request was answered with 206,
+    ``offset`` is the first byte served and ``hasher`` must already cover the
+    bytes before it.
+    """
+
+    def __init__(self, url, timeout=60, progress=None, headers=None, hasher=None):
+        self.response = _open_https(url, timeout=timeout, headers=headers)
+        info = self.response.headers
         try:
-            total = int(response.headers.get("Content-Length") or 0)
+            length = int(info.get("Content-Length") or 0)
         except Exception:
-            total = 0
-        done = 0
-        with open(dest_path, "wb") as f:
-            while True:
-                chunk = response.read(1024 * 128)
-                if not chunk:
-                    break
-                f.write(chunk)
-                hasher.update(chunk)
-                done += len(chunk)
-                if progress:
-                    progress(done, total)
-        digest = (expected_digest or "").strip().lower()
-        if digest.startswith("sha256:"):
-            digest = digest.split(":", 1)[1]
-        if digest and re.match(r"^[0-9a-f]{64}$", digest):
-            actual = hasher.hexdigest().lower()
+            length = 0
+        self.offset = 0
+        self.total = length
+        status = getattr(self.response, "status", None) or self.response.getcode()
+        self.partial = status == 206
+        if self.partial:
+            m = re.match(r"^bytes\s+(\d+)-(\d+)/(\d+|\*)", info.get("Content-Range") or "")
+            if not m:
+                self.close()
+                raise IOError("Nieprawidłowy nagłówek Content-Range")
+            self.offset = int(m.group(1))
+            self.total = int(m.group(3)) if m.group(3) != "*" else self.offset + length
+        self.etag = info.get("ETag") or ""
+        self.last_modified = info.get("Last-Modified") or ""
+        self.done = self.offset
+        self._reported = self.offset
+        self.hasher = hasher if (hasher is not None and self.offset) else hashlib.sha256()
+        self._progress = progress
+
+    def read(self, n=-1):
+        with perf.span("body"):
+            if n is None or n < 0:
+                data = self.response.read()
+            else:
+                data = self.response.read(n)
+        if data:
+            self.hasher.update(data)
+            self.done += len(data)
+        if self._progress and (not data or self.done - self._reported >= 1024 * 128):
+            self._reported = self.done
+            self._progress(self.done, self.total)
+        return data
+
+    def hexdigest(self):
+        return self.hasher.hexdigest().lower()
+
+    def verify(self, expected_digest):
+        digest = _sha256_hex(expected_digest)
+        if digest:
+            actual = self.hexdigest()
             if actual != digest:
-                try:
-                    os.unlink(dest_path)
-                except Exception:
-                    pass
                 raise IOError("SHA256 mismatch: expected %s, got %s" % (digest, actual))
-        return done
-    finally:
+
+    def close(self):
         try:
-            response.close()
+            self.response.close()
+        except Exception:
+            pass
+
+    def abort(self):
+        """close() from another thread; shutting the socket down wakes a blocked read."""
+        sock = getattr(getattr(getattr(self.response, "fp", None), "raw", None), "_sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+        self.close()
+
+
+def _drop_files(*paths):
+    for path in paths:
+        try:
+            os.unlink(path)
         except Exception:
             pass
+
+
+def _part_meta(meta_path, url, part_path):
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if isinstance(meta, dict) and meta.get("url") == url and os.path.exists(part_path):
+            return meta
+    except Exception:
+        pass
+    _drop_files(part_path, meta_path)
+    return {}
+
+
+def _hash_prefix(path, hasher):
+    done = 0
+    with perf.span("digest"), open(path, "rb") as f:
+        while True:
+            data = f.read(1024 * 256)
+            if not data:
+                break
+            hasher.update(data)
+            done += len(data)
+    return done
+
+
+SEGMENT_MIN_BYTES = 1024 * 1024
+
+
+def _pause(seconds, cancel=None):
+    if cancel is not None:
+        cancel.wait(seconds)
+    else:
+        time.sleep(seconds)
+
+
+def _download_segmented(url, part_path, segments, progress=None, timeout=60, attempts=3, cancel=None):
+    """Fetch byte ranges concurrently into a preallocated file.
+
+    Returns the file size, or 0 when the server does not honour ranges (or the
+    asset is too small to be worth splitting) so the caller can fall back to a
+    single stream. Each worker writes through its own handle at its offset and
+    resumes its own range after a dropped connection.
+    """
+    probe = DownloadStream(url, timeout=timeout, headers={"Range": "bytes=0-0"})
+    try:
+        total = probe.total if probe.partial else 0
+        validator = probe.etag or probe.last_modified
+    finally:
+        probe.close()
+    if total < SEGMENT_MIN_BYTES * 2:
+        return 0
+    segments = max(1, min(int(segments), total // SEGMENT_MIN_BYTES))
+    with open(part_path, "wb") as f:
+        f.truncate(total)
+    lock = threading.Lock()
+    state = {"done": 0, "reported": 0}
+    errors = []
+    step = total // segments
+    run = perf.current()
+
+    def fetch(start, end):
+        pos = start
+        for attempt in range(max(1, attempts)):
+            if attempt:
+                _pause(min(10.0, 2 ** (attempt - 1)), cancel)
+            if cancel is not None and cancel.is_set():
+                return
+            headers = {"Range": "bytes=%d-%d" % (pos, end)}
+            if validator:
+                headers["If-Range"] = validator
+            try:
+                stream = DownloadStream(url, timeout=timeout, headers=headers)
+                if cancel is not None:
+                    cancel.on_cancel(stream.abort)
+                try:
+                    if not stream.partial or stream.offset != pos:
+                        raise IOError("Serwer zwrócił nieoczekiwany zakres")
+                    with open(part_path, "r+b") as f:
+                        f.seek(pos)
+                        while pos <= end:
+                            if cancel is not None:
+                                cancel.check()
+                            chunk = stream.read(min(1024 * 128, end - pos + 1))
+                            if not chunk:
+                                break
+                            f.write(chunk)
+                            pos += len(chunk)
+                            with lock:
+                                state["done"] += len(chunk)
+                                if progress and state["done"] - state["reported"] >= 1024 * 128:
+                                    state["reported"] = state["done"]
+                                    progress(state["done"], total)
+                finally:
+                    stream.close()
+                if pos > end:
+                    return
+            except Exception as e:
+                errors.append(e)
+        errors.append(IOError("Segment %d-%d niepełny" % (start, end)))
+
+    def bound_fetch(start, end):
+        # Segment threads report their spans to the caller's run.
+        with perf.bind(run):
+            fetch(start, end)
+
+    workers = []
+    for i in range(segments):
+        start = i * step
+        end = total - 1 if i == segments - 1 else start + step - 1
+        t = threading.Thread(target=bound_fetch, args=(start, end))
+        t.daemon = True
+        t.start()
+        workers.append(t)
+    for t in workers:
+        t.join()
+    if state["done"] != total:
+        raise errors[-1] if errors else IOError("Pobieranie segmentowe niepełne")
+    if progress:
+        progress(total, total)
+    return total
+
+
+def _download_resumable(url, part_path, meta_path, progress=None, timeout=60, attempts=5, backoff=2.0,
+                        cancel=None):
+    """Single-stream download into part_path; returns (bytes, sha256 hasher)."""
+    meta = _part_meta(meta_path, url, part_path)
+    last_error = None
+    for attempt in range(max(1, attempts)):
+        if attempt:
+            _pause(min(30.0, backoff * (2 ** (attempt - 1))), cancel)
+        if cancel is not None:
+            cancel.check()
+        hasher = hashlib.sha256()
+        offset = _hash_prefix(part_path, hasher) if meta else 0
+        if offset and offset == int(meta.get("total") or 0):
+            return offset, hasher
+        headers = {}
+        if offset:
+            headers["Range"] = "bytes=%d-" % offset
+            validator = meta.get("etag") or meta.get("last_modified")
+            if validator:
+                headers["If-Range"] = validator
+        try:
+            stream = DownloadStream(url, timeout=timeout, progress=progress, headers=headers, hasher=hasher)
+        except HTTPError as e:
+            last_error = e
+            if e.code == 416:
+                _drop_files(part_path, meta_path)
+                meta = {}
+            elif e.code < 500 and e.code not in (408, 429):
+                raise
+            continue
+        except Exception as e:
+            last_error = e
+            continue
+        if cancel is not None:
+            # Aborting the response unblocks a read stuck for up to ``timeout``.
+            cancel.on_cancel(stream.abort)
+        try:
+            if stream.offset not in (0, offset):
+                _drop_files(part_path, meta_path)
+                meta = {}
+                raise IOError("Serwer zwrócił nieoczekiwany zakres")
+            # 200 instead of 206 means the range was ignored or the asset changed.
+            offset = stream.offset
+            meta = {"url": url, "etag": stream.etag, "last_modified": stream.last_modified, "total": stream.total}
+            _atomic_json_write(meta_path, meta)
+            with open(part_path, "r+b" if offset else "wb") as f:
+                f.seek(offset)
+                f.truncate()
+                while True:
+                    if cancel is not None:
+                        cancel.check()
+                    chunk = stream.read(1024 * 128)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            if cancel is not None:
+                cancel.check()
+            if stream.total and stream.done < stream.total:
+                raise IOError("Połączenie przerwane po %d z %d bajtów" % (stream.done, stream.total))
+            return stream.done, stream.hasher
+        except Exception as e:
+            last_error = e
+        finally:
+            stream.close()
+    if cancel is not None:
+        cancel.check()
+    raise last_error or IOError("Pobieranie nie powiodło się")
+
+
+def download_file(url, dest_path, progress=None, timeout=60, expected_digest="", attempts=5, backoff=2.0, segments=1,
+                  cancel=None):
+    """Download url to dest_path, resuming interrupted transfers.
+
+    Data goes to ``dest_path + ".part"`` and a JSON sidecar keeps URL, ETag,
+    Last-Modified and total size. Dropped connections are retried with
+    exponential backoff inside this call, and a later call continues the same
+    .part file, both with Range/If-Range. hashlib cannot persist its internal
+    state, so the partial SHA256 is rebuilt from the local .part file on resume.
+
+    With ``segments`` > 1 a fresh download is first tried as that many parallel
+    range requests; servers without range support get the single stream.
+    ``cancel`` (jobs.CancelToken) stops the transfer between chunks and
+    retries; the .part file is kept for a later resume.
+    """
+    part_path = dest_path + ".part"
+    meta_path = part_path + ".json"
+    done, hasher = 0, None
+    if segments > 1 and not _part_meta(meta_path, url, part_path):
+        try:
+            done = _download_segmented(url, part_path, segments, progress=progress, timeout=timeout, cancel=cancel)
+        except Exception:
+            done = 0
+        if done:
+            hasher = hashlib.sha256()
+            _hash_prefix(part_path, hasher)
+        else:
+            _drop_files(part_path)
+    if hasher is None:
+        done, hasher = _download_resumable(url, part_path, meta_path, progress=progress, timeout=timeout,
+                                           attempts=attempts, backoff=backoff, cancel=cancel)
+
+    digest = _sha256_hex(expected_digest)
+    if digest:
+        actual = hasher.hexdigest().lower()
+        if actual != digest:
+            _drop_files(part_path, meta_path)
+            raise IOError("SHA256 mismatch: expected %s, got %s" % (digest, actual))
+    os.rename(part_path, dest_path)
+    _drop_files(meta_path)
+    return done
@@ -57,7 +57,7 @@ python3 - "$TMP_ZIP" "$TMP_EXTRACT" <<'PY'
 import os, sys, zipfile
 archive, out = sys.argv[1], sys.argv[2]
 root = "PiconUpdater-main/"
-required = {"plugin.py", "ui.py", "catalog.py", "storage.py", "version", "installer.sh"}
+required = {"plugin.py", "ui.py", "catalog.py", "storage.py", "jobs.py", "perf.py", "version", "installer.sh"}
 seen = set()
 with zipfile.ZipFile(archive, "r") as zf:
     for info in zf.infolist():
@@ -85,7 +85,7 @@ missing = required - seen
 if missing:
     raise SystemExit("missing required files: %s" % ", ".join(sorted(missing)))
 # Validate syntax without compileall/py_compile – some stripped images do not ship them.
-for name in ("__init__.py", "plugin.py", "ui.py", "catalog.py", "storage.py"):
+for name in ("__init__.py", "plugin.py", "ui.py", "catalog.py", "storage.py", "jobs.py", "perf.py"):
     path = os.path.join(out, name)
     if os.path.exists(path):
         with open(path, "rb") as f:
@@ -95,7 +95,7 @@ PY
 
 say "Przygotowanie nowej wersji..."
 mkdir -p "$STAGE"
-for name in __init__.py plugin.py ui.py catalog.py storage.py version icon.png catalog_fallback.json custom_sources.json LICENSE changelog README.md THIRD_PARTY.md installer.sh; do
+for name in __init__.py plugin.py ui.py catalog.py storage.py jobs.py perf.py version icon.png catalog_fallback.json custom_sources.json LICENSE changelog README.md THIRD_PARTY.md installer.sh; do
     if [ -e "$TMP_EXTRACT/$name" ]; then
         cp -a "$TMP_EXTRACT/$name" "$STAGE/"
     fi
@@ -106,7 +106,7 @@ for name in assets previews_local; do
     fi
 done
 
-for required in plugin.py ui.py catalog.py storage.py version; do
+for required in plugin.py ui.py catalog.py storage.py jobs.py perf.py version; do
     [ -f "$STAGE/$required" ] || { say "BŁĄD: brak $required w stagingu."; exit 1; }
 done
 chmod 755 "$STAGE" 2>/dev/null || true
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import json
+import os
+import threading
+import time
+
+JOB_KINDS = ("refresh", "download", "install", "clear")
+DOWNLOAD_LOCK = "download"
+PHASES = ("download", "validate", "clear", "install")
+PROGRESS_LOG = "/tmp/piconupdater-progress.jsonl"
+PROGRESS_LOG_LIMIT = 256 * 1024
+
+
+class Cancelled(Exception):
+    """Raised inside a job once its CancelToken was set."""
+
+
+class CancelToken(object):
+    """Cancellation flag handed to the work function of a job.
+
+    Loops call check() between units of work; blocking work registers a
+    callback with on_cancel() (for example terminating the install worker).
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled()
+
+    def wait(self, seconds):
+        """Sleep up to seconds, waking early on cancel; True when cancelled."""
+        self._event.wait(seconds)
+        return self._event.is_set()
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
+def target_locks(target):
+    """Lock keys of one target dict or a list of them: their real paths."""
+    targets = target if isinstance(target, list) else [target]
+    return [os.path.realpath(t.get("path") or "/") for t in targets if t]
+
+
+class Job(object):
+    """One unit of background work of a known kind.
+
+    ``work(token)`` runs on a worker thread; ``locks`` are keys (target paths,
+    DOWNLOAD_LOCK) no other running job may hold at the same time.
+    """
+
+    def __init__(self, kind, work, locks=(), label=""):
+        if kind not in JOB_KINDS:
+            raise ValueError("Nieznany typ zadania: %s" % kind)
+        self.kind = kind
+        self.work = work
+        self.locks = frozenset(locks)
+        self.label = label
+        self.token = CancelToken()
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.finished = threading.Event()
+
+    def cancel(self):
+        self.token.cancel()
+
+
+class JobManager(object):
+    """FIFO queue of jobs, each started on its own thread once its locks are free.
+
+    A queued job never overtakes an earlier one that wants any of its locks, so
+    installs to one target run in submission order while a refresh or an
+    install elsewhere proceeds at the same time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._running = []
+
+    def submit(self, kind, work, locks=(), label=""):
+        job = Job(kind, work, locks, label)
+        with self._lock:
+            self._pending.append(job)
+            started = self._dispatch()
+        self._start(started)
+        return job
+
+    def active(self, kinds=None):
+        """Queued and running jobs, optionally only of the given kinds."""
+        with self._lock:
+            jobs = self._running + self._pending
+        return [j for j in jobs if kinds is None or j.kind in kinds]
+
+    def cancel_all(self, kinds=None):
+        for job in self.active(kinds):
+            job.cancel()
+        with self._lock:
+            started = self._dispatch()
+        self._start(started)
+
+    def _dispatch(self):
+        """Move startable jobs from pending to running; the caller holds the lock."""
+        held = set()
+        for job in self._running:
+            held |= job.locks
+        started = []
+        for job in list(self._pending):
+            if job.token.is_set():
+                self._pending.remove(job)
+                job.state = "cancelled"
+                job.finished.set()
+                continue
+            blocked = bool(job.locks & held)
+            # Waiting jobs reserve their locks too, which keeps the order per lock.
+            held |= job.locks
+            if blocked:
+                continue
+            self._pending.remove(job)
+            self._running.append(job)
+            job.state = "running"
+            started.append(job)
+        return started
+
+    def _start(self, jobs):
+        for job in jobs:
+            t = threading.Thread(target=self._run, args=(job,))
+            t.daemon = True
+            t.start()
+
+    def _run(self, job):
+        try:
+            job.token.check()
+            job.result = job.work(job.token)
+            job.state = "done"
+        except Cancelled:
+            job.state = "cancelled"
+        except Exception as e:
+            job.error = e
+            job.state = "failed"
+        finally:
+            with self._lock:
+                self._running.remove(job)
+                started = self._dispatch()
+            job.finished.set()
+            self._start(started)
+
+
+class ProgressReporter(object):
+    """Coalesces byte and member progress of one job into snapshots.
+
+    Callbacks may fire for every chunk or member; ``sink(snapshot)`` is called
+    at most every ``interval`` seconds, plus on phase changes and when a phase
+    completes. A snapshot is a dict with the phase, bytes and members done and
+    expected, instantaneous and average throughput of both and an ETA in
+    seconds (None while unknown). Every snapshot is also appended to ``log``
+    as one JSON line.
+    """
+
+    def __init__(self, sink=None, interval=0.5, log=PROGRESS_LOG, label="", clock=time.time):
+        self.sink = sink
+        self.interval = interval
+        self.log = log
+        self.label = label
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.phase_name = ""
+        self._reset()
+
+    def _reset(self):
+        now = self.clock()
+        self.values = {"bytes": 0, "bytes_total": 0, "members": 0, "members_total": 0}
+        self._started = now
+        self._emitted = None
+        self._last = (now, 0, 0)
+
+    def phase(self, name, bytes_total=0, members_total=0):
+        """Start phase name (one of PHASES); the previous one is closed first."""
+        if name not in PHASES:
+            raise ValueError("Nieznana faza: %s" % name)
+        with self._lock:
+            if name == self.phase_name:
+                return
+            if self.phase_name:
+                self._emit(self._snapshot(done=True))
+            self.phase_name = name
+            self._reset()
+            self.values["bytes_total"] = int(bytes_total or 0)
+            self.values["members_total"] = int(members_total or 0)
+            self._emit(self._snapshot())
+
+    def update(self, bytes_done=None, bytes_total=None, members=None, members_total=None):
+        with self._lock:
+            if not self.phase_name:
+                return
+            for key, value in (("bytes", bytes_done), ("bytes_total", bytes_total),
+                               ("members", members), ("members_total", members_total)):
+                if value is not None:
+                    self.values[key] = int(value)
+            v = self.values
+            complete = (v["bytes_total"] and v["bytes"] >= v["bytes_total"]) or \
+                (not v["bytes_total"] and v["members_total"] and v["members"] >= v["members_total"])
+            if complete or self._emitted is None or self.clock() - self._emitted >= self.interval:
+                self._emit(self._snapshot())
+
+    def bytes_callback(self, phase):
+        """progress(done, total) callback counting bytes of phase."""
+        def progress(done, total):
+            self.phase(phase)
+            self.update(bytes_done=done, bytes_total=total or None)
+        return progress
+
+    def members_callback(self, phase):
+        """progress(done, total) callback counting members (files) of phase."""
+        def progress(done, total):
+            self.phase(phase)
+            self.update(members=done, members_total=total or None)
+        return progress
+
+    def finish(self):
+        with self._lock:
+            if self.phase_name:
+                self._emit(self._snapshot(done=True))
+            self.phase_name = ""
+
+    def _snapshot(self, done=False):
+        now = self.clock()
+        v = self.values
+        elapsed = max(now - self._started, 1e-6)
+        last_t, last_bytes, last_members = self._last
+        span = now - last_t
+        snap = dict(v)
+        snap.update({
+            "phase": self.phase_name,
+            "label": self.label,
+            "done": bool(done),
+            "elapsed": round(elapsed, 3),
+            "rate": (v["bytes"] - last_bytes) / span if span > 0 else 0.0,
+            "avg_rate": v["bytes"] / elapsed,
+            "member_rate": (v["members"] - last_members) / span if span > 0 else 0.0,
+            "avg_member_rate": v["members"] / elapsed,
+        })
+        # Bytes give the steadier estimate; members only when no size is known.
+        if v["bytes_total"] and v["bytes"]:
+            snap["fraction"] = min(1.0, float(v["bytes"]) / v["bytes_total"])
+            remaining = max(0, v["bytes_total"] - v["bytes"])
+            snap["eta"] = remaining / snap["avg_rate"]
+        elif v["members_total"] and v["members"]:
+            snap["fraction"] = min(1.0, float(v["members"]) / v["members_total"])
+            remaining = max(0, v["members_total"] - v["members"])
+            snap["eta"] = remaining / snap["avg_member_rate"]
+        else:
+            snap["fraction"] = None
+            snap["eta"] = None
+        self._last = (now, v["bytes"], v["members"])
+        return snap
+
+    def _emit(self, snap):
+        self._emitted = self.clock()
+        if self.log:
+            self._write_log(snap)
+        if self.sink is not None:
+            self.sink(snap)
+
+    def _write_log(self, snap):
+        try:
+            mode = "a"
+            if os.path.getsize(self.log) > PROGRESS_LOG_LIMIT:
+                mode = "w"
+        except OSError:
+            pass
+        try:
+            line = dict(snap)
+            line["ts"] = round(self.clock(), 3)
+            with open(self.log, mode) as f:
+                f.write(json.dumps(line, sort_keys=True) + "\n")
+        except (IOError, OSError):
+            pass
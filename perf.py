@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+PERF_HISTORY = "/etc/enigma2/piconupdater_perf.jsonl"
+PERF_HISTORY_LIMIT = 64 * 1024
+SPANS = ("connect", "ttfb", "body", "digest", "ar", "index", "clear", "write", "links")
+
+_local = threading.local()
+
+
+class PerfRun(object):
+    """Timed spans of one install, summed per name.
+
+    Code in catalog and storage wraps its phases in span(); the spans go to
+    the run bound to the current thread with bind() and cost nothing when
+    no run is bound. Spans of parallel threads add up, so their sum can
+    exceed the wall time of the run. The wall clock starts with the first
+    start() call, so time spent queued behind other jobs is not counted.
+    """
+
+    def __init__(self, label=""):
+        self.label = label
+        self.started = None
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.started is None:
+                self.started = time.time()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + max(0.0, seconds)
+
+    def merge(self, spans):
+        for name, seconds in (spans or {}).items():
+            self.add(name, float(seconds))
+
+    def record(self, files=0, package_bytes=0, target="", version="", status="ok"):
+        """History entry of the finished run."""
+        self.start()
+        wall = max(time.time() - self.started, 1e-6)
+        return {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "version": version,
+            "label": self.label,
+            "status": status,
+            "box": box_model(),
+            "fs": fs_type(target) if target else "",
+            "target": target,
+            "package_bytes": int(package_bytes or 0),
+            "files": int(files or 0),
+            "seconds": round(wall, 3),
+            "files_per_s": round(files / wall, 1),
+            "mb_per_s": round(package_bytes / wall / (1024.0 * 1024.0), 3),
+            "spans": dict((k, round(v, 3)) for k, v in sorted(self.spans.items())),
+        }
+
+
+def current():
+    return getattr(_local, "run", None)
+
+
+@contextlib.contextmanager
+def bind(run):
+    """Send spans of this thread to run (None stops recording)."""
+    previous = current()
+    _local.run = run
+    try:
+        yield run
+    finally:
+        _local.run = previous
+
+
+def add(name, seconds):
+    run = current()
+    if run is not None:
+        run.add(name, seconds)
+
+
+@contextlib.contextmanager
+def span(name):
+    """Time the block as span name; a nested span of the same name is not counted twice."""
+    run = current()
+    open_spans = _local.__dict__.setdefault("open", set())
+    if run is None or name in open_spans:
+        yield
+        return
+    open_spans.add(name)
+    started = time.time()
+    try:
+        yield
+    finally:
+        open_spans.discard(name)
+        run.add(name, time.time() - started)
+
+
+def timed(name):
+    """Decorator running the whole function as span name."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def box_model():
+    for path in ("/proc/stb/info/vumodel", "/proc/stb/info/boxtype", "/proc/stb/info/model", "/etc/hostname"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except (IOError, OSError):
+            continue
+        if value:
+            return value
+    return ""
+
+
+def fs_type(path):
+    """Filesystem type of the mount holding path, from /proc/mounts."""
+    path = os.path.realpath(path or "/")
+    best, kind = "", ""
+    try:
+        with open("/proc/mounts") as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return ""
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        mount = fields[1].replace("\\040", " ")
+        inside = path == mount or path.startswith(mount.rstrip("/") + "/")
+        if inside and len(mount) >= len(best):
+            best, kind = mount, fields[2]
+    return kind
+
+
+def append_history(record, path=PERF_HISTORY):
+    """Append record; a file over PERF_HISTORY_LIMIT is rotated to path.1 first."""
+    try:
+        if os.path.getsize(path) > PERF_HISTORY_LIMIT:
+            os.rename(path, path + ".1")
+    except OSError:
+        pass
+    try:
+        with open(path, "a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+    except (IOError, OSError):
+        pass
+
+
+def load_history(limit=20, path=PERF_HISTORY):
+    """Last limit records, oldest first, including the rotated file."""
+    records = []
+    for name in (path + ".1", path):
+        try:
+            with open(name) as f:
+                lines = f.read().splitlines()
+        except (IOError, OSError):
+            continue
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict):
+                records.append(record)
+    return records[-limit:] if limit else records
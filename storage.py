@@ -1,16 +1,35 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
+import contextlib
+import hashlib
+import io
+import json
 import os
 import posixpath
 import shutil
+import stat
+import subprocess
+import sys
 import tarfile
 import tempfile
+import threading
+import time
+import zlib
 
 try:
-    from .catalog import satellite_orbital
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+try:
+    from .catalog import satellite_orbital, satellite_set, DownloadStream, _sha256_hex, _atomic_json_write
+    from .jobs import Cancelled, target_locks
+    from . import perf
 except ImportError:
-    from catalog import satellite_orbital
+    from catalog import satellite_orbital, satellite_set, DownloadStream, _sha256_hex, _atomic_json_write
+    from jobs import Cancelled, target_locks
+    import perf
 
 FLASH_PICON = "/usr/share/enigma2/picon"
 
@@ -91,19 +110,24 @@ def free_space(path):
 
 
 def _copy_stream(src, dst, chunk=1024 * 256):
+    """Copy src to dst and return the CRC32 of the written data."""
     parent = os.path.dirname(dst)
     if parent and not os.path.isdir(parent):
         os.makedirs(parent)
+    crc = 0
     with open(dst, "wb") as f:
         while True:
             data = src.read(chunk)
             if not data:
                 break
+            crc = zlib.crc32(data, crc)
             f.write(data)
+    return crc & 0xffffffff
 
 
-def _extract_data_tar_from_ar(ipk_path, tmp_dir):
-    out_path = None
+@perf.timed("ar")
+def _ar_data_member(ipk_path):
+    """Return (name, offset, size) of the data.tar.* member inside an IPK/ar file."""
     with open(ipk_path, "rb") as f:
         if f.read(8) != b"!<arch>\n":
             raise ValueError("Nieprawidłowy format IPK/ar")
@@ -120,24 +144,69 @@ def _extract_data_tar_from_ar(ipk_path, tmp_dir):
             except Exception:
                 raise ValueError("Nieprawidłowy rozmiar elementu ar")
             if name.startswith("data.tar"):
-                out_path = os.path.join(tmp_dir, os.path.basename(name))
-                remaining = size
-                with open(out_path, "wb") as out:
-                    while remaining > 0:
-                        data = f.read(min(1024 * 256, remaining))
-                        if not data:
-                            raise IOError("Nieoczekiwany koniec IPK")
-                        out.write(data)
-                        remaining -= len(data)
-            else:
-                f.seek(size, 1)
+                offset = f.tell()
+                f.seek(0, 2)
+                if f.tell() < offset + size:
+                    raise IOError("Nieoczekiwany koniec IPK")
+                return name, offset, size
+            f.seek(size, 1)
             if size % 2:
                 f.seek(1, 1)
-            if out_path:
-                return out_path
     raise ValueError("Brak data.tar.* w IPK")
 
 
+class _BoundedReader(object):
+    """Read-only, seekable view of the byte range [offset, offset + size) of a file.
+
+    tarfile reads data.tar.* straight from the downloaded .ipk through this view, so
+    no copy of the payload is written to the RAM-backed /tmp.
+    """
+
+    def __init__(self, fileobj, offset, size, name=None):
+        self._f = fileobj
+        self._start = offset
+        self._size = size
+        self._pos = 0
+        self.name = name or getattr(fileobj, "name", None)
+        self.closed = False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self._pos
+        elif whence == 2:
+            pos += self._size
+        if pos < 0:
+            raise IOError("Nieprawidłowa pozycja w IPK")
+        self._pos = pos
+        return self._pos
+
+    def read(self, n=-1):
+        remaining = self._size - self._pos
+        if remaining <= 0:
+            return b""
+        if n is None or n < 0 or n > remaining:
+            n = remaining
+        self._f.seek(self._start + self._pos)
+        data = self._f.read(n)
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        self.closed = True
+
+
 def _safe_archive_name(name):
     name = (name or "").replace("\\", "/")
     while name.startswith("./"):
@@ -208,43 +277,297 @@ def _srp_orbital_from_rel(rel):
         return None
 
 
-def _filtered_srp_members(tf, satellite):
-    """Select only service-reference aliases belonging to one orbital position.
+def _package_kind(package_path, item):
+    fmt = ((item or {}).get("format") or "ipk").lower()
+    if fmt == "ipk" or package_path.lower().endswith(".ipk"):
+        return "ipk"
+    if fmt in ("tar.xz", "txz") or package_path.lower().endswith(".tar.xz"):
+        return "tar"
+    raise ValueError("Nieobsługiwany format: %s" % fmt)
+
+
+class _IndexEntry(object):
+    __slots__ = ("name", "rel", "kind", "size", "link")
+
+    def __init__(self, name, rel, kind, size, link):
+        self.name = name
+        self.rel = rel
+        self.kind = kind
+        self.size = size
+        self.link = link
+
+    def isfile(self):
+        return self.kind == "file"
+
+
+class ArchiveIndex(object):
+    """Member table of one downloaded package, built in a single metadata pass.
 
-    Official picons packages contain a large shared logos/ tree plus aliases. When a
-    concrete satellite is selected we deliberately do not install the shared logos/
-    tree. Instead we dereference only matching aliases, which avoids installing
-    thousands of unrelated files.
+    validate_package(), estimate_install_bytes() and install_package() accept the
+    same index, so the (usually xz) payload is decompressed once for metadata and
+    once more only when the files are actually written.
     """
-    wanted = satellite_orbital(satellite)
-    if wanted is None:
-        return []
-    out = []
-    for member in tf.getmembers():
+
+    def __init__(self, package_path, item, scan=True):
+        self.package_path = package_path
+        self.kind = _package_kind(package_path, item)
+        self.data_offset = 0
+        self.data_size = 0
+        self.entries = []         # installable PNG files/links in archive order
+        self.by_name = {}         # clean archive name -> entry (also non-PNG link targets)
+        self.sources = {}         # link archive name -> final regular-file entry
+        self.orbital_counts = {}  # SRP orbital position -> number of aliases
+        self.orbital_bytes = {}   # SRP orbital position -> dereferenced alias bytes
+        self.orbital_sources = {}  # SRP orbital position -> names of the logos its aliases use
+        self.file_bytes = 0       # regular PNG payload
+        self.link_bytes = 0       # extra payload when links must be dereferenced
+        if scan:
+            if self.kind == "ipk":
+                _name, self.data_offset, self.data_size = _ar_data_member(package_path)
+            with perf.span("index"), self.open_tar() as tf:
+                for member in tf:
+                    self.add_member(member)
+            self.finish()
+
+    @contextlib.contextmanager
+    def open_tar(self):
+        if self.kind != "ipk":
+            with tarfile.open(self.package_path, "r:*") as tf:
+                yield tf
+            return
+        with open(self.package_path, "rb") as raw:
+            view = _BoundedReader(raw, self.data_offset, self.data_size)
+            with tarfile.open(fileobj=view, mode="r:*") as tf:
+                yield tf
+
+    def add_member(self, member):
+        """Record one tar member; returns its entry or None for skipped members."""
+        if member.isfile():
+            kind, link = "file", None
+        elif member.issym():
+            kind, link = "sym", _resolved_link_archive_name(member)
+        elif member.islnk():
+            kind, link = "hard", _resolved_link_archive_name(member)
+        else:
+            return None
+        name = _safe_archive_name(member.name)
+        if not name:
+            return None
         rel = _picon_relative_path(member.name)
-        if not rel or not rel.lower().endswith(".png"):
-            continue
-        if rel.lower().startswith("logos/"):
-            continue
-        if not (member.isfile() or member.issym() or member.islnk()):
-            continue
-        if _srp_orbital_from_rel(rel) == wanted:
-            out.append((member, rel))
-    return out
+        if rel and not rel.lower().endswith(".png"):
+            rel = None
+        entry = _IndexEntry(name, rel, kind, int(member.size or 0), link)
+        self.by_name[name] = entry
+        if rel:
+            self.entries.append(entry)
+        return entry
+
+    def finish(self):
+        """Resolve link sources and per-orbital totals once all members are known."""
+        for entry in self.entries:
+            source = entry if entry.isfile() else self._resolve(entry)
+            if source is not entry and source is not None:
+                self.sources[entry.name] = source
+            size = source.size if source is not None else 0
+            if entry.isfile():
+                self.file_bytes += size
+            else:
+                self.link_bytes += size
+            if entry.rel.lower().startswith("logos/"):
+                continue
+            orbital = _srp_orbital_from_rel(entry.rel)
+            if orbital is not None:
+                self.orbital_counts[orbital] = self.orbital_counts.get(orbital, 0) + 1
+                self.orbital_bytes[orbital] = self.orbital_bytes.get(orbital, 0) + size
+                if source is not None:
+                    self.orbital_sources.setdefault(orbital, set()).add(source.name)
+
+    def _resolve(self, entry):
+        """Follow symlink/hardlink chains to the regular file holding the payload."""
+        seen = set()
+        while entry is not None and not entry.isfile():
+            if entry.name in seen:
+                return None
+            seen.add(entry.name)
+            entry = self.by_name.get(entry.link or "")
+        return entry
+
+    def source_of(self, entry):
+        return entry if entry.isfile() else self.sources.get(entry.name)
+
+    def selected(self, satellite="*"):
+        """Entries installed for the requested mode.
+
+        Official picons packages contain a large shared logos/ tree plus aliases. When
+        a concrete satellite is selected we deliberately do not install the shared
+        logos/ tree. Instead we dereference only matching aliases, which avoids
+        installing thousands of unrelated files.
+        """
+        wanted = _wanted_orbitals(satellite)
+        if wanted is None:
+            return list(self.entries)
+        return [e for e in self.entries if _is_satellite_alias(e, wanted)]
+
+
+def _wanted_orbitals(satellite):
+    """Orbital positions of a satellite selection (one or several), None for "*"."""
+    tokens = satellite_set(satellite)
+    if not tokens:
+        return None
+    return set(o for o in (satellite_orbital(t) for t in tokens) if o is not None)
+
+
+def _is_satellite_alias(entry, wanted):
+    rel = entry.rel or ""
+    return bool(rel) and not rel.lower().startswith("logos/") and _srp_orbital_from_rel(rel) in wanted
+
+
+def _orbital_counts(manifest, satellite):
+    """Installed aliases per selected satellite, from what the manifest recorded."""
+    tokens = dict((satellite_orbital(t), t) for t in satellite_set(satellite))
+    tokens.pop(None, None)
+    counts = dict((t, 0) for t in tokens.values())
+    for rel in manifest.records:
+        token = tokens.get(_srp_orbital_from_rel(rel))
+        if token is not None:
+            counts[token] += 1
+    return counts
+
+
+def build_archive_index(package_path, item):
+    return ArchiveIndex(package_path, item)
+
+
+def _satellite_mode(item):
+    satellite = ((item or {}).get("selected_satellite") or "*").lower()
+    ptype = ((item or {}).get("type") or "").lower()
+    return satellite if (ptype == "srp" and satellite != "*") else "*"
+
+
+_LINK_CACHE_MEMORY = 4 * 1024 * 1024
+
+
+class _LinkResolver(object):
+    """Payload cache used to dereference tar links during one forward pass.
+
+    Seeking back to a link target in an xz stream restarts decompression from the
+    beginning, which made alias-heavy installs quadratic. Instead every needed link
+    target is read once when the stream passes it and kept here until the last alias
+    using it has been written. Payloads live in memory up to ``memory_limit`` bytes;
+    anything beyond that is appended to a scratch file in ``scratch_dir``.
+    """
+
+    def __init__(self, scratch_dir, memory_limit=_LINK_CACHE_MEMORY):
+        self._scratch_dir = scratch_dir
+        self._limit = memory_limit
+        self._used = 0
+        self._memory = {}
+        self._spilled = {}
+        self._refs = {}
+        self._scratch = None
+        self._scratch_path = None
+
+    def __contains__(self, name):
+        return name in self._memory or name in self._spilled
+
+    def add(self, name, src, size, refs=1, spill=True):
+        """Cache the payload of name; False when it fits in memory only and does not."""
+        if name in self:
+            self._refs[name] = self._refs.get(name, 0) + refs
+            return True
+        if size <= self._limit - self._used:
+            self._refs[name] = refs
+            data = src.read()
+            self._memory[name] = data
+            self._used += len(data)
+            return True
+        if not spill:
+            return False
+        self._refs[name] = refs
+        if self._scratch is None:
+            fd, self._scratch_path = tempfile.mkstemp(prefix=".piconupdater-scratch-", dir=self._scratch_dir)
+            self._scratch = os.fdopen(fd, "w+b")
+        self._scratch.seek(0, 2)
+        offset = self._scratch.tell()
+        written = 0
+        while True:
+            data = src.read(1024 * 256)
+            if not data:
+                break
+            self._scratch.write(data)
+            written += len(data)
+        self._scratch.flush()
+        self._spilled[name] = (offset, written)
+        return True
+
+    def open(self, name):
+        """Readable view of a cached payload, or None."""
+        if name in self._memory:
+            return io.BytesIO(self._memory[name])
+        if name in self._spilled:
+            offset, size = self._spilled[name]
+            return _BoundedReader(self._scratch, offset, size)
+        return None
+
+    def copy_to(self, name, dst):
+        """Write a cached payload to dst; returns its CRC32 or None when not cached."""
+        src = self.open(name)
+        if src is None:
+            return None
+        _replace_path(dst)
+        return _copy_stream(src, dst)
+
+    def release(self, name):
+        refs = self._refs.get(name, 0) - 1
+        if refs > 0:
+            self._refs[name] = refs
+            return
+        self._refs.pop(name, None)
+        data = self._memory.pop(name, None)
+        if data is not None:
+            self._used -= len(data)
+        self._spilled.pop(name, None)
+
+    def retain(self, refs):
+        """Keep only the names in refs (name -> number of uses) and set their counts."""
+        for name in [n for n in list(self._memory) + list(self._spilled) if not refs.get(n)]:
+            self._refs[name] = 1
+            self.release(name)
+        for name, count in refs.items():
+            if name in self:
+                self._refs[name] = count
+
+    def close(self):
+        self._memory = {}
+        self._spilled = {}
+        self._used = 0
+        if self._scratch is not None:
+            try:
+                self._scratch.close()
+            except Exception:
+                pass
+            try:
+                os.unlink(self._scratch_path)
+            except Exception:
+                pass
+            self._scratch = None
+
 
+@perf.timed("write")
+def _copy_member(tf, member, dst):
+    """Copy the payload of the regular tar member the stream is positioned at.
 
-def _copy_member_dereferenced(tf, member, dst):
-    """Copy a regular file or an internal tar link as a plain PNG."""
+    Returns the CRC32 of the payload, or None when the member has no data.
+    """
     try:
         src = tf.extractfile(member)
     except Exception:
         src = None
     if src is None:
-        return False
+        return None
     _replace_path(dst)
     try:
-        _copy_stream(src, dst)
-        return True
+        return _copy_stream(src, dst)
     finally:
         try:
             src.close()
@@ -252,133 +575,493 @@ def _copy_member_dereferenced(tf, member, dst):
             pass
 
 
-def _install_srp_satellite(tar_path, target_path, satellite, progress=None):
-    count = 0
-    with tarfile.open(tar_path, "r:*") as tf:
-        members = _filtered_srp_members(tf, satellite)
-        total = len(members)
-        if total == 0:
-            raise ValueError("Brak piconów SRP dla wybranego satelity: %s" % satellite)
-        for idx, (member, rel) in enumerate(members):
-            # SRP aliases are stored in picon root. Preserve relative path if upstream
-            # ever nests them, but do not copy the shared logos/ directory.
-            dst = os.path.join(target_path, *rel.split("/"))
-            if _copy_member_dereferenced(tf, member, dst):
-                count += 1
-            if progress and (idx % 100 == 0):
-                progress(idx + 1, total)
-        if progress:
-            progress(total, total)
-    return count
+MANIFEST_NAME = ".piconupdater_manifest"
 
 
-def _estimate_srp_satellite(tar_path, satellite):
-    total = 0
-    with tarfile.open(tar_path, "r:*") as tf:
-        members = _filtered_srp_members(tf, satellite)
-        if not members:
-            return 0
-        by_name = {}
-        for m in tf.getmembers():
-            clean = _safe_archive_name(m.name)
-            if clean:
-                by_name[clean] = m
-        for member, _rel in members:
-            if member.isfile():
-                total += int(member.size or 0)
+class InstallManifest(object):
+    """Record of every picon an install wrote below its target directory.
+
+    Stored as ``.piconupdater_manifest`` in the target, one tab separated line
+    per entry so loading is a split per line even on slow receivers::
+
+        F <rel> <size> <mtime> <crc32>   regular file
+        L <rel> <link>                   symlink
+        H <rel> <source rel>             hardlink
+
+    Size and mtime tell whether a file still is what the plugin wrote, which
+    makes the recorded CRC32 usable for verification and delta updates.
+    """
+
+    HEADER = "piconupdater-manifest\t1"
+
+    def __init__(self, package=""):
+        self.package = package
+        self.records = {}
+
+    def add_file(self, rel, size, crc):
+        self.records[rel] = ["F", int(size), 0, int(crc)]
+
+    def add_link(self, rel, link):
+        self.records[rel] = ["L", link]
+
+    def add_hardlink(self, rel, source):
+        self.records[rel] = ["H", source]
+
+    def save(self, root):
+        lines = ["%s\t%s" % (self.HEADER, self.package.replace("\t", " ").replace("\n", " "))]
+        for rel in sorted(self.records):
+            record = self.records[rel]
+            if "\t" in rel or "\n" in rel:
                 continue
-            target_name = _resolved_link_archive_name(member)
-            target_member = by_name.get(target_name or "")
-            if target_member is not None:
-                total += int(target_member.size or 0)
-        # Direct copies need no logos/ tree and no filesystem link overhead.
-        return int(total * 1.08) + (512 * 1024)
+            if record[0] == "F":
+                try:
+                    record[2] = int(os.lstat(os.path.join(root, *rel.split("/"))).st_mtime)
+                except OSError:
+                    continue
+                lines.append("F\t%s\t%d\t%d\t%08x" % (rel, record[1], record[2], record[3]))
+            else:
+                lines.append("%s\t%s\t%s" % (record[0], rel, record[1]))
+        path = os.path.join(root, MANIFEST_NAME)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.rename(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, root):
+        """Return the manifest stored in root, or None when missing or unreadable."""
+        try:
+            with open(os.path.join(root, MANIFEST_NAME), "r") as f:
+                header = f.readline().rstrip("\n")
+                if not header.startswith(cls.HEADER):
+                    return None
+                manifest = cls(header[len(cls.HEADER) + 1:])
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if parts[0] == "F" and len(parts) == 5:
+                        manifest.records[parts[1]] = ["F", int(parts[2]), int(parts[3]), int(parts[4], 16)]
+                    elif parts[0] in ("L", "H") and len(parts) == 3:
+                        manifest.records[parts[1]] = [parts[0], parts[2]]
+                return manifest
+        except (IOError, OSError, ValueError):
+            return None
+
+
+_DELTA_COMPARE_LIMIT = 4 * 1024 * 1024
+
+
+def installed_snapshot(target_path):
+    """Map rel path -> ("file", size[, crc32]) or ("sym", link) for installed PNGs.
+
+    With a manifest only the files the plugin wrote are listed, and a recorded
+    CRC32 is kept where size and mtime show the file was not touched since.
+    Without one every PNG below target_path is scanned.
+    """
+    snapshot = {}
+    if not os.path.isdir(target_path):
+        return snapshot
+    manifest = InstallManifest.load(target_path)
+    if manifest is not None:
+        for rel, record in manifest.records.items():
+            try:
+                st = os.lstat(os.path.join(target_path, *rel.split("/")))
+            except OSError:
+                continue
+            if stat.S_ISLNK(st.st_mode):
+                snapshot[rel] = ("sym", os.readlink(os.path.join(target_path, *rel.split("/"))))
+            elif record[0] == "F" and record[1] == st.st_size and record[2] == int(st.st_mtime):
+                snapshot[rel] = ("file", st.st_size, record[3])
+            else:
+                snapshot[rel] = ("file", st.st_size)
+        return snapshot
+    for root, _dirs, files in os.walk(target_path):
+        for name in files:
+            if not name.lower().endswith(".png"):
+                continue
+            full = os.path.join(root, name)
+            rel = os.path.relpath(full, target_path).replace(os.sep, "/")
+            try:
+                st = os.lstat(full)
+                if stat.S_ISLNK(st.st_mode):
+                    snapshot[rel] = ("sym", os.readlink(full))
+                else:
+                    snapshot[rel] = ("file", st.st_size)
+            except OSError:
+                continue
+    return snapshot
+
+
+def _file_equals(path, data):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(data) + 1) == data
+    except (IOError, OSError):
+        return False
+
+
+@perf.timed("write")
+def _delta_write(dst, rel, size, open_src, existing, stats):
+    """Write a regular file unless the installed copy already has the same content.
+
+    Returns the CRC32 of the content, or None when there was nothing to write.
+    """
+    prev = existing.pop(rel, None) if existing is not None else None
+    src = open_src()
+    if src is None:
+        return None
+    if prev is not None and prev[0] == "file" and prev[1] == size and size <= _DELTA_COMPARE_LIMIT:
+        data = src.read()
+        crc = zlib.crc32(data) & 0xffffffff
+        # A CRC from the manifest spares reading the installed file back.
+        if (prev[2] == crc) if len(prev) > 2 else _file_equals(dst, data):
+            stats["unchanged"] += 1
+            return crc
+        src = io.BytesIO(data)
+    _replace_path(dst)
+    crc = _copy_stream(src, dst)
+    if existing is not None:
+        stats["changed" if prev is not None else "added"] += 1
+    return crc
+
+
+def _committed_crc(dst, size, open_src):
+    """CRC of a file written before the last checkpoint, or None when it must be rewritten.
+
+    The payload is still read from the archive (the stream has to pass it anyway),
+    but the flash is not written again.
+    """
+    try:
+        if os.path.islink(dst) or os.path.getsize(dst) != size:
+            return None
+    except OSError:
+        return None
+    src = open_src()
+    if src is None:
+        return None
+    crc = 0
+    while True:
+        chunk = src.read(1024 * 256)
+        if not chunk:
+            break
+        crc = zlib.crc32(chunk, crc)
+    return crc & 0xffffffff
+
+
+def _link_alias(first, dst):
+    """Hardlink dst to first, else symlink it; returns "hard", "sym" or None."""
+    parent = os.path.dirname(dst)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+    _replace_path(dst)
+    try:
+        os.link(first, dst)
+        return "hard"
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.relpath(first, parent), dst)
+        return "sym"
+    except OSError:
+        return None
+
+
+@perf.timed("links")
+def _share_alias(first, first_rel, dst, rel, existing, stats, manifest):
+    """Satellite mode: point another alias of a logo at the copy written for the first one.
+
+    False when no link could be made, so the caller writes a copy instead.
+    """
+    prev = existing.pop(rel, None) if existing is not None else None
+    try:
+        kind = ("sym" if os.path.islink(dst) else "hard") if prev is not None and os.path.samefile(first, dst) else None
+    except OSError:
+        kind = None
+    if kind is not None:
+        stats["unchanged"] += 1
+    else:
+        kind = _link_alias(first, dst)
+        if kind is None:
+            if prev is not None:
+                existing[rel] = prev
+            return False
+        if existing is not None:
+            stats["changed" if prev is not None else "added"] += 1
+    if manifest is not None:
+        if kind == "hard":
+            manifest.add_hardlink(rel, first_rel)
+        else:
+            manifest.add_link(rel, os.readlink(dst))
+    return True
+
+
+def _record_link(manifest, index, entry, root):
+    """Add the alias just created below root to the manifest as it ended up on disk."""
+    dst = os.path.join(root, *entry.rel.split("/"))
+    if os.path.islink(dst):
+        manifest.add_link(entry.rel, os.readlink(dst))
+        return
+    target_entry = index.by_name.get(entry.link or "")
+    try:
+        if entry.kind == "hard" and target_entry is not None and target_entry.rel and \
+                os.path.samefile(dst, os.path.join(root, *target_entry.rel.split("/"))):
+            manifest.add_hardlink(entry.rel, target_entry.rel)
+            return
+    except OSError:
+        pass
+    source = index.source_of(entry)
+    record = manifest.records.get(source.rel) if source is not None else None
+    if record is not None and record[0] == "F":
+        manifest.add_file(entry.rel, record[1], record[3])
+
+
+def _link_unchanged(index, entry, root, prev):
+    dst = os.path.join(root, *entry.rel.split("/"))
+    target_entry = index.by_name.get(entry.link or "")
+    if target_entry is None or not target_entry.rel:
+        return False
+    target_dst = os.path.join(root, *target_entry.rel.split("/"))
+    try:
+        if entry.kind == "sym":
+            return prev[0] == "sym" and prev[1] == os.path.relpath(target_dst, os.path.dirname(dst))
+        return prev[0] == "file" and os.path.samefile(dst, target_dst)
+    except OSError:
+        return False
+
+
+@perf.timed("clear")
+def _remove_stale(target_path, existing, keep):
+    """Delete installed PNGs that the new package no longer contains."""
+    removed = 0
+    for rel in [r for r in existing if r not in keep]:
+        del existing[rel]
+        try:
+            os.unlink(os.path.join(target_path, *rel.split("/")))
+            removed += 1
+        except OSError:
+            pass
+    for root, dirs, _files in os.walk(target_path, topdown=False):
+        for name in dirs:
+            try:
+                os.rmdir(os.path.join(root, name))
+            except OSError:
+                pass
+    return removed
 
 
-def _install_tar_members(tar_path, target_path, progress=None):
+REPORT_BYTES = 1024 * 1024
+
+
+def _install_from_index(index, target_path, satellite="*", progress=None, existing=None, stats=None,
+                        manifest=None, journal=None, resume_from=0, cancel=None, byte_progress=None):
     """Install PNGs while preserving official picons symlink/hardlink layout.
 
     The upstream project deliberately builds a logos/ directory plus service-name/
     service-reference aliases. Flattening only regular PNG members loses those aliases,
-    so links are recreated when possible and safely dereferenced as a fallback.
+    so links are recreated when the filesystem supports them and dereferenced
+    otherwise. In satellite mode aliases are always dereferenced because logos/ is
+    not installed. Either way the tar stream is read once, front to back.
+
+    ``existing`` (see installed_snapshot) turns the install into a delta update:
+    PNGs missing from the package are removed first, files with identical content
+    and links with the same target are left alone, and ``stats`` receives the
+    added/changed/unchanged/removed counts. ``manifest`` records every
+    installed file and link.
+
+    Every write has a fixed position in this order; ``journal`` gets a checkpoint
+    each CHECKPOINT_EVERY positions, and ``resume_from`` (a checkpoint of an
+    interrupted run) keeps files below it that are already on disk. ``cancel``
+    (jobs.CancelToken) is checked once per archive member. ``progress`` counts
+    installed entries, ``byte_progress`` the payload bytes read from the archive.
     """
+    selected = index.selected(satellite)
+    total = len(selected)
+    if total == 0:
+        if satellite != "*":
+            raise ValueError("Brak piconów SRP dla wybranego satelity: %s" % satellite)
+        return 0
+    if stats is None:
+        stats = {}
+    for key in ("added", "changed", "unchanged", "removed"):
+        stats.setdefault(key, 0)
+    if existing is not None:
+        existing = dict(existing)
+        stats["removed"] += _remove_stale(target_path, existing, set(e.rel for e in selected))
+    links_ok = _filesystem_supports_links(target_path)
+    dereference = satellite != "*" or not links_ok
+    # Satellite mode writes each logo once and links its other aliases to that
+    # copy; only filesystems without links (FAT) get a copy per alias.
+    share = satellite != "*" and links_ok
+    files = {}
+    copies = {}   # source archive name -> aliases served from its payload
+    links = []
+    for entry in selected:
+        if entry.isfile():
+            files[entry.name] = entry
+            continue
+        source = index.source_of(entry)
+        if source is None:
+            continue
+        if dereference or not _linkable(index, entry):
+            copies.setdefault(source.name, []).append(entry)
+        else:
+            links.append(entry)
+
+    def dst_of(entry):
+        return os.path.join(target_path, *entry.rel.split("/"))
+
     count = 0
-    link_jobs = []
-    with tarfile.open(tar_path, "r:*") as tf:
-        members = []
-        for m in tf.getmembers():
-            rel = _picon_relative_path(m.name)
-            if not rel or not rel.lower().endswith(".png"):
-                continue
-            if m.isfile() or m.issym() or m.islnk():
-                members.append((m, rel))
-        total = len(members)
 
-        # Regular files first, so link targets normally already exist.
-        for idx, (member, rel) in enumerate(members):
-            if member.isfile():
-                src = tf.extractfile(member)
-                if src is not None:
-                    dst = os.path.join(target_path, *rel.split("/"))
-                    _replace_path(dst)
-                    try:
-                        _copy_stream(src, dst)
-                        count += 1
-                    finally:
-                        try:
-                            src.close()
-                        except Exception:
-                            pass
-            else:
-                link_jobs.append((member, rel))
-            if progress and (idx % 250 == 0):
-                progress(idx + 1, total)
+    def written(entry, size, crc):
+        if crc is None:
+            return 0
+        if manifest is not None:
+            manifest.add_file(entry.rel, size, crc)
+        return 1
 
-        for member, rel in link_jobs:
-            dst = os.path.join(target_path, *rel.split("/"))
-            parent = os.path.dirname(dst)
-            if parent and not os.path.isdir(parent):
-                os.makedirs(parent)
-            archive_target = _resolved_link_archive_name(member)
-            target_rel = _picon_relative_path(archive_target) if archive_target else None
-            linked = False
-            if target_rel:
-                target_dst = os.path.join(target_path, *target_rel.split("/"))
-                _replace_path(dst)
-                try:
-                    if member.issym():
-                        # Use a relative filesystem link so moving /picon to USB/HDD remains valid.
-                        link_text = os.path.relpath(target_dst, parent or target_path)
-                        os.symlink(link_text, dst)
-                    else:
-                        os.link(target_dst, dst)
-                    linked = True
-                    count += 1
-                except Exception:
-                    linked = False
-            if not linked:
-                # FAT-like external media may not support links. TarFile can resolve
-                # internal links; copy their content instead of silently losing picons.
-                try:
-                    src = tf.extractfile(member)
-                except Exception:
-                    src = None
-                if src is not None:
-                    _replace_path(dst)
-                    try:
-                        _copy_stream(src, dst)
-                        count += 1
-                    finally:
-                        try:
-                            src.close()
-                        except Exception:
-                            pass
+    position = [0, 0]   # writes so far, position of the last checkpoint
+
+    def committed(dest, size, open_src):
+        if position[0] >= resume_from:
+            return None
+        return _committed_crc(dst_of(dest), size, open_src)
+
+    def advance():
+        position[0] += 1
+        if journal is not None and position[0] - position[1] >= CHECKPOINT_EVERY:
+            position[1] = position[0]
+            journal.checkpoint(position[0])
 
+    done = 0
+    read = 0
+    payload = sum(e.size for e in files.values()) + \
+        sum(index.by_name[n].size for n in copies if n not in files and n in index.by_name)
+
+    marks = [0, 0]   # done and read at the last report
+
+    def report(final=False):
+        marks[:] = [done, read]
         if progress:
-            progress(total, total)
+            progress(total if final else done, total)
+        if byte_progress:
+            byte_progress(payload if final else read, payload)
+
+    resolver = _LinkResolver(target_path)
+    try:
+        with index.open_tar() as tf:
+            for member in tf:
+                if cancel is not None:
+                    cancel.check()
+                if not member.isfile():
+                    continue
+                name = _safe_archive_name(member.name) or ""
+                entry = files.get(name)
+                aliases = copies.pop(name, None)
+                size = int(member.size or 0)
+                if aliases:
+                    src = tf.extractfile(member)
+                    if src is None:
+                        continue
+                    resolver.add(name, src, size, refs=len(aliases))
+                    first = None
+                    for dest in ([entry] if entry is not None else []) + aliases:
+                        if share and first is not None and \
+                                _share_alias(dst_of(first), first.rel, dst_of(dest), dest.rel, existing, stats, manifest):
+                            count += 1
+                        else:
+                            crc = committed(dest, size, lambda: resolver.open(name))
+                            if crc is None:
+                                crc = _delta_write(dst_of(dest), dest.rel, size, lambda: resolver.open(name), existing, stats)
+                            count += written(dest, size, crc)
+                            if crc is not None and first is None:
+                                first = dest
+                        if dest is not entry:
+                            resolver.release(name)
+                        advance()
+                    done += len(aliases)
+                    read += size
+                elif entry is not None:
+                    crc = committed(entry, size, lambda: tf.extractfile(member))
+                    if crc is None and existing is None:
+                        crc = _copy_member(tf, member, dst_of(entry))
+                    elif crc is None:
+                        crc = _delta_write(dst_of(entry), entry.rel, size, lambda: tf.extractfile(member), existing, stats)
+                    count += written(entry, size, crc)
+                    advance()
+                    read += size
+                else:
+                    continue
+                if entry is not None:
+                    done += 1
+                # A few large logos move the byte count as much as many small ones.
+                if done - marks[0] >= 250 or read - marks[1] >= REPORT_BYTES:
+                    report()
+    finally:
+        resolver.close()
+
+    for entry in links:
+        prev = existing.pop(entry.rel, None) if existing is not None else None
+        if prev is not None and _link_unchanged(index, entry, target_path, prev):
+            stats["unchanged"] += 1
+        elif _recreate_link(index, entry, target_path):
+            if existing is not None:
+                stats["changed" if prev is not None else "added"] += 1
+        else:
+            entry = None
+        if entry is not None:
+            count += 1
+            if manifest is not None:
+                _record_link(manifest, index, entry, target_path)
+        advance()
+        done += 1
+        if done - marks[0] >= 250:
+            report()
+    report(final=True)
     return count
 
 
+def _linkable(index, entry):
+    """Whether a link alias can be recreated below the target, or needs its payload copied.
+
+    A link whose target lies outside the picon tree has nothing to point at there,
+    so it is installed as a copy like before links were recreated.
+    """
+    target_entry = index.by_name.get(entry.link or "")
+    source = index.source_of(entry)
+    return bool(target_entry is not None and target_entry.rel and source is not None and source.rel)
+
+
+@perf.timed("links")
+def _recreate_link(index, entry, root):
+    """Recreate a symlink/hardlink alias below root, copying the payload as fallback."""
+    dst = os.path.join(root, *entry.rel.split("/"))
+    parent = os.path.dirname(dst)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+    target_entry = index.by_name.get(entry.link or "")
+    _replace_path(dst)
+    try:
+        if target_entry is None or not target_entry.rel:
+            raise IOError("link target outside picon tree")
+        target_dst = os.path.join(root, *target_entry.rel.split("/"))
+        if entry.kind == "sym":
+            # Use a relative filesystem link so moving /picon to USB/HDD remains valid.
+            os.symlink(os.path.relpath(target_dst, parent or root), dst)
+        else:
+            os.link(target_dst, dst)
+        return True
+    except Exception:
+        # Links may still fail for individual entries; the payload has already
+        # been written as a regular file, so copy it from disk instead.
+        source = index.source_of(entry)
+        try:
+            if source is not None and source.rel:
+                shutil.copyfile(os.path.join(root, *source.rel.split("/")), dst)
+                return True
+        except Exception:
+            pass
+    return False
+
 
 def _filesystem_supports_links(path):
     """Probe link support without touching user picons."""
@@ -405,124 +1088,1189 @@ def _filesystem_supports_links(path):
         return False
 
 
-def _tar_required_bytes(tar_path, target_path):
+def _index_required_bytes(index, target_path, satellite="*"):
     """Estimate final disk usage for PNG payload in the selected filesystem."""
-    link_ok = _filesystem_supports_links(target_path)
-    total = 0
-    with tarfile.open(tar_path, "r:*") as tf:
-        members = tf.getmembers()
-        by_name = {}
-        for m in members:
-            clean = _safe_archive_name(m.name)
-            if clean:
-                by_name[clean] = m
-        for member in members:
-            rel = _picon_relative_path(member.name)
-            if not rel or not rel.lower().endswith(".png"):
-                continue
-            if member.isfile():
-                total += int(member.size or 0)
-            elif (member.issym() or member.islnk()) and not link_ok:
-                target_name = _resolved_link_archive_name(member)
-                target_member = by_name.get(target_name or "")
-                if target_member is not None and target_member.isfile():
-                    total += int(target_member.size or 0)
+    if satellite != "*":
+        wanted = _wanted_orbitals(satellite)
+        total = sum(index.orbital_bytes.get(o, 0) for o in wanted)
+        if not total:
+            return 0
+        if _filesystem_supports_links(target_path):
+            # Aliases of one logo share a single copy.
+            names = set()
+            for orbital in wanted:
+                names |= index.orbital_sources.get(orbital, set())
+            total = sum(index.by_name[n].size for n in names)
+        # No logos/ tree is installed, so only the copies need room.
+        return int(total * 1.08) + (512 * 1024)
+    total = index.file_bytes
+    if index.link_bytes and not _filesystem_supports_links(target_path):
+        total += index.link_bytes
     # Small safety margin for filesystem allocation/metadata.
     return int(total * 1.10) + (2 * 1024 * 1024)
 
 
-def validate_package(package_path, item):
+def validate_package(package_path, item, index=None):
     """Validate archive structure before any existing picons are removed.
 
     Returns the number of installable PNG aliases/files visible for the requested
     mode. This deliberately does not touch the destination filesystem.
     """
-    tmp_dir = tempfile.mkdtemp(prefix="piconupdater-validate-")
-    try:
-        fmt = (item.get("format") or "ipk").lower()
-        satellite = (item.get("selected_satellite") or "*").lower()
-        ptype = (item.get("type") or "").lower()
-        if fmt == "ipk" or package_path.lower().endswith(".ipk"):
-            tar_path = _extract_data_tar_from_ar(package_path, tmp_dir)
-        elif fmt in ("tar.xz", "txz") or package_path.lower().endswith(".tar.xz"):
-            tar_path = package_path
-        else:
-            raise ValueError("Nieobsługiwany format: %s" % fmt)
-        with tarfile.open(tar_path, "r:*") as tf:
-            if ptype == "srp" and satellite != "*":
-                count = len(_filtered_srp_members(tf, satellite))
-            else:
-                count = 0
-                for member in tf.getmembers():
-                    rel = _picon_relative_path(member.name)
-                    if rel and rel.lower().endswith(".png") and (member.isfile() or member.issym() or member.islnk()):
-                        count += 1
-            if count <= 0:
-                if ptype == "srp" and satellite != "*":
-                    raise ValueError("Brak piconów SRP dla wybranego satelity: %s" % satellite)
-                raise ValueError("Paczka nie zawiera piconów PNG.")
-            return count
-    finally:
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if index is None:
+        index = build_archive_index(package_path, item)
+    satellite = _satellite_mode(item)
+    count = len(index.selected(satellite))
+    if count <= 0:
+        if satellite != "*":
+            raise ValueError("Brak piconów SRP dla wybranego satelity: %s" % satellite)
+        raise ValueError("Paczka nie zawiera piconów PNG.")
+    return count
 
 
-def estimate_install_bytes(package_path, item, target):
+def estimate_install_bytes(package_path, item, target, index=None, existing=None):
+    """Extra bytes the install needs on the target; a delta update can reuse what
+    the installed set (``existing``) already occupies."""
     target_path, _ = ensure_target(target)
-    tmp_dir = tempfile.mkdtemp(prefix="piconupdater-estimate-")
-    try:
-        fmt = (item.get("format") or "ipk").lower()
-        satellite = (item.get("selected_satellite") or "*").lower()
-        ptype = (item.get("type") or "").lower()
-        if fmt == "ipk" or package_path.lower().endswith(".ipk"):
-            data_tar = _extract_data_tar_from_ar(package_path, tmp_dir)
-            if ptype == "srp" and satellite != "*":
-                return _estimate_srp_satellite(data_tar, satellite)
-            return _tar_required_bytes(data_tar, target_path)
-        if fmt in ("tar.xz", "txz") or package_path.lower().endswith(".tar.xz"):
-            if ptype == "srp" and satellite != "*":
-                return _estimate_srp_satellite(package_path, satellite)
-            return _tar_required_bytes(package_path, target_path)
-        return 0
-    finally:
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if index is None:
+        try:
+            _package_kind(package_path, item)
+        except ValueError:
+            return 0
+        index = build_archive_index(package_path, item)
+    required = _index_required_bytes(index, target_path, _satellite_mode(item))
+    if existing and required:
+        reusable = sum(v[1] for v in existing.values() if v[0] == "file")
+        required = max(0, required - reusable)
+    return required
 
 
-def install_package(package_path, item, target, progress=None):
-    target_path, symlink_message = ensure_target(target)
-    tmp_dir = tempfile.mkdtemp(prefix="piconupdater-install-")
+def _mark_reload(target_path):
+    """Leave the marker noting that the picon set below target_path was replaced."""
     try:
-        fmt = (item.get("format") or "ipk").lower()
-        satellite = (item.get("selected_satellite") or "*").lower()
-        ptype = (item.get("type") or "").lower()
-        if fmt == "ipk" or package_path.lower().endswith(".ipk"):
-            data_tar = _extract_data_tar_from_ar(package_path, tmp_dir)
-            if ptype == "srp" and satellite != "*":
-                count = _install_srp_satellite(data_tar, target_path, satellite, progress=progress)
-            else:
-                count = _install_tar_members(data_tar, target_path, progress=progress)
-        elif fmt in ("tar.xz", "txz") or package_path.lower().endswith(".tar.xz"):
-            if ptype == "srp" and satellite != "*":
-                count = _install_srp_satellite(package_path, target_path, satellite, progress=progress)
-            else:
-                count = _install_tar_members(package_path, target_path, progress=progress)
-        else:
-            raise ValueError("Nieobsługiwany format: %s" % fmt)
-        try:
-            marker = os.path.join(target_path, ".piconupdater_reload")
-            with open(marker, "w") as f:
-                f.write("reload\n")
-        except Exception:
-            pass
-        return {"count": count, "path": target_path, "symlink": symlink_message, "satellite": satellite}
-    finally:
-        shutil.rmtree(tmp_dir, ignore_errors=True)
+        with open(os.path.join(target_path, ".piconupdater_reload"), "w") as f:
+            f.write("reload\n")
+    except Exception:
+        pass
 
 
-def clear_picons(target):
-    path, _ = ensure_target(target)
+def install_package(package_path, item, target, progress=None, index=None, existing=None,
+                    journal=None, resume_from=0, cancel=None, byte_progress=None):
+    """Install the package into target.
+
+    Pass ``existing`` from installed_snapshot() for a delta update instead of a
+    clear-and-reinstall; the result then carries added/changed/removed counts.
+    ``journal``, ``resume_from``, ``cancel`` and ``byte_progress`` are passed to
+    _install_from_index().
+    A list of targets is written from one decompression pass, see _install_targets().
+    """
+    if isinstance(target, list):
+        return _install_targets(package_path, item, target, progress=progress, index=index, cancel=cancel,
+                                byte_progress=byte_progress)
+    target_path, symlink_message = ensure_target(target)
+    satellite = ((item or {}).get("selected_satellite") or "*").lower()
+    if index is None:
+        index = build_archive_index(package_path, item)
+    stats = {}
+    manifest = InstallManifest((item or {}).get("name") or "")
+    count = _install_from_index(index, target_path, _satellite_mode(item), progress=progress,
+                                existing=existing, stats=stats, manifest=manifest,
+                                journal=journal, resume_from=resume_from, cancel=cancel,
+                                byte_progress=byte_progress)
+    manifest_path = manifest.save(target_path)
+    _mark_reload(target_path)
+    result = {"count": count, "path": target_path, "symlink": symlink_message, "satellite": satellite,
+              "manifest": manifest_path, "orbitals": _orbital_counts(manifest, _satellite_mode(item))}
+    if existing is not None:
+        result["delta"] = stats
+    return result
+
+
+TRASH_DIR = ".piconupdater-trash"
+_TRASH_LOCK = threading.Lock()
+_TRASH_WORKERS = {}
+
+
+def _trash_root(live):
+    return os.path.join(os.path.dirname(live.rstrip("/")), TRASH_DIR)
+
+
+def _reserve_trash(live):
+    """Return a fresh path inside the trash next to live (same filesystem)."""
+    root = _trash_root(live)
+    # Under the lock, so an emptying worker cannot remove root in between.
+    with _TRASH_LOCK:
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        return os.path.join(tempfile.mkdtemp(prefix=os.path.basename(live.rstrip("/")) + "-", dir=root), "tree")
+
+
+def _scandir(path):
+    """Yield (full path, is_dir) of directory entries without following links."""
+    if hasattr(os, "scandir"):
+        for entry in os.scandir(path):
+            yield entry.path, entry.is_dir(follow_symlinks=False)
+        return
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        yield full, os.path.isdir(full) and not os.path.islink(full)
+
+
+@perf.timed("clear")
+def remove_tree(path, progress=None):
+    """Delete a directory tree children first; returns the number of removed files.
+
+    Entries vanishing underneath (a concurrent remover) are ignored. progress is
+    called as progress(removed, 0) every 500 files.
+    """
+    removed = [0]
+
+    def walk(directory):
+        try:
+            entries = list(_scandir(directory))
+        except OSError:
+            return
+        for full, is_dir in entries:
+            if is_dir:
+                walk(full)
+                try:
+                    os.rmdir(full)
+                except OSError:
+                    pass
+                continue
+            try:
+                os.unlink(full)
+            except OSError:
+                continue
+            removed[0] += 1
+            if progress and removed[0] % 500 == 0:
+                progress(removed[0], 0)
+    walk(path)
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+    return removed[0]
+
+
+def _lower_thread_priority():
+    # Linux applies nice values per thread; the receiver keeps playing smoothly.
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except Exception:
+        pass
+
+
+def trash_bytes(path):
+    """Bytes still waiting in the trash next to path."""
+    total = 0
+    for root, _dirs, files in os.walk(_trash_root(os.path.realpath(path))):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def empty_trash(path, progress=None, background=False):
+    """Delete what is pending in the trash next to path.
+
+    Returns the number of removed files, or with background=True the low-priority
+    daemon thread doing the work (one per trash directory).
+    """
+    root = _trash_root(os.path.realpath(path))
+
+    def run():
+        if background:
+            _lower_thread_priority()
+        try:
+            names = os.listdir(root)
+        except OSError:
+            names = []
+        removed = 0
+        for name in names:
+            tree = os.path.join(root, name, "tree")
+            if not os.path.lexists(tree):
+                # Reserved by _reserve_trash but not renamed into yet.
+                continue
+            done = removed
+            removed += remove_tree(tree, progress=progress and (lambda n, total: progress(done + n, total)))
+            try:
+                os.rmdir(os.path.dirname(tree))
+            except OSError:
+                pass
+        with _TRASH_LOCK:
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+            _TRASH_WORKERS.pop(root, None)
+        return removed
+    if not background:
+        return run()
+    with _TRASH_LOCK:
+        worker = _TRASH_WORKERS.get(root)
+        if worker is not None and worker.is_alive():
+            return worker
+        worker = threading.Thread(target=run)
+        worker.daemon = True
+        _TRASH_WORKERS[root] = worker
+    worker.start()
+    return worker
+
+
+@perf.timed("clear")
+def move_to_trash(target):
+    """Move the installed picon set into the trash with one rename.
+
+    Files the plugin does not own are moved straight back, so the result matches
+    clear_picons() without unlinking anything yet. Returns the trash path, or ""
+    when the target cannot be renamed (mount point) and nothing was moved.
+    """
+    path, _ = ensure_target(target)
+    live = os.path.realpath(path)
+    trash = _reserve_trash(live)
+    try:
+        os.rename(live, trash)
+    except OSError:
+        shutil.rmtree(os.path.dirname(trash), ignore_errors=True)
+        return ""
+    os.makedirs(live)
+    try:
+        shutil.copymode(trash, live)
+    except OSError:
+        pass
+    _carry_over(trash, live)
+    return trash
+
+
+def _carry_over(old_root, new_root):
+    """Move entries the plugin does not own from the live tree into the staged one.
+
+    Ownership follows clear_picons(): manifest entries when a manifest exists,
+    otherwise every PNG. Everything else (user logos, configs) survives the swap.
+    """
+    manifest = InstallManifest.load(old_root)
+    owned = manifest.records if manifest is not None else None
+    moved = 0
+    for root, dirs, files in os.walk(old_root):
+        names = list(files) + [d for d in dirs if os.path.islink(os.path.join(root, d))]
+        dirs[:] = [d for d in dirs if d not in names]
+        for name in names:
+            full = os.path.join(root, name)
+            rel = os.path.relpath(full, old_root).replace(os.sep, "/")
+            if name == MANIFEST_NAME:
+                continue
+            ours = rel in owned if owned is not None else name.lower().endswith(".png")
+            if ours:
+                continue
+            dst = os.path.join(new_root, *rel.split("/"))
+            if os.path.lexists(dst):
+                continue
+            parent = os.path.dirname(dst)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            os.rename(full, dst)
+            moved += 1
+    return moved
+
+
+def _commit_staging(staging, live, target):
+    """Swap a finished staging tree in place of live; True when done by rename.
+
+    Targets that cannot be renamed (mount points) get the old set cleared and the
+    staging tree merged instead.
+    """
+    if not os.path.lexists(live):
+        # Interrupted between the two renames: the old set is already in the trash.
+        os.rename(staging, live)
+        return True
+    _carry_over(live, staging)
+    trash = _reserve_trash(live)
+    try:
+        os.rename(live, trash)
+    except OSError:
+        shutil.rmtree(os.path.dirname(trash), ignore_errors=True)
+        trash = None
+    if trash is not None:
+        try:
+            os.rename(staging, live)
+            empty_trash(live, background=True)
+            return True
+        except OSError:
+            os.rename(trash, live)
+    clear_picons(target)
+    _merge_tree(staging, live)
+    return False
+
+
+def staged_install_package(package_path, item, target, progress=None, index=None,
+                           journal=None, resume_from=0, cancel=None, byte_progress=None):
+    """Install into a sibling staging directory and swap it in with two renames.
+
+    The live picons stay complete while the new set is written; visible downtime
+    is the rename pair, and the old tree is deleted in the background afterwards.
+    Returns None without touching anything when the filesystem cannot hold both
+    sets at once, so the caller can fall back to clear_picons() + install_package().
+    With ``resume_from`` the staging tree of an interrupted run is continued.
+    """
+    target_path, symlink_message = ensure_target(target)
+    # Resolve symlinked targets so staging lands on the filesystem of the real tree.
+    live = os.path.realpath(target_path)
+    satellite = ((item or {}).get("selected_satellite") or "*").lower()
+    if index is None:
+        index = build_archive_index(package_path, item)
+    staging = _staging_path(live)
+    try:
+        if not (resume_from and os.path.isdir(staging)):
+            resume_from = 0
+            required = _index_required_bytes(index, live, _satellite_mode(item))
+            free = free_space(os.path.dirname(live))
+            if required and free and free < required:
+                return None
+            _replace_path(staging)
+            os.makedirs(staging)
+        manifest = InstallManifest((item or {}).get("name") or "")
+        count = _install_from_index(index, staging, _satellite_mode(item), progress=progress, manifest=manifest,
+                                    journal=journal, resume_from=resume_from, cancel=cancel,
+                                    byte_progress=byte_progress)
+        manifest.save(staging)
+        staged = _commit_staging(staging, live, target)
+        _mark_reload(live)
+        return {"count": count, "path": target_path, "symlink": symlink_message, "satellite": satellite,
+                "manifest": os.path.join(target_path, MANIFEST_NAME), "staged": staged,
+                "orbitals": _orbital_counts(manifest, _satellite_mode(item))}
+    finally:
+        if os.path.isdir(staging):
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+JOURNAL_FILE = "/etc/enigma2/piconupdater_journal.json"
+CHECKPOINT_EVERY = 1000
+
+
+def journal_path(target, path=JOURNAL_FILE):
+    """Journal file of installs to target, so installs elsewhere can run alongside."""
+    key = "\n".join(sorted(target_locks(target))).encode("utf-8")
+    base, ext = os.path.splitext(path)
+    return "%s-%s%s" % (base, hashlib.sha1(key).hexdigest()[:12], ext)
+
+
+def _sync():
+    sync = getattr(os, "sync", None)
+    if sync is not None:
+        sync()
+    else:
+        os.system("sync")
+
+
+class InstallJournal(object):
+    """Record of the running install, kept until it ends.
+
+    begin() stores the package digest, target, mode and satellite; checkpoint()
+    flushes everything written so far with a single sync and then records how
+    many writes are durable. A journal still present at plugin start means the
+    box went down mid-install and resume_install() can continue it.
+    """
+
+    def __init__(self, path=JOURNAL_FILE, record=None):
+        self.path = path
+        self.record = record
+
+    def begin(self, item, target, package):
+        self.record = {
+            "schema": 1,
+            "digest": (item or {}).get("digest") or "",
+            "item": dict(item or {}),
+            "target": [dict(t) for t in target] if isinstance(target, list) else dict(target or {}),
+            "satellite": _satellite_mode(item),
+            "package": package,
+            "mode": "",
+            "checkpoint": 0,
+            "started_at": int(time.time()),
+            "run_id": hashlib.sha1(os.urandom(16)).hexdigest()[:16],
+        }
+        self._write()
+
+    def set_mode(self, mode):
+        self.record["mode"] = mode
+        self.record["checkpoint"] = 0
+        self._write()
+
+    def checkpoint(self, position):
+        _sync()
+        self.record["checkpoint"] = int(position)
+        self._write()
+
+    def finish(self):
+        """Drop the journal file, unless it now belongs to another install."""
+        record, self.record = self.record, None
+        if record is None:
+            return
+        on_disk = InstallJournal.load(self.path)
+        if on_disk is not None and on_disk.record.get("run_id") != record.get("run_id"):
+            return
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _write(self):
+        _atomic_json_write(self.path, self.record)
+
+    @classmethod
+    def load(cls, path=JOURNAL_FILE):
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(record, dict) or record.get("schema") != 1 or not record.get("item"):
+            return None
+        return cls(path, record)
+
+    @classmethod
+    def load_all(cls, path=JOURNAL_FILE):
+        """Every journal left next to path: the shared one and per-target ones."""
+        folder = os.path.dirname(path)
+        base, ext = os.path.splitext(os.path.basename(path))
+        try:
+            names = sorted(os.listdir(folder))
+        except OSError:
+            return []
+        found = []
+        for name in names:
+            if name == base + ext or (name.startswith(base + "-") and name.endswith(ext)):
+                journal = cls.load(os.path.join(folder, name))
+                if journal is not None:
+                    found.append(journal)
+        return found
+
+
+def _human_bytes(value):
+    try:
+        value = float(value or 0)
+    except Exception:
+        return "—"
+    units = ["B", "KB", "MB", "GB"]
+    idx = 0
+    while value >= 1024.0 and idx < len(units) - 1:
+        value /= 1024.0
+        idx += 1
+    if idx == 0:
+        return "%d %s" % (int(value), units[idx])
+    return "%.1f %s" % (value, units[idx])
+
+
+def perform_install(package_path, item, target, progress=None, status=None, delta=False, journal=None,
+                    cancel=None, byte_progress=None):
+    """Validate a downloaded package and install it with the cheapest safe strategy.
+
+    Delta when ``delta`` is set, otherwise staged with an in-place fallback when
+    both sets do not fit. ``status(phase, done)`` announces the "validating",
+    "comparing_old" and "clearing_old" phases. A ``journal`` that already carries a mode (loaded
+    after a crash) continues that mode from its checkpoint.
+    """
+    resume = journal.record if journal is not None and journal.record.get("mode") else None
+    mode = resume["mode"] if resume else ""
+    resume_from = int(resume.get("checkpoint") or 0) if resume else 0
+
+    def announce(phase, done=0):
+        if status:
+            status(phase, done)
+
+    def enter(new_mode):
+        if journal is not None and journal.record.get("mode") != new_mode:
+            journal.set_mode(new_mode)
+
+    # Fully validate the downloaded archive before touching existing picons.
+    # Only after successful validation do we remove the old set. This gives
+    # the update access to the space occupied by previous picons without
+    # risking deletion because of a corrupt/incomplete download. The member
+    # index is built once and shared by validation, estimate and install.
+    announce("validating")
+    index = build_archive_index(package_path, item)
+    validate_package(package_path, item, index=index)
+    if isinstance(target, list):
+        # Several targets restart from scratch after a crash; no checkpoints.
+        return _install_targets(package_path, item, target, progress=progress, index=index,
+                                status=announce, cancel=cancel, byte_progress=byte_progress)
+    existing = None
+    if mode == "delta" or (not mode and delta):
+        enter("delta")
+        announce("comparing_old")
+        existing = installed_snapshot(target.get("path"))
+        resume_from = 0
+    elif mode in ("", "staged"):
+        # The new set is written next to the live one and swapped in;
+        # None means both sets do not fit, so replace in place.
+        enter("staged")
+        result = staged_install_package(package_path, item, target, progress=progress, index=index,
+                                        journal=journal, resume_from=resume_from, cancel=cancel,
+                                        byte_progress=byte_progress)
+        if result is not None:
+            return result
+        # One rename; the old files are deleted after the install unless
+        # their space is needed first.
+        announce("clearing_old")
+        if not move_to_trash(target):
+            clear_picons(target)
+        enter("inplace")
+        resume_from = 0
+    path = target.get("path", "/")
+    required = estimate_install_bytes(package_path, item, target, index=index, existing=existing)
+    target_free = free_space(path)
+    if resume_from:
+        # Part of the new set is already on disk; the first run checked the space.
+        required = 0
+    if required and target_free and target_free < required:
+        pending = trash_bytes(path)
+        if pending and target_free + pending >= required:
+            empty_trash(path, progress=lambda done, total: announce("clearing_old", done))
+            target_free = free_space(path)
+    if required and target_free and target_free < required:
+        where = "na aktualizację piconów" if existing is not None else "po usunięciu poprzednich piconów"
+        raise IOError("Za mało miejsca %s: potrzeba ok. %s, wolne %s" % (where, _human_bytes(required), _human_bytes(target_free)))
+    result = install_package(package_path, item, target, progress=progress, index=index, existing=existing,
+                             journal=journal, resume_from=resume_from, cancel=cancel,
+                             byte_progress=byte_progress)
+    empty_trash(path, background=True)
+    return result
+
+
+WORKER_NICE = 10
+
+
+class InstallCancelled(Cancelled):
+    pass
+
+
+def _which(name):
+    for folder in os.environ.get("PATH", "/usr/bin:/bin").split(os.pathsep):
+        path = os.path.join(folder, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return ""
+
+
+def _worker_command():
+    """Command line running this module as an install worker, or [] without a Python binary."""
+    python = sys.executable or ""
+    # Inside enigma2 sys.executable may be the GUI binary itself.
+    if not os.path.basename(python).startswith("python"):
+        python = _which("python3") or _which("python")
+    if not python:
+        return []
+    command = [python, os.path.abspath(__file__), "--install-worker"]
+    ionice = _which("ionice")
+    return ([ionice, "-c", "3"] if ionice else []) + command
+
+
+class InstallWorker(object):
+    """perform_install() in a child process at low CPU and I/O priority.
+
+    The calling thread only reads JSON lines from the child's stdout, so the
+    tarfile/lzma loops no longer compete with enigma2 for the GIL. cancel()
+    terminates the child; without a usable Python binary the install runs in
+    the calling thread instead.
+    """
+
+    def __init__(self, package_path, item, target, delta=False, journal=None, cancel=None):
+        self.journal = journal
+        self.token = cancel
+        self.job = {"package": package_path, "item": item, "target": target, "delta": bool(delta),
+                    "journal": journal.path if journal is not None and journal.record else ""}
+        self.proc = None
+        self.cancelled = False
+
+    def run(self, progress=None, status=None, byte_progress=None):
+        command = _worker_command()
+        errors = tempfile.TemporaryFile() if command else None
+        try:
+            return self._run(command, errors, progress, status, byte_progress)
+        finally:
+            if errors is not None:
+                errors.close()
+
+    def _run(self, command, errors, progress, status, byte_progress):
+        """run() with the child's stderr going to errors, which the caller closes."""
+        if command:
+            try:
+                self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=errors,
+                                             close_fds=True)
+            except OSError:
+                self.proc = None
+        if self.proc is None:
+            job = self.job
+            try:
+                return perform_install(job["package"], job["item"], job["target"], progress=progress, status=status,
+                                       delta=job["delta"], journal=self.journal, cancel=self.token,
+                                       byte_progress=byte_progress)
+            except Cancelled:
+                self._discard()
+                raise InstallCancelled()
+        proc = self.proc
+        if self.token is not None:
+            self.token.on_cancel(self.cancel)
+        if self.cancelled:
+            proc.terminate()
+        try:
+            proc.stdin.write((json.dumps(self.job) + "\n").encode("utf-8"))
+            proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        result = error = None
+        for line in iter(proc.stdout.readline, b""):
+            try:
+                msg = json.loads(line.decode("utf-8"))
+            except ValueError:
+                continue
+            kind = msg.get("kind")
+            if kind == "progress" and progress:
+                progress(msg.get("done", 0), msg.get("total", 0))
+            elif kind == "bytes" and byte_progress:
+                byte_progress(msg.get("done", 0), msg.get("total", 0))
+            elif kind == "status" and status:
+                status(msg.get("phase", ""), msg.get("done", 0))
+            elif kind == "done":
+                result = msg.get("result") or {}
+                break
+            elif kind == "error":
+                error = msg.get("message") or ""
+                break
+        if result is not None:
+            # Spans timed in the child belong to the run of this thread.
+            run = perf.current()
+            if run is not None:
+                run.merge(result.get("timings"))
+            result.pop("timings", None)
+            # The child still empties the trash; reap it when it is done.
+            reaper = threading.Thread(target=proc.wait)
+            reaper.daemon = True
+            reaper.start()
+            return result
+        code = proc.wait()
+        if self.cancelled:
+            self._discard()
+            raise InstallCancelled()
+        if error is None:
+            errors.seek(0)
+            lines = errors.read().decode("utf-8", "replace").strip().splitlines()
+            error = lines[-1] if lines else "Proces instalacji zakończył się kodem %s" % code
+        raise IOError(error)
+
+    def cancel(self):
+        self.cancelled = True
+        proc = self.proc
+        if proc is not None and proc.poll() is None:
+            proc.terminate()
+
+    def _discard(self):
+        """After a cancel, drop the journal and staging trees of the job.
+
+        An in-place or delta install had already changed the live set, so its
+        journal is kept and the next start completes it.
+        """
+        journal = InstallJournal.load(self.job["journal"]) if self.job["journal"] else None
+        if journal is not None and journal.record.get("mode") in ("inplace", "delta"):
+            return
+        target = self.job["target"]
+        for each in (target if isinstance(target, list) else [target]):
+            shutil.rmtree(_staging_path(os.path.realpath(each.get("path", ""))), ignore_errors=True)
+        if journal is not None:
+            journal.finish()
+
+
+def _worker_main():
+    """Install worker process: one JSON job on stdin, JSON lines on stdout."""
+    # Lowered here rather than in a preexec_fn, which is unsafe to run in
+    # the threaded enigma2 process between fork and exec.
+    try:
+        os.nice(WORKER_NICE)
+    except OSError:
+        pass
+    out = sys.stdout
+
+    def send(kind, **fields):
+        fields["kind"] = kind
+        out.write(json.dumps(fields) + "\n")
+        out.flush()
+    try:
+        job = json.loads(sys.stdin.readline())
+        journal = InstallJournal.load(job["journal"]) if job.get("journal") else None
+        run = perf.PerfRun()
+        with perf.bind(run):
+            result = perform_install(job["package"], job["item"], job["target"],
+                                     progress=lambda done, total: send("progress", done=done, total=total),
+                                     status=lambda phase, done: send("status", phase=phase, done=done),
+                                     byte_progress=lambda done, total: send("bytes", done=done, total=total),
+                                     delta=job.get("delta", False), journal=journal)
+    except Exception as e:
+        send("error", message=str(e))
+        return 1
+    result["timings"] = run.spans
+    send("done", result=result)
+    # Background trash removal would die with the process; finish it first.
+    with _TRASH_LOCK:
+        workers = list(_TRASH_WORKERS.values())
+    for worker in workers:
+        worker.join()
+    return 0
+
+
+_FEED_DEPTH = 64
+
+
+class _TarFeed(object):
+    """tarfile stand-in for one writer thread of _fan_out().
+
+    Yields the members handed over by the single reading pass; extractfile()
+    serves the payload read for the current member.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=_FEED_DEPTH)
+        self.ended = False
+        self._data = None
+
+    def __iter__(self):
+        while not self.ended:
+            item = self.queue.get()
+            if item is None:
+                self.ended = True
+                return
+            member, self._data = item
+            yield member
+
+    def extractfile(self, member):
+        return io.BytesIO(self._data) if self._data is not None else None
+
+    def drain(self):
+        for _member in self:
+            pass
+
+
+class _FeedIndex(object):
+    """ArchiveIndex whose open_tar() yields a _TarFeed instead of the package."""
+
+    def __init__(self, index, feed):
+        self._index = index
+        self._feed = feed
+
+    def __getattr__(self, name):
+        return getattr(self._index, name)
+
+    @contextlib.contextmanager
+    def open_tar(self):
+        yield self._feed
+
+
+def _fan_out(index, roots, satellite="*", progress=None, manifests=None, cancel=None, byte_progress=None):
+    """Decompress the package once and install it below every root in parallel.
+
+    Each root has a writer thread running _install_from_index() on a _TarFeed,
+    so link support and delta handling stay per filesystem. Returns per-root
+    counts; the first writer error is raised after all threads have ended.
+    """
+    selected = index.selected(satellite)
+    needed = set()
+    for entry in selected:
+        source = index.source_of(entry)
+        if source is not None:
+            needed.add(source.name)
+    feeds = [_TarFeed() for _root in roots]
+    counts = [0] * len(roots)
+    errors = [None] * len(roots)
+    done = [0] * len(roots)
+    read = [0] * len(roots)
+    run = perf.current()
+
+    def writer(i):
+        def report(value, total):
+            done[i] = value
+            if progress:
+                progress(sum(done), total * len(roots))
+
+        def report_bytes(value, total):
+            read[i] = value
+            if byte_progress:
+                byte_progress(sum(read), total * len(roots))
+        try:
+            with perf.bind(run):
+                counts[i] = _install_from_index(_FeedIndex(index, feeds[i]), roots[i], satellite, progress=report,
+                                                manifest=manifests[i] if manifests else None,
+                                                byte_progress=report_bytes)
+        except Exception as e:
+            errors[i] = e
+        finally:
+            # Keep consuming so the reading pass never blocks on a failed writer.
+            feeds[i].drain()
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(len(roots))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    try:
+        with index.open_tar() as tf:
+            for member in tf:
+                if cancel is not None:
+                    cancel.check()
+                if not member.isfile() or (_safe_archive_name(member.name) or "") not in needed:
+                    continue
+                src = tf.extractfile(member)
+                data = src.read() if src is not None else None
+                for feed in feeds:
+                    feed.queue.put((member, data))
+    finally:
+        for feed in feeds:
+            feed.queue.put(None)
+        for t in threads:
+            t.join()
+    for error in errors:
+        if error is not None:
+            raise error
+    return counts
+
+
+def _install_targets(package_path, item, targets, progress=None, index=None, status=None,
+                     cancel=None, byte_progress=None):
+    """Install one package into several targets from a single decompression pass.
+
+    Each target has its own space check and manifest. Targets that can hold
+    both sets are written next to the live tree and swapped in; the others
+    have their old set moved to the trash first, so every target ends up with
+    only the new set. The result reports per-target counts.
+    """
+    satellite = _satellite_mode(item)
+    if index is None:
+        index = build_archive_index(package_path, item)
+    plans = []
+    try:
+        for target in targets:
+            path, symlink_message = ensure_target(target)
+            live = os.path.realpath(path)
+            required = _index_required_bytes(index, live, satellite)
+            staging = None
+            free = free_space(os.path.dirname(live))
+            if not (required and free and free < required):
+                staging = _staging_path(live)
+                _replace_path(staging)
+                os.makedirs(staging)
+            else:
+                if status:
+                    status("clearing_old", 0)
+                if not move_to_trash(target):
+                    clear_picons(target)
+            if staging is None:
+                target_free = free_space(path)
+                if required and target_free and target_free < required:
+                    pending = trash_bytes(path)
+                    if pending and target_free + pending >= required:
+                        empty_trash(path)
+                        target_free = free_space(path)
+                if required and target_free and target_free < required:
+                    raise IOError("Za mało miejsca w %s: potrzeba ok. %s, wolne %s" % (
+                        target.get("label") or path, _human_bytes(required), _human_bytes(target_free)))
+            plans.append({"target": target, "path": path, "live": live, "staging": staging,
+                          "symlink": symlink_message,
+                          "manifest": InstallManifest((item or {}).get("name") or "")})
+        counts = _fan_out(index, [p["staging"] or p["path"] for p in plans], satellite, progress=progress,
+                          manifests=[p["manifest"] for p in plans], cancel=cancel,
+                          byte_progress=byte_progress)
+        per_target = []
+        for plan, count in zip(plans, counts):
+            root = plan["staging"] or plan["path"]
+            plan["manifest"].save(root)
+            if plan["staging"]:
+                _commit_staging(plan["staging"], plan["live"], plan["target"])
+            else:
+                empty_trash(plan["path"], background=True)
+            _mark_reload(plan["path"])
+            per_target.append({"id": plan["target"].get("id"), "label": plan["target"].get("label", ""),
+                               "path": plan["path"], "count": count, "staged": bool(plan["staging"])})
+        first = plans[0]
+        return {"count": counts[0], "path": first["path"], "symlink": first["symlink"],
+                "satellite": ((item or {}).get("selected_satellite") or "*").lower(),
+                "manifest": os.path.join(first["path"], MANIFEST_NAME),
+                "orbitals": _orbital_counts(first["manifest"], satellite), "targets": per_target}
+    finally:
+        for plan in plans:
+            if plan["staging"] and os.path.isdir(plan["staging"]):
+                shutil.rmtree(plan["staging"], ignore_errors=True)
+
+
+class _ExactReader(object):
+    """Non-seekable reader returning exactly ``size`` bytes of an underlying stream."""
+
+    def __init__(self, fileobj, size):
+        self._f = fileobj
+        self.remaining = size
+
+    def read(self, n=-1):
+        if self.remaining <= 0:
+            return b""
+        if n is None or n < 0 or n > self.remaining:
+            n = self.remaining
+        data = self._f.read(n)
+        if not data:
+            raise IOError("Nieoczekiwany koniec IPK")
+        self.remaining -= len(data)
+        return data
+
+    def skip_rest(self):
+        while self.remaining > 0:
+            self.read(1024 * 128)
+
+
+class _ArStream(object):
+    """Sequential IPK/ar parser for non-seekable input such as an HTTPS response."""
+
+    def __init__(self, fileobj):
+        self._f = fileobj
+        if self._read_exact(8) != b"!<arch>\n":
+            raise ValueError("Nieprawidłowy format IPK/ar")
+        self._pad = 0
+
+    def _read_exact(self, n):
+        out = b""
+        while len(out) < n:
+            data = self._f.read(n - len(out))
+            if not data:
+                break
+            out += data
+        return out
+
+    @perf.timed("ar")
+    def data_member(self):
+        """Skip to data.tar.* and return (name, reader) positioned at its payload."""
+        while True:
+            if self._pad:
+                self._read_exact(self._pad)
+            header = self._read_exact(60)
+            if not header:
+                break
+            if len(header) != 60 or header[58:60] != b"`\n":
+                raise ValueError("Uszkodzony nagłówek ar")
+            name = header[0:16].decode("utf-8", "ignore").strip().rstrip("/")
+            try:
+                size = int(header[48:58].decode("ascii", "ignore").strip())
+            except Exception:
+                raise ValueError("Nieprawidłowy rozmiar elementu ar")
+            self._pad = size % 2
+            reader = _ExactReader(self._f, size)
+            if name.startswith("data.tar"):
+                return name, reader
+            reader.skip_rest()
+        raise ValueError("Brak data.tar.* w IPK")
+
+
+def _staging_path(target_path):
+    parent, base = os.path.split(target_path.rstrip("/"))
+    return os.path.join(parent, ".%s.piconupdater-staging" % base)
+
+
+def _merge_tree(src, dst):
+    """Move every entry of src into dst with per-entry renames on one filesystem."""
+    if not os.path.isdir(dst):
+        os.makedirs(dst)
+    for name in os.listdir(src):
+        s = os.path.join(src, name)
+        d = os.path.join(dst, name)
+        if os.path.isdir(s) and not os.path.islink(s) and os.path.isdir(d) and not os.path.islink(d):
+            _merge_tree(s, d)
+            continue
+        _replace_path(d)
+        os.rename(s, d)
+    shutil.rmtree(src, ignore_errors=True)
+
+
+class StreamFallback(IOError):
+    """The streaming install cannot proceed; install from a downloaded file instead."""
+
+
+def stream_install_fits(item, target):
+    """Whether a staged set of item fits next to the live one on the target.
+
+    The uncompressed size is unknown before the stream ends; PNGs barely
+    compress, so the package size with the usual margin stands in for it.
+    """
+    need = int((item or {}).get("size") or 0)
+    if not need:
+        return True
+    path = target.get("path", "/")
+    while path and not os.path.isdir(path):
+        path = os.path.dirname(path)
+    free = free_space(path or "/")
+    return not free or free >= int(need * 1.10) + (2 * 1024 * 1024)
+
+
+def stream_install_package(url, item, target, progress=None, timeout=120, cancel=None):
+    """Download and install in one pass without a temporary package file.
+
+    The HTTPS response feeds the SHA256 hasher, the ar parser, the tarfile stream
+    decompressor and the member writer at the same time. Files land in a staging
+    directory next to the target; existing picons are only replaced after the
+    whole download has been verified against the release digest.
+
+    There is no in-place fallback, so StreamFallback is raised when the staged
+    set does not fit (see stream_install_fits()) or, in satellite mode, when
+    logos that arrive before their aliases do not fit the in-memory cache.
+    """
+    if not stream_install_fits(item, target):
+        raise StreamFallback("Za mało miejsca na instalację strumieniową")
+    target_path, symlink_message = ensure_target(target)
+    live = os.path.realpath(target_path)
+    satellite = _satellite_mode(item)
+    wanted = _wanted_orbitals(satellite)
+    index = ArchiveIndex(url, item, scan=False)
+    staging = _staging_path(live)
+    _replace_path(staging)
+    os.makedirs(staging)
+    committed = False
+    stream = DownloadStream(url, timeout=timeout, progress=progress)
+    if cancel is not None:
+        # Unblocks a read stuck on a stalled connection.
+        cancel.on_cancel(stream.abort)
+    resolver = _LinkResolver(staging, memory_limit=_LINK_CACHE_MEMORY)
+    manifest = InstallManifest((item or {}).get("name") or "")
+    try:
+        container = None
+        payload = stream
+        if index.kind == "ipk":
+            container = _ArStream(stream)
+            _name, payload = container.data_member()
+        count = 0
+        pending = set()   # link targets of selected aliases already seen
+        with tarfile.open(fileobj=payload, mode="r|*") as tf:
+            for member in tf:
+                if cancel is not None:
+                    cancel.check()
+                entry = index.add_member(member)
+                if entry is None:
+                    continue
+                if not entry.isfile():
+                    if entry.link and (wanted is None or _is_satellite_alias(entry, wanted)):
+                        pending.add(entry.link)
+                    continue
+                if entry.rel and (wanted is None or _is_satellite_alias(entry, wanted)):
+                    crc = _copy_member(tf, member, os.path.join(staging, *entry.rel.split("/")))
+                    if crc is not None:
+                        manifest.add_file(entry.rel, entry.size, crc)
+                        count += 1
+                elif wanted is not None and (entry.name in pending or _srp_orbital_from_rel(entry.rel or "") is None):
+                    # Only a logo can be a link target. One an alias already asked
+                    # for is kept even on scratch; one that may be asked for later
+                    # only in memory, since spilling every logo would fill flash.
+                    src = tf.extractfile(member)
+                    if src is not None and not resolver.add(entry.name, src, entry.size,
+                                                            spill=entry.name in pending):
+                        raise StreamFallback("Logo przed aliasami nie mieści się w pamięci")
+                elif wanted is None and not entry.rel:
+                    # A file outside the picon tree is copied in place of links
+                    # pointing at it; links usually come later, so keep it in memory.
+                    src = tf.extractfile(member)
+                    if src is not None:
+                        resolver.add(entry.name, src, entry.size, spill=entry.name in pending)
+        # Consume trailing tar/ar bytes so the digest covers the whole download.
+        if container is not None:
+            payload.skip_rest()
+        while stream.read(1024 * 128):
+            pass
+        with perf.span("digest"):
+            stream.verify(item.get("digest", ""))
+
+        index.finish()
+        selected = index.selected(satellite)
+        if not selected:
+            if satellite != "*":
+                raise ValueError("Brak piconów SRP dla wybranego satelity: %s" % satellite)
+            raise ValueError("Paczka nie zawiera piconów PNG.")
+        share = wanted is not None and _filesystem_supports_links(staging)
+        firsts = {}   # logo archive name -> alias holding its only copy
+        uses = {}
+        for entry in selected:
+            source = None if entry.isfile() else index.source_of(entry)
+            if source is not None and (wanted is not None or not _linkable(index, entry)):
+                uses[source.name] = uses.get(source.name, 0) + 1
+        # Drop payloads no selected alias uses; the rest go after their last alias.
+        resolver.retain(uses)
+        for entry in selected:
+            if entry.isfile():
+                continue
+            if wanted is not None or index.source_of(entry) is not None and not _linkable(index, entry):
+                source = index.source_of(entry)
+                dst = os.path.join(staging, *entry.rel.split("/"))
+                first = firsts.get(source.name) if source else None
+                if share and first is not None and \
+                        _share_alias(os.path.join(staging, *first.split("/")), first, dst, entry.rel, None, None, manifest):
+                    resolver.release(source.name)
+                    count += 1
+                    continue
+                crc = resolver.copy_to(source.name, dst) if source else None
+                if crc is None and source is not None and wanted is not None and _is_satellite_alias(source, wanted):
+                    # The target is itself a selected alias, already in staging.
+                    with open(os.path.join(staging, *source.rel.split("/")), "rb") as src:
+                        _replace_path(dst)
+                        crc = _copy_stream(src, dst)
+                if source is not None:
+                    if crc is None:
+                        # A link target that passed before it was known to be needed.
+                        raise StreamFallback("Brak celu aliasu w strumieniu: %s" % entry.rel)
+                    resolver.release(source.name)
+                if crc is not None:
+                    manifest.add_file(entry.rel, source.size, crc)
+                    firsts.setdefault(source.name, entry.rel)
+                    count += 1
+            elif _recreate_link(index, entry, staging):
+                _record_link(manifest, index, entry, staging)
+                count += 1
+        resolver.close()
+        manifest.save(staging)
+
+        _commit_staging(staging, live, target)
+        committed = True
+        _mark_reload(target_path)
+        return {"count": count, "path": target_path, "symlink": symlink_message,
+                "satellite": ((item or {}).get("selected_satellite") or "*").lower(),
+                "bytes": stream.done, "orbitals": _orbital_counts(manifest, satellite)}
+    finally:
+        resolver.close()
+        stream.close()
+        if not committed:
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+@perf.timed("clear")
+def clear_picons(target):
+    """Remove installed picons; with a manifest only the files the plugin wrote.
+
+    The set is moved to the trash first and then deleted with remove_tree();
+    callers that do not need the space at once use move_to_trash() and
+    empty_trash(background=True) instead.
+    """
+    path, _ = ensure_target(target)
     removed = 0
     if not os.path.isdir(path):
         return 0
+    trash = move_to_trash(target)
+    if trash:
+        _replace_path(os.path.join(trash, MANIFEST_NAME))
+        return remove_tree(os.path.dirname(trash))
+    manifest = InstallManifest.load(path)
+    if manifest is not None:
+        for rel in manifest.records:
+            try:
+                os.unlink(os.path.join(path, *rel.split("/")))
+                removed += 1
+            except OSError:
+                pass
+        _replace_path(os.path.join(path, MANIFEST_NAME))
+        for root, dirs, _files in os.walk(path, topdown=False):
+            for name in dirs:
+                try:
+                    os.rmdir(os.path.join(root, name))
+                except OSError:
+                    pass
+        return removed
     for root, dirs, files in os.walk(path, topdown=False):
         for name in files:
             full = os.path.join(root, name)
@@ -540,3 +2288,160 @@ def clear_picons(target):
             except Exception:
                 pass
     return removed
+
+
+PACKAGE_CACHE_DIR = "piconupdater-cache"
+PACKAGE_CACHE_LIMIT = 256 * 1024 * 1024
+# /tmp lives in RAM on most receivers; without HDD/USB only a small cache is kept.
+TMP_PACKAGE_CACHE_LIMIT = 64 * 1024 * 1024
+
+
+def package_cache_dir():
+    """Package cache on the first mounted HDD/USB, or in /tmp when none is present."""
+    for target in storage_targets():
+        if target["id"] != "flash":
+            return os.path.join(os.path.dirname(target["path"]), PACKAGE_CACHE_DIR)
+    return os.path.join("/tmp", PACKAGE_CACHE_DIR)
+
+
+class PackageCache(object):
+    """Downloaded packages addressed by SHA256 digest (or asset id), evicted LRU.
+
+    The mtime of an entry records its last use. lookup() checks size and digest
+    again before an entry is reused, so a damaged file is dropped instead of
+    being installed.
+    """
+
+    SUFFIXES = (".ipk", ".tar.xz")
+
+    def __init__(self, root=None, limit=PACKAGE_CACHE_LIMIT):
+        self.root = root or package_cache_dir()
+        self.limit = int(limit)
+        if self.root.startswith("/tmp/"):
+            self.limit = min(self.limit, TMP_PACKAGE_CACHE_LIMIT)
+
+    @staticmethod
+    def key(item):
+        digest = _sha256_hex((item or {}).get("digest", ""))
+        if digest:
+            return "sha256-" + digest
+        asset_id = int((item or {}).get("asset_id") or 0)
+        return "asset-%d" % asset_id if asset_id else ""
+
+    def path_for(self, item):
+        """Cache path an item is downloaded to; "" without a stable key or when it cannot fit."""
+        key = self.key(item)
+        if not key or self.limit <= 0 or int(item.get("size") or 0) > self.limit:
+            return ""
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        suffix = ".tar.xz" if item.get("format") == "tar.xz" else ".ipk"
+        return os.path.join(self.root, key + suffix)
+
+    def lookup(self, item):
+        """Return the verified cached package for item, or ""."""
+        key = self.key(item)
+        if not key or self.limit <= 0:
+            return ""
+        suffix = ".tar.xz" if item.get("format") == "tar.xz" else ".ipk"
+        path = os.path.join(self.root, key + suffix)
+        if not os.path.isfile(path):
+            return ""
+        size = int(item.get("size") or 0)
+        intact = not size or os.path.getsize(path) == size
+        digest = _sha256_hex(item.get("digest", ""))
+        if intact and digest:
+            hasher = hashlib.sha256()
+            with perf.span("digest"), open(path, "rb") as f:
+                while True:
+                    chunk = f.read(1024 * 256)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+            intact = hasher.hexdigest() == digest
+        if not intact:
+            self.remove(path)
+            return ""
+        os.utime(path, None)
+        return path
+
+    def entries(self):
+        """(mtime, size, path) of complete cache entries, least recently used first."""
+        out = []
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return out
+        for name in names:
+            if not name.endswith(self.SUFFIXES):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            out.append((st.st_mtime, st.st_size, path))
+        out.sort()
+        return out
+
+    def usage(self):
+        """(entries, bytes) including partial downloads waiting to be resumed."""
+        count, total = 0, 0
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return 0, 0
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(self.root, name))
+            except OSError:
+                continue
+            if name.endswith(self.SUFFIXES):
+                count += 1
+        return count, total
+
+    def evict(self, keep="", reserve=0):
+        """Drop least recently used entries until the cache, plus reserve bytes
+        about to be downloaded, fits its limit."""
+        entries = self.entries()
+        total = sum(size for _mtime, size, _path in entries) + reserve
+        removed = 0
+        for _mtime, size, path in entries:
+            if total <= self.limit:
+                break
+            if path == keep:
+                continue
+            self.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def settle(self, path):
+        """After an install from path: keep it for reinstalls within the limit.
+
+        The limit also bounds a cache in /tmp, where it is the smaller
+        TMP_PACKAGE_CACHE_LIMIT since /tmp is RAM on most receivers.
+        """
+        try:
+            too_big = os.path.getsize(path) > self.limit
+        except OSError:
+            too_big = False
+        if too_big:
+            self.remove(path)
+        self.evict(keep=path)
+
+    def remove(self, path):
+        for name in (path, path + ".part", path + ".part.json"):
+            try:
+                os.unlink(name)
+            except OSError:
+                pass
+
+    def purge(self):
+        count, total = self.usage()
+        shutil.rmtree(self.root, ignore_errors=True)
+        return count, total
+
+
+if __name__ == "__main__" and "--install-worker" in sys.argv:
+    sys.exit(_worker_main())
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Manual benchmarks; not collected by the test runner.
+
+    python tests/benchmarks.py links
+    python tests/benchmarks.py segments
+"""
+import io
+import os
+import random
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import catalog
+import storage
+
+
+def build_srp_tar_xz(path, logos, aliases_per_logo=3, logo_size=4096):
+    """Write an upstream-like tar.xz: logos/ payloads plus 13.0E SRP symlink aliases."""
+    rnd = random.Random(logos)
+    with tarfile.open(path, 'w:xz') as tf:
+        for i in range(logos):
+            payload = bytes(bytearray(rnd.getrandbits(8) for _ in range(logo_size)))
+            info = tarfile.TarInfo('picon/logos/logo%05d.png' % i)
+            info.size = len(payload)
+            tf.addfile(info, io.BytesIO(payload))
+        for i in range(logos):
+            for j in range(aliases_per_logo):
+                sym = tarfile.TarInfo('picon/1_0_1_%X_%X_1_820000_0_0_0.png' % (i + 1, j + 1))
+                sym.type = tarfile.SYMTYPE
+                sym.linkname = 'logos/logo%05d.png' % i
+                tf.addfile(sym)
+
+
+def bench_links(sizes=(250, 500, 1000, 2000)):
+    tmp = tempfile.mkdtemp(prefix='piconupdater-bench-')
+    try:
+        print('%8s %10s %10s %12s' % ('logos', 'archive', 'seconds', 'us/alias'))
+        for logos in sizes:
+            package = os.path.join(tmp, 'bench-%d.tar.xz' % logos)
+            build_srp_tar_xz(package, logos)
+            target = {'id': 'flash', 'label': 'bench', 'path': os.path.join(tmp, 'target-%d' % logos)}
+            item = {'format': 'tar.xz', 'type': 'srp', 'selected_satellite': '13e'}
+            index = storage.build_archive_index(package, item)
+            started = time.time()
+            result = storage.install_package(package, item, target, index=index)
+            elapsed = time.time() - started
+            print('%8d %9dK %10.3f %12.1f' % (
+                logos, os.path.getsize(package) // 1024, elapsed,
+                elapsed * 1e6 / max(1, result['count'])))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench_segments(size=4 * 1024 * 1024, rate=1024 * 1024, counts=(1, 2, 4, 8)):
+    """Download through a local server throttled per connection, like a CDN edge."""
+    from test_core import LocalServer
+    payload = os.urandom(size)
+    tmp = tempfile.mkdtemp(prefix='piconupdater-bench-')
+    try:
+        print('%8s %10s %10s' % ('segments', 'seconds', 'MB/s'))
+        with LocalServer({'/pkg.ipk': payload}, rate=rate) as server:
+            for segments in counts:
+                dest = os.path.join(tmp, 'pkg-%d.ipk' % segments)
+                started = time.time()
+                catalog.download_file(server.url('/pkg.ipk'), dest, segments=segments)
+                elapsed = time.time() - started
+                print('%8d %10.2f %10.2f' % (segments, elapsed, size / elapsed / 1048576.0))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+BENCHMARKS = {
+    'links': bench_links,
+    'segments': bench_segments,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+    for name in names:
+        print('== %s' % name)
+        BENCHMARKS[name]()
@@ -1,17 +1,35 @@
 # -*- coding: utf-8 -*-
+import gzip
+import hashlib
 import io
+import json
 import os
 import shutil
 import sys
 import tarfile
 import tempfile
+import threading
 import unittest
+import zlib
+
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from unittest import mock
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    mock = None
 
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
 import catalog
+import jobs
+import perf
 import storage
 
 
@@ -83,6 +101,95 @@ def build_satellite_test_ipk(path):
                 f.write(b'\n')
 
 
+class LocalServer(object):
+    """Serve in-memory payloads over plain HTTP on 127.0.0.1 for download tests."""
+
+    def __init__(self, files, drop_after=None, ranges=True, rate=None, compress=False, headers=None):
+        self.files = files
+        self.requests = []
+        self.compress = compress
+        self.headers = dict(headers or {})
+        # Byte counts after which successive responses are cut off mid-transfer.
+        self.drop_after = list(drop_after or [])
+        self.ranges = ranges
+        # Optional per-connection throttle in bytes/s, like a CDN edge.
+        self.rate = rate
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                owner.requests.append((self.path, dict(self.headers)))
+                payload = owner.files.get(self.path)
+                if payload is None:
+                    self.send_error(404)
+                    return
+                etag = '"%s"' % hashlib.sha256(payload).hexdigest()[:16]
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                if owner.compress and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+                    buf = io.BytesIO()
+                    with gzip.GzipFile(fileobj=buf, mode='wb') as gz:
+                        gz.write(payload)
+                    payload = buf.getvalue()
+                start, end = 0, len(payload) - 1
+                wanted = self.headers.get('Range')
+                if_range = self.headers.get('If-Range')
+                if owner.ranges and wanted and (not if_range or if_range == etag):
+                    first, _dash, last = wanted.split('=', 1)[1].partition('-')
+                    start = int(first)
+                    end = int(last) if last else end
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(payload)))
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Length', str(end - start + 1))
+                self.send_header('ETag', etag)
+                if owner.ranges:
+                    self.send_header('Accept-Ranges', 'bytes')
+                if owner.compress and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+                    self.send_header('Content-Encoding', 'gzip')
+                for key, value in owner.headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                body = payload[start:end + 1]
+                if owner.drop_after:
+                    body = body[:owner.drop_after.pop(0)]
+                if not owner.rate:
+                    self.wfile.write(body)
+                    return
+                chunk = max(1024, owner.rate // 20)
+                for pos in range(0, len(body), chunk):
+                    self.wfile.write(body[pos:pos + chunk])
+                    time.sleep(float(chunk) / owner.rate)
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.httpd = Server(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d%s' % (self.httpd.server_address[1], path)
+
+    def __enter__(self):
+        self.thread.start()
+        self.patch = mock.patch.object(catalog, '_safe_url', lambda url: True)
+        self.patch.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.patch.stop()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
 class CatalogTests(unittest.TestCase):
     def test_parse_current_asset(self):
         name = 'enigma2-plugin-picons-srp-full.220x132-190x102.dark.on.transparent_2026-08-14--12-51-19_all.ipk'
@@ -94,6 +201,178 @@ class CatalogTests(unittest.TestCase):
         self.assertEqual(parsed['logotype'], 'dark')
         self.assertEqual(parsed['background'], 'transparent')
 
+    def test_download_resumes_after_dropped_connection(self):
+        payload = os.urandom(300 * 1024)
+        digest = 'sha256:' + hashlib.sha256(payload).hexdigest()
+        tmp = tempfile.mkdtemp(prefix='piconupdater-test-')
+        try:
+            dest = os.path.join(tmp, 'pkg.ipk')
+            with LocalServer({'/pkg.ipk': payload}, drop_after=[100 * 1024, 50 * 1024]) as server:
+                # First call gives up after one cut-off attempt and keeps the .part file.
+                with self.assertRaises(IOError):
+                    catalog.download_file(server.url('/pkg.ipk'), dest, expected_digest=digest, attempts=1)
+                self.assertEqual(os.path.getsize(dest + '.part'), 100 * 1024)
+                seen = []
+                done = catalog.download_file(server.url('/pkg.ipk'), dest, expected_digest=digest,
+                                             progress=lambda d, t: seen.append((d, t)), backoff=0)
+            self.assertEqual(done, len(payload))
+            with open(dest, 'rb') as f:
+                self.assertEqual(f.read(), payload)
+            self.assertFalse(os.path.exists(dest + '.part'))
+            self.assertFalse(os.path.exists(dest + '.part.json'))
+            ranges = [h.get('Range') for _p, h in server.requests]
+            self.assertEqual(ranges, [None, 'bytes=102400-', 'bytes=153600-'])
+            self.assertTrue(all(h.get('If-Range') for _p, h in server.requests[1:]))
+            self.assertEqual(seen[-1], (len(payload), len(payload)))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def test_segmented_download_and_single_stream_fallback(self):
+        payload = os.urandom(512 * 1024 + 7)
+        digest = 'sha256:' + hashlib.sha256(payload).hexdigest()
+        tmp = tempfile.mkdtemp(prefix='piconupdater-test-')
+        try:
+            with mock.patch.object(catalog, 'SEGMENT_MIN_BYTES', 64 * 1024):
+                for ranges in (True, False):
+                    dest = os.path.join(tmp, 'pkg-%s.ipk' % ranges)
+                    seen = []
+                    with LocalServer({'/pkg.ipk': payload}, ranges=ranges) as server:
+                        done = catalog.download_file(server.url('/pkg.ipk'), dest, expected_digest=digest,
+                                                     progress=lambda d, t: seen.append((d, t)), segments=4)
+                    self.assertEqual(done, len(payload))
+                    with open(dest, 'rb') as f:
+                        self.assertEqual(f.read(), payload)
+                    self.assertEqual(seen[-1], (len(payload), len(payload)))
+                    ranged = [h.get('Range') for _p, h in server.requests if h.get('Range')]
+                    # Probe plus four segments, or just the probe before falling back.
+                    self.assertEqual(len(ranged), 5 if ranges else 1)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def test_conditional_gzip_catalog_refresh(self):
+        releases = [{'tag_name': '2026-08-14', 'published_at': '2026-08-14T12:51:19Z', 'assets': [{
+            'name': 'enigma2-plugin-picons-srp-full.100x60-86x46.dark.on.transparent_2026-08-14--12-51-19_all.ipk',
+            'browser_download_url': 'https://github.com/picons/picons/releases/download/x/a.ipk',
+            'size': 10, 'id': 1}]}]
+        tmp = tempfile.mkdtemp(prefix='piconupdater-test-')
+        try:
+            with LocalServer({'/releases': json.dumps(releases).encode('utf-8')}, compress=True) as server, \
+                    mock.patch.object(catalog, 'CACHE_FILE', os.path.join(tmp, 'cache.json')), \
+                    mock.patch.object(catalog, 'GITHUB_RELEASES_API', server.url('/releases')):
+                items, status = catalog.get_catalog(ROOT, force=True)
+                self.assertEqual(status['message'], 'github')
+                self.assertEqual(len([x for x in items if x['source'] == 'picons/picons']), 1)
+                self.assertIn('gzip', server.requests[0][1].get('Accept-Encoding'))
+                items, status = catalog.get_catalog(ROOT, force=True)
+                self.assertEqual(status['message'], 'github 304')
+                self.assertTrue(server.requests[1][1].get('If-None-Match'))
+                self.assertEqual(len([x for x in items if x['source'] == 'picons/picons']), 1)
+                # An exhausted quota is remembered; the next refresh stays off the network.
+                server.headers['X-RateLimit-Remaining'] = '0'
+                server.headers['X-RateLimit-Reset'] = str(int(time.time()) + 600)
+                server.files['/releases'] += b' '
+                catalog.get_catalog(ROOT, force=True)
+                items, status = catalog.get_catalog(ROOT, force=True)
+                self.assertEqual(len(server.requests), 3)
+                self.assertTrue(status['cached'])
+                self.assertIn('rate limit', status['message'])
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def test_incremental_release_discovery(self):
+        def release(tag, logotype):
+            stamp = tag + 'T12:00:00Z'
+            name = 'enigma2-plugin-picons-srp-full.100x60-86x46.%s.on.transparent_%s--12-00-00_all.ipk' % (logotype, tag)
+            return {'tag_name': tag, 'published_at': stamp, 'assets': [{
+                'name': name, 'size': 10, 'id': 1,
+                'browser_download_url': 'https://github.com/picons/picons/releases/download/%s/%s' % (tag, name)}]}
+
+        def remote(items):
+            return dict((x['logotype'], x['release_tag']) for x in items if x['source'] == 'picons/picons')
+
+        tmp = tempfile.mkdtemp(prefix='piconupdater-test-')
+        files = {
+            '/releases?per_page=2': json.dumps([release('2026-08-02', 'dark'), release('2026-08-01', 'light')]).encode('utf-8'),
+            '/releases?per_page=2&page=2': json.dumps([release('2026-07-01', 'white')]).encode('utf-8'),
+        }
+        try:
+            with LocalServer(files) as server, \
+                    mock.patch.object(catalog, 'CACHE_FILE', os.path.join(tmp, 'cache.json')), \
+                    mock.patch.object(catalog, 'GITHUB_RELEASES_API', server.url('/releases?per_page=2')):
+                items, _status = catalog.get_catalog(ROOT, force=True)
+                self.assertEqual(remote(items), {'dark': '2026-08-02', 'light': '2026-08-01'})
+                self.assertEqual(len(server.requests), 1)
+                # Two new releases fill page one, so page two is read until the known tag.
+                server.files = {
+                    '/releases?per_page=2': json.dumps([release('2026-08-04', 'dark'), release('2026-08-03', 'black')]).encode('utf-8'),
+                    '/releases?per_page=2&page=2': json.dumps([release('2026-08-02', 'dark'), release('2026-08-01', 'light')]).encode('utf-8'),
+                    '/releases?per_page=2&page=3': json.dumps([release('2026-07-01', 'white')]).encode('utf-8'),
+                }
+                items, _status = catalog.get_catalog(ROOT, force=True)
+                self.assertEqual(remote(items), {'dark': '2026-08-04', 'black': '2026-08-03', 'light': '2026-08-01'})
+                self.assertEqual([p for p, _h in server.requests[1:]], ['/releases?per_page=2', '/releases?per_page=2&page=2'])
+                # Older history is only read on demand, one page at a time.
+                items, _status, added = catalog.load_older_releases(ROOT)
+                self.assertEqual(added, 0)
+                items, _status, added = catalog.load_older_releases(ROOT)
+                self.assertEqual(added, 1)
+                self.assertEqual(remote(items)['white'], '2026-07-01')
+                self.assertEqual(remote(catalog.load_cache()[1])['dark'], '2026-08-04')
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def test_streaming_release_parser(self):
+        good = 'enigma2-plugin-picons-srp-full.100x60-86x46.dark.on.transparent_2026-08-14--12-51-19_all.ipk'
+        releases = [
+            {'url': 'x', 'tag_name': '2026-08-14', 'draft': False, 'prerelease': False, 'published_at': '2026-08-14T12:51:19Z',
+             'author': {'login': 'a', 'name': 'tag_name', 'site_admin': True},
+             'body': 'Notes with "quotes", \\ slashes, {braces} [brackets] and \u0142\u00f3d\u017a' * 400,
+             'assets': [
+                 {'url': 'u', 'id': 7, 'name': 'README-%d.txt' % n, 'label': None,
+                  'uploader': {'login': 'b', 'name': good}, 'size': 99, 'browser_download_url': 'https://x/%d' % n}
+                 for n in range(300)] + [
+                 {'url': 'u', 'id': 1, 'uploader': {'login': 'b', 'name': 'README.txt'}, 'name': good, 'label': '', 'size': 10,
+                  'digest': 'sha256:' + '0' * 64, 'browser_download_url': 'https://github.com/picons/picons/releases/download/x/good.ipk'}]},
+            {'tag_name': '2026-08-01', 'draft': True, 'published_at': None, 'assets': []},
+        ]
+        raw = json.dumps(releases, indent=1).encode('utf-8')
+        stream = catalog._JsonReleaseStream(io.BytesIO(raw), chunk_size=7)
+        peak = [0]
+        fill = stream._fill
+
+        def tracked_fill():
+            peak[0] = max(peak[0], len(stream._buf))
+            return fill()
+        stream._fill = tracked_fill
+        parsed = list(stream)
+        self.assertEqual([r['tag_name'] for r in parsed], ['2026-08-14', '2026-08-01'])
+        self.assertEqual(parsed[0]['assets'], [{'name': good, 'id': 1, 'size': 10, 'digest': 'sha256:' + '0' * 64,
+                                                'browser_download_url': 'https://github.com/picons/picons/releases/download/x/good.ipk'}])
+        self.assertEqual((parsed[0]['draft'], parsed[1]['draft'], parsed[1]['published_at']), (False, True, None))
+        self.assertNotIn('body', parsed[0])
+        self.assertLess(peak[0], 1024)
+        self.assertGreater(len(raw), 100 * 1024)
+        items = catalog._catalog_from_releases(parsed)
+        self.assertEqual([x['name'] for x in items], [good])
+
+    def test_local_catalog_and_diff_for_background_refresh(self):
+        tmp = tempfile.mkdtemp(prefix='piconupdater-test-')
+        try:
+            with mock.patch.object(catalog, 'CACHE_FILE', os.path.join(tmp, 'cache.json')), \
+                    mock.patch.object(catalog, 'fetch_releases', side_effect=AssertionError('network')):
+                items, status = catalog.local_catalog(ROOT)
+                self.assertFalse(status['cached'])
+                self.assertTrue(status['stale'])
+                catalog.save_cache(items[:3], fetched_at='2000-01-01T00:00:00Z')
+                cached, status = catalog.local_catalog(ROOT)
+                self.assertTrue(status['cached'] and status['stale'])
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        newer = [dict(cached[0], published_at='2099-01-01T00:00:00Z'), cached[1]]
+        newer.append(dict(cached[2], variant_key='extra'))
+        added, updated = catalog.catalog_diff(cached, newer)
+        self.assertEqual((added, updated), (['extra'], [cached[0]['variant_key']]))
+
     def test_variant_update_flags(self):
         item = catalog.normalize_item({
             'source':'picons/picons', 'type':'srp', 'scope':'full', 'canvas':'100x60',
@@ -107,6 +386,39 @@ class CatalogTests(unittest.TestCase):
         self.assertIn('UPDATE', flags)
         self.assertIn('NEW', flags)
 
+    def test_catalog_view_matches_item_flags(self):
+        items = catalog._fallback_items(ROOT)
+        items[0] = dict(items[0], published_at='2026-09-01T00:00:00Z')
+        installed = {items[1]['variant_key']: {'name': 'old.ipk', 'published_at': '2000-01-01T00:00:00Z'},
+                     items[2]['variant_key']: {'name': items[2]['name']}}
+        for seen in ('', '2026-08-20T00:00:00Z'):
+            state = {'installed': installed, 'seen_published_at': seen}
+            view = catalog.CatalogView(items, state)
+            newest = catalog.newest_published(items)
+            expected = [catalog.item_flags(x, state, newest) for x in items]
+            self.assertEqual([view.item_flags(x) for x in items], expected)
+            self.assertEqual(view.update_count, sum('UPDATE' in f for f in expected))
+            self.assertEqual(view.new_count, sum('NEW' in f or 'LATEST' in f for f in expected))
+        self.assertEqual(catalog.iso_epoch('1970-01-02T00:00:00Z'), 86400)
+        self.assertEqual(catalog.iso_epoch(''), 0)
+
+    def test_filter_index_matches_linear_scan(self):
+        items = catalog._merge_catalog(catalog._fallback_items(ROOT), [])
+        index = catalog.FilterIndex(items)
+
+        def linear(filters):
+            return [x for x in items
+                    if all(filters.get(k, '*') in ('*', x.get(k)) for k in catalog.FILTER_KEYS)
+                    and catalog.item_supports_satellite(x, filters.get('satellite', '*'))]
+        self.assertIn('19e', index.options('satellite'))
+        for key in catalog.FILTER_KEYS + ('satellite',):
+            counts = index.counts({'type': 'srp'}, key)
+            for value in ['*'] + index.options(key):
+                filters = {'type': 'srp', key: value} if key != 'type' else {'type': value}
+                self.assertEqual(index.match(filters), linear(filters))
+                self.assertEqual(counts[value], len(linear(filters)))
+        self.assertEqual(index.match({'type': 'srp', 'satellite': '1w', 'canvas': 'nope'}), [])
+
     def test_satellite_scope_helpers(self):
         self.assertEqual(catalog.scope_satellites('13e.19e.23e.28e'), ['13e', '19e', '23e', '28e'])
         self.assertEqual(catalog.satellite_orbital('13e'), 130)
@@ -115,6 +427,18 @@ class CatalogTests(unittest.TestCase):
         self.assertTrue(catalog.item_supports_satellite(item, '13e'))
         self.assertFalse(catalog.item_supports_satellite({'type':'snp','scope':'13e.19e.23e.28e'}, '13e'))
 
+    def test_filter_index_multi_satellite_selection(self):
+        items = [
+            {'type': 'srp', 'scope': 'full', 'variant_key': 'full'},
+            {'type': 'srp', 'scope': '13e', 'variant_key': 'hb'},
+            {'type': 'srp', 'scope': '13e.19e', 'variant_key': 'both'},
+        ]
+        index = catalog.FilterIndex(items)
+        self.assertEqual([i['variant_key'] for i in index.match({'satellite': '13e'})], ['full', 'hb', 'both'])
+        self.assertEqual([i['variant_key'] for i in index.match({'satellite': '13e,19e'})], ['full', 'both'])
+        self.assertEqual(catalog.satellite_set('*'), [])
+        self.assertEqual(catalog.join_satellites([]), '*')
+
     def test_fallback_manifest(self):
         items = catalog._fallback_items(ROOT)
         self.assertGreaterEqual(len(items), 12)
@@ -164,6 +488,493 @@ class StorageTests(unittest.TestCase):
         with open(os.path.join(target_path, '1_0_1_100_200_300_820000_0_0_0.png'), 'rb') as f:
             self.assertEqual(f.read(), b'HOTBIRD')
 
+    def test_multi_satellite_install_in_one_pass(self):
+        ipk = os.path.join(self.tmp, 'sat.ipk')
+        target_path = os.path.join(self.tmp, 'target')
+        build_satellite_test_ipk(ipk)
+        target = {'id': 'flash', 'label': 'test', 'path': target_path}
+        item = {'format': 'ipk', 'type': 'srp', 'selected_satellite': catalog.join_satellites(['19e', '13e', '23e'])}
+        self.assertEqual(item['selected_satellite'], '13e,19e,23e')
+        self.assertTrue(catalog.item_supports_satellite({'type': 'srp', 'scope': 'full'}, item['selected_satellite']))
+        self.assertFalse(catalog.item_supports_satellite({'type': 'srp', 'scope': '13e'}, '13e,19e'))
+        index = storage.build_archive_index(ipk, item)
+        passes = []
+        real_open = index.open_tar
+
+        def open_tar():
+            passes.append(1)
+            return real_open()
+        index.open_tar = open_tar
+        result = storage.install_package(ipk, item, target, index=index)
+        self.assertEqual(len(passes), 1)
+        self.assertEqual(result['count'], 2)
+        self.assertEqual(result['orbitals'], {'13e': 1, '19e': 1, '23e': 0})
+        for name, payload in (('1_0_1_100_200_300_820000_0_0_0.png', b'HOTBIRD'),
+                              ('1_0_1_101_201_301_C00000_0_0_0.png', b'ASTRA')):
+            with open(os.path.join(target_path, name), 'rb') as f:
+                self.assertEqual(f.read(), payload)
+        self.assertFalse(os.path.exists(os.path.join(target_path, 'logos')))
+
+    def test_satellite_mode_writes_each_logo_once(self):
+        pkg = os.path.join(self.tmp, 'sat.tar.xz')
+        aliases = ['1_0_1_%X_200_300_820000_0_0_0.png' % sid for sid in (0x100, 0x101, 0x102)]
+        with tarfile.open(pkg, 'w:xz') as tf:
+            info = tarfile.TarInfo('picon/logos/hotbird.png')
+            info.size = 4096
+            tf.addfile(info, io.BytesIO(b'H' * 4096))
+            for alias in aliases:
+                sym = tarfile.TarInfo('picon/' + alias)
+                sym.type = tarfile.SYMTYPE
+                sym.linkname = 'logos/hotbird.png'
+                tf.addfile(sym)
+        item = {'format': 'tar.xz', 'type': 'srp', 'selected_satellite': '13e'}
+        target_path = os.path.join(self.tmp, 'target')
+        target = {'id': 'flash', 'label': 'test', 'path': target_path}
+        index = storage.build_archive_index(pkg, item)
+        shared = storage._index_required_bytes(index, target_path, '13e')
+        with mock.patch.object(storage, '_filesystem_supports_links', return_value=False):
+            self.assertGreater(storage._index_required_bytes(index, target_path, '13e'), shared)
+        result = storage.install_package(pkg, item, target)
+        self.assertEqual(result['count'], 3)
+        paths = [os.path.join(target_path, a) for a in aliases]
+        self.assertEqual(len(set(os.stat(p).st_ino for p in paths)), 1)
+        with open(paths[2], 'rb') as f:
+            self.assertEqual(f.read(), b'H' * 4096)
+        records = storage.InstallManifest.load(target_path).records
+        self.assertEqual(sorted(r[0] for r in records.values()), ['F', 'H', 'H'])
+        again = storage.install_package(pkg, item, target, existing=storage.installed_snapshot(target_path))
+        self.assertEqual(again['delta']['unchanged'], 3)
+        # FAT: no links, one copy per alias.
+        fat = os.path.join(self.tmp, 'fat')
+        with mock.patch.object(storage, '_filesystem_supports_links', return_value=False):
+            storage.install_package(pkg, item, {'id': 'usb', 'label': 'fat', 'path': fat})
+        self.assertEqual(len(set(os.stat(os.path.join(fat, a)).st_ino for a in aliases)), 3)
+
+    def test_multi_target_install_from_one_pass(self):
+        ipk = os.path.join(self.tmp, 'test.ipk')
+        build_test_ipk(ipk)
+        item = {'format': 'ipk'}
+        flash = {'id': 'flash', 'label': 'Flash', 'path': os.path.join(self.tmp, 'flash')}
+        fat = {'id': 'ext:/media/usb', 'label': 'USB', 'path': os.path.join(self.tmp, 'usb', 'picon')}
+        os.makedirs(flash['path'])
+        with open(os.path.join(flash['path'], 'stale.png'), 'wb') as f:
+            f.write(b'OLD')
+        real_probe = storage._filesystem_supports_links
+        index = storage.build_archive_index(ipk, item)
+        passes = []
+        real_open = index.open_tar
+
+        def open_tar():
+            passes.append(1)
+            return real_open()
+        index.open_tar = open_tar
+        with mock.patch.object(storage, '_filesystem_supports_links',
+                               lambda path: 'usb' not in path and real_probe(path)):
+            result = storage.install_package(ipk, item, [flash, fat], index=index)
+        self.assertEqual(len(passes), 1)
+        self.assertEqual([(t['id'], t['count']) for t in result['targets']], [('flash', 3), ('ext:/media/usb', 3)])
+        # The old set goes like with a single target.
+        self.assertFalse(os.path.exists(os.path.join(flash['path'], 'stale.png')))
+        self.assertTrue(os.path.islink(os.path.join(flash['path'], '1_0_1_TEST.png')))
+        usb_alias = os.path.join(fat['path'], '1_0_1_TEST.png')
+        self.assertFalse(os.path.islink(usb_alias))
+        with open(usb_alias, 'rb') as f:
+            self.assertEqual(f.read(), b'PNGDATA')
+        for target in (flash, fat):
+            self.assertIsNotNone(storage.InstallManifest.load(target['path']))
+        with mock.patch.object(storage, 'empty_trash'):
+            staged = storage.perform_install(ipk, item, [flash, fat])
+        self.assertEqual([t['staged'] for t in staged['targets']], [True, True])
+        for parent in (self.tmp, os.path.join(self.tmp, 'usb')):
+            self.assertEqual([x for x in os.listdir(parent) if 'staging' in x], [])
+        with mock.patch.object(storage, 'free_space', return_value=1):
+            self.assertRaises(IOError, storage.install_package, ipk, item, [flash, fat])
+
+    def test_archive_index_shared_by_all_phases(self):
+        ipk = os.path.join(self.tmp, 'sat.ipk')
+        target_path = os.path.join(self.tmp, 'target')
+        build_satellite_test_ipk(ipk)
+        target = {'id':'flash', 'label':'test', 'path':target_path}
+        item = {'format':'ipk', 'type':'srp', 'selected_satellite':'19e'}
+        index = storage.build_archive_index(ipk, item)
+        self.assertEqual(index.orbital_counts, {130: 1, 192: 1})
+        self.assertEqual(index.orbital_bytes[192], len(b'ASTRA'))
+        self.assertEqual(index.file_bytes, len(b'HOTBIRD') + len(b'ASTRA'))
+        self.assertEqual(storage.validate_package(ipk, item, index=index), 1)
+        self.assertGreater(storage.estimate_install_bytes(ipk, item, target, index=index), 0)
+        result = storage.install_package(ipk, item, target, index=index)
+        self.assertEqual(result['count'], 1)
+        with open(os.path.join(target_path, '1_0_1_101_201_301_C00000_0_0_0.png'), 'rb') as f:
+            self.assertEqual(f.read(), b'ASTRA')
+
+    def test_ipk_payload_read_in_place(self):
+        ipk = os.path.join(self.tmp, 'test.ipk')
+        build_test_ipk(ipk)
+        name, offset, size = storage._ar_data_member(ipk)
+        self.assertEqual(name, 'data.tar.gz')
+        with open(ipk, 'rb') as raw:
+            view = storage._BoundedReader(raw, offset, size)
+            self.assertEqual(view.seek(0, 2), size)
+            view.seek(0)
+            with tarfile.open(fileobj=view, mode='r:*') as tf:
+                self.assertIn('picon/logos/testlogo.png', tf.getnames())
+        before = set(os.listdir(tempfile.gettempdir()))
+        storage.validate_package(ipk, {'format':'ipk'})
+        self.assertEqual(set(os.listdir(tempfile.gettempdir())) - before, set())
+
+    def test_link_resolver_spills_to_scratch(self):
+        resolver = storage._LinkResolver(self.tmp, memory_limit=4)
+        resolver.add('small', io.BytesIO(b'abc'), 3, refs=2)
+        resolver.add('large', io.BytesIO(b'PNGDATA'), 7)
+        self.assertEqual(len([x for x in os.listdir(self.tmp) if 'scratch' in x]), 1)
+        self.assertTrue(resolver.copy_to('large', os.path.join(self.tmp, 'out', 'a.png')))
+        self.assertTrue(resolver.copy_to('small', os.path.join(self.tmp, 'out', 'b.png')))
+        resolver.release('small')
+        self.assertIn('small', resolver)
+        resolver.release('small')
+        self.assertNotIn('small', resolver)
+        resolver.close()
+        self.assertEqual([x for x in os.listdir(self.tmp) if 'scratch' in x], [])
+        with open(os.path.join(self.tmp, 'out', 'a.png'), 'rb') as f:
+            self.assertEqual(f.read(), b'PNGDATA')
+
+    def test_links_dereferenced_without_link_support(self):
+        ipk = os.path.join(self.tmp, 'test.ipk')
+        target_path = os.path.join(self.tmp, 'target')
+        build_test_ipk(ipk)
+        target = {'id':'flash', 'label':'test', 'path':target_path}
+        original = storage._filesystem_supports_links
+        storage._filesystem_supports_links = lambda path: False
+        try:
+            result = storage.install_package(ipk, {'format':'ipk'}, target)
+        finally:
+            storage._filesystem_supports_links = original
+        self.assertEqual(result['count'], 3)
+        for name in ('1_0_1_TEST.png', '1_0_1_HARD.png'):
+            path = os.path.join(target_path, name)
+            self.assertFalse(os.path.islink(path))
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'PNGDATA')
+
+    def test_link_to_file_outside_picon_tree_is_copied(self):
+        for target_first in (True, False):
+            pkg = os.path.join(self.tmp, 'outside.tar.xz')
+            with tarfile.open(pkg, 'w:xz') as tf:
+                info = tarfile.TarInfo('usr/share/logo.dat')
+                info.size = 4
+                sym = tarfile.TarInfo('picon/1_0_1_OUT.png')
+                sym.type = tarfile.SYMTYPE
+                sym.linkname = '../usr/share/logo.dat'
+                members = [(info, io.BytesIO(b'LOGO')), (sym, None)]
+                for member, data in (members if target_first else members[::-1]):
+                    tf.addfile(member, data)
+            with open(pkg, 'rb') as f:
+                payload = f.read()
+            item = {'format': 'tar.xz', 'digest': 'sha256:' + hashlib.sha256(payload).hexdigest()}
+            for mode in ('file', 'stream'):
+                target_path = os.path.join(self.tmp, mode)
+                target = {'id': 'flash', 'label': 'test', 'path': target_path}
+                if mode == 'file':
+                    result = storage.install_package(pkg, item, target)
+                else:
+                    with LocalServer({'/outside.tar.xz': payload}) as server:
+                        result = storage.stream_install_package(server.url('/outside.tar.xz'), item, target)
+                self.assertEqual(result['count'], 1)
+                alias = os.path.join(target_path, '1_0_1_OUT.png')
+                self.assertFalse(os.path.islink(alias))
+                with open(alias, 'rb') as f:
+                    self.assertEqual(f.read(), b'LOGO')
+                shutil.rmtree(target_path)
+
+    def test_stream_install_commits_only_after_digest(self):
+        ipk = os.path.join(self.tmp, 'sat.ipk')
+        build_satellite_test_ipk(ipk)
+        with open(ipk, 'rb') as f:
+            payload = f.read()
+        digest = 'sha256:' + hashlib.sha256(payload).hexdigest()
+        target_path = os.path.join(self.tmp, 'target')
+        os.makedirs(target_path)
+        with open(os.path.join(target_path, 'old.png'), 'wb') as f:
+            f.write(b'OLD')
+        target = {'id':'flash', 'label':'test', 'path':target_path}
+        item = {'format':'ipk', 'type':'srp', 'selected_satellite':'13e', 'digest':'sha256:' + '0' * 64}
+        with LocalServer({'/sat.ipk': payload}) as server:
+            with self.assertRaises(IOError):
+                storage.stream_install_package(server.url('/sat.ipk'), item, target)
+            self.assertTrue(os.path.exists(os.path.join(target_path, 'old.png')))
+            self.assertFalse(os.path.exists(storage._staging_path(target_path)))
+            item['digest'] = digest
+            result = storage.stream_install_package(server.url('/sat.ipk'), item, target)
+        self.assertEqual(result['count'], 1)
+        self.assertEqual(result['bytes'], len(payload))
+        self.assertFalse(os.path.exists(os.path.join(target_path, 'old.png')))
+        self.assertFalse(os.path.exists(storage._staging_path(target_path)))
+        with open(os.path.join(target_path, '1_0_1_100_200_300_820000_0_0_0.png'), 'rb') as f:
+            self.assertEqual(f.read(), b'HOTBIRD')
+
+    def test_stream_satellite_caches_only_link_targets(self):
+        def release(path, logos_first):
+            with tarfile.open(path, 'w:xz') as tf:
+                members = []
+                for name in ('hotbird', 'astra', 'unused'):
+                    info = tarfile.TarInfo('picon/logos/%s.png' % name)
+                    info.size = 2048
+                    members.append((info, io.BytesIO(name[0].encode('ascii') * 2048)))
+                for sid, logo in ((0x100, 'hotbird'), (0x101, 'hotbird'), (0x102, 'astra')):
+                    sym = tarfile.TarInfo('picon/1_0_1_%X_200_300_820000_0_0_0.png' % sid)
+                    sym.type = tarfile.SYMTYPE
+                    sym.linkname = 'logos/%s.png' % logo
+                    members.append((sym, None))
+                if not logos_first:
+                    members = members[3:] + members[:3]
+                for info, data in members:
+                    tf.addfile(info, data)
+            with open(path, 'rb') as f:
+                return f.read()
+        target = {'id': 'flash', 'label': 'test', 'path': os.path.join(self.tmp, 'target')}
+        cached = []
+        real_add = storage._LinkResolver.add
+
+        def add(resolver, name, *args, **kwargs):
+            cached.append((name, kwargs.get('spill', True)))
+            return real_add(resolver, name, *args, **kwargs)
+        aliases_first = release(os.path.join(self.tmp, 'a.tar.xz'), False)
+        logos_first = release(os.path.join(self.tmp, 'l.tar.xz'), True)
+        item = {'format': 'tar.xz', 'type': 'srp', 'selected_satellite': '13e'}
+        with LocalServer({'/a.tar.xz': aliases_first, '/l.tar.xz': logos_first}) as server, \
+                mock.patch.object(storage._LinkResolver, 'add', add):
+            result = storage.stream_install_package(server.url('/a.tar.xz'), item, target)
+            self.assertEqual(result['count'], 3)
+            # Logos an alias asked for may spill; any other is held in memory only.
+            self.assertEqual(sorted(cached), [('picon/logos/astra.png', True), ('picon/logos/hotbird.png', True),
+                                              ('picon/logos/unused.png', False)])
+            with open(os.path.join(target['path'], '1_0_1_102_200_300_820000_0_0_0.png'), 'rb') as f:
+                self.assertEqual(f.read(), b'a' * 2048)
+            # Logos ahead of their aliases are held in memory only.
+            with mock.patch.object(storage, '_LINK_CACHE_MEMORY', 3000):
+                with self.assertRaises(storage.StreamFallback):
+                    storage.stream_install_package(server.url('/l.tar.xz'), item, target)
+            self.assertFalse(os.path.exists(storage._staging_path(target['path'])))
+            with mock.patch.object(storage, 'free_space', return_value=1024):
+                self.assertFalse(storage.stream_install_fits({'size': 1024 * 1024}, target))
+                with self.assertRaises(storage.StreamFallback):
+                    storage.stream_install_package(server.url('/a.tar.xz'), dict(item, size=1024 * 1024), target)
+
+    def test_delta_update_writes_only_changes(self):
+        def release(path, logos, links):
+            with tarfile.open(path, 'w:xz') as tf:
+                for name, payload in logos:
+                    info = tarfile.TarInfo('picon/logos/%s.png' % name)
+                    info.size = len(payload)
+                    tf.addfile(info, io.BytesIO(payload))
+                for alias, logo in links:
+                    sym = tarfile.TarInfo('picon/%s.png' % alias)
+                    sym.type = tarfile.SYMTYPE
+                    sym.linkname = 'logos/%s.png' % logo
+                    tf.addfile(sym)
+
+        old_pkg = os.path.join(self.tmp, 'old.tar.xz')
+        new_pkg = os.path.join(self.tmp, 'new.tar.xz')
+        release(old_pkg, [('a', b'AAAA'), ('b', b'BBBB'), ('gone', b'GONE')], [('1_0_1_A', 'a'), ('1_0_1_B', 'b')])
+        release(new_pkg, [('a', b'AAAA'), ('b', b'bbbb'), ('c', b'CC')], [('1_0_1_A', 'a'), ('1_0_1_B', 'c')])
+        target_path = os.path.join(self.tmp, 'target')
+        target = {'id': 'flash', 'label': 'test', 'path': target_path}
+        item = {'format': 'tar.xz'}
+        storage.install_package(old_pkg, item, target)
+        untouched = os.path.join(target_path, 'logos', 'a.png')
+        os.utime(untouched, (1, 1))
+        existing = storage.installed_snapshot(target_path)
+        self.assertEqual(existing['1_0_1_A.png'], ('sym', os.path.join('logos', 'a.png')))
+        result = storage.install_package(new_pkg, item, target, existing=existing)
+        self.assertEqual(result['delta'], {'added': 1, 'changed': 2, 'unchanged': 2, 'removed': 1})
+        self.assertEqual(os.stat(untouched).st_mtime, 1)
+        self.assertFalse(os.path.exists(os.path.join(target_path, 'logos', 'gone.png')))
+        with open(os.path.join(target_path, '1_0_1_B.png'), 'rb') as f:
+            self.assertEqual(f.read(), b'CC')
+        with open(os.path.join(target_path, 'logos', 'b.png'), 'rb') as f:
+            self.assertEqual(f.read(), b'bbbb')
+
+    def test_manifest_records_install_and_limits_clear(self):
+        ipk = os.path.join(self.tmp, 'test.ipk')
+        target_path = os.path.join(self.tmp, 'target')
+        build_test_ipk(ipk)
+        target = {'id': 'flash', 'label': 'test', 'path': target_path}
+        result = storage.install_package(ipk, {'format': 'ipk', 'name': 'test.ipk'}, target)
+        manifest = storage.InstallManifest.load(target_path)
+        self.assertEqual(result['manifest'], os.path.join(target_path, storage.MANIFEST_NAME))
+        self.assertEqual(manifest.package, 'test.ipk')
+        logo = manifest.records['logos/testlogo.png']
+        self.assertEqual((logo[0], logo[1], logo[3]), ('F', 7, zlib.crc32(b'PNGDATA') & 0xffffffff))
+        self.assertEqual(manifest.records['1_0_1_TEST.png'], ['L', os.path.join('logos', 'testlogo.png')])
+        self.assertEqual(manifest.records['1_0_1_HARD.png'], ['H', 'logos/testlogo.png'])
+        self.assertEqual(storage.installed_snapshot(target_path)['logos/testlogo.png'][2], logo[3])
+        own = os.path.join(target_path, 'mine.png')
+        with open(own, 'wb') as f:
+            f.write(b'USER')
+        self.assertEqual(storage.clear_picons(target), 3)
+        self.assertEqual(sorted(x for x in os.listdir(target_path) if not x.startswith('.')), ['mine.png'])
+
+    def test_staged_install_swaps_complete_tree(self):
+        ipk = os.path.join(self.tmp, 'test.ipk')
+        build_test_ipk(ipk)
+        target_path = os.path.join(self.tmp, 'target')
+        target = {'id': 'flash', 'label': 'test', 'path': target_path}
+        os.makedirs(os.path.join(target_path, 'logos'))
+        for name, data in (('old.png', b'OLD'), ('logos/testlogo.png', b'OLD'), ('notes.txt', b'keep')):
+            with open(os.path.join(target_path, *name.split('/')), 'wb') as f:
+                f.write(data)
+        seen = []
+
+        def progress(done, total):
+            seen.append(sorted(os.listdir(target_path)))
+        with mock.patch.object(storage, 'empty_trash') as remover:
+            result = storage.staged_install_package(ipk, {'format': 'ipk'}, target, progress=progress)
+        self.assertTrue(result['staged'])
+        # The live tree was untouched while the new set was written.
+        self.assertIn(['logos', 'notes.txt', 'old.png'], seen)
+        remover.assert_called_once_with(os.path.realpath(target_path), background=True)
+        self.assertFalse(os.path.exists(os.path.join(target_path, 'old.png')))
+        self.assertEqual(storage.trash_bytes(target_path), 6)
+        self.assertEqual(storage.empty_trash(target_path), 2)
+        with open(os.path.join(target_path, 'notes.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'keep')
+        with open(os.path.join(target_path, '1_0_1_TEST.png'), 'rb') as f:
+            self.assertEqual(f.read(), b'PNGDATA')
+        self.assertEqual([x for x in os.listdir(self.tmp) if 'piconupdater' in x], [])
+        with mock.patch.object(storage, 'free_space', return_value=1):
+            self.assertIsNone(storage.staged_install_package(ipk, {'format': 'ipk'}, target))
+
+    def test_journal_resumes_install_from_checkpoint(self):
+        pkg = os.path.join(self.tmp, 'set.tar.xz')
+        with tarfile.open(pkg, 'w:xz') as tf:
+            for i in range(10):
+                payload = ('LOGO%02d' % i).encode('ascii')
+                info = tarfile.TarInfo('picon/1_0_1_%d.png' % i)
+                info.size = len(payload)
+                tf.addfile(info, io.BytesIO(payload))
+        target_path = os.path.join(self.tmp, 'target')
+        os.makedirs(target_path)
+        with open(os.path.join(target_path, 'old.png'), 'wb') as f:
+            f.write(b'OLD')
+        target = {'id': 'flash', 'label': 'test', 'path': target_path}
+        item = {'format': 'tar.xz', 'name': 'set', 'digest': 'sha256:' + '0' * 64}
+        journal_path = os.path.join(self.tmp, 'journal.json')
+        journal = storage.InstallJournal(journal_path)
+        journal.begin(item, target, pkg)
+
+        class PowerLoss(Exception):
+            pass
+        real_checkpoint = storage.InstallJournal.checkpoint
+
+        def checkpoint(self, position):
+            real_checkpoint(self, position)
+            if position >= 6:
+                raise PowerLoss()
+        syncs = []
+        # rmtree is disabled so the staging tree survives like it would a power cut.
+        with mock.patch.object(storage, 'CHECKPOINT_EVERY', 3), \
+                mock.patch.object(storage, '_sync', lambda: syncs.append(1)), \
+                mock.patch.object(storage.InstallJournal, 'checkpoint', checkpoint), \
+                mock.patch.object(storage.shutil, 'rmtree'), \
+                mock.patch.object(storage, 'empty_trash'):
+            self.assertRaises(PowerLoss, storage.perform_install, pkg, item, target, journal=journal)
+        self.assertEqual(len(syncs), 2)
+        resumed = storage.InstallJournal.load(journal_path)
+        self.assertEqual((resumed.record['mode'], resumed.record['checkpoint']), ('staged', 6))
+        self.assertEqual(resumed.record['package'], pkg)
+        staging = storage._staging_path(os.path.realpath(target_path))
+        committed = os.path.join(staging, '1_0_1_0.png')
+        os.utime(committed, (1, 1))
+        with open(os.path.join(staging, '1_0_1_6.png'), 'wb') as f:
+            f.write(b'TORN')
+        with mock.patch.object(storage, 'empty_trash'):
+            result = storage.perform_install(pkg, item, target, journal=resumed)
+        resumed.finish()
+        self.assertEqual(result['count'], 10)
+        self.assertFalse(os.path.exists(journal_path))
+        self.assertIsNone(storage.InstallJournal.load(journal_path))
+        self.assertFalse(os.path.exists(staging))
+        # Files below the checkpoint were kept, the rest were written again.
+        self.assertEqual(os.stat(os.path.join(target_path, '1_0_1_0.png')).st_mtime, 1)
+        for i in range(10):
+            with open(os.path.join(target_path, '1_0_1_%d.png' % i), 'rb') as f:
+                self.assertEqual(f.read(), ('LOGO%02d' % i).encode('ascii'))
+        self.assertFalse(os.path.exists(os.path.join(target_path, 'old.png')))
+        # A journal that was not begun, or was replaced on disk, leaves the file alone.
+        first = storage.InstallJournal(journal_path)
+        first.begin(item, target, pkg)
+        second = storage.InstallJournal(journal_path)
+        second.finish()
+        second.begin(item, target, pkg)
+        first.finish()
+        self.assertEqual(storage.InstallJournal.load(journal_path).record['run_id'], second.record['run_id'])
+
+    def test_install_worker_process_reports_and_cancels(self):
+        ipk = os.path.join(self.tmp, 'test.ipk')
+        build_test_ipk(ipk)
+        target = {'id': 'flash', 'label': 'test', 'path': os.path.join(self.tmp, 'target')}
+        self.assertTrue(storage._worker_command())
+        seen = []
+        worker = storage.InstallWorker(ipk, {'format': 'ipk'}, target)
+        result = worker.run(progress=lambda done, total: seen.append((done, total)))
+        self.assertIsNotNone(worker.proc)
+        self.assertEqual(result['count'], 3)
+        self.assertEqual(seen[-1], (3, 3))
+        with open(os.path.join(target['path'], '1_0_1_TEST.png'), 'rb') as f:
+            self.assertEqual(f.read(), b'PNGDATA')
+        self.assertEqual(worker.proc.wait(), 0)
+        # A cancelled job leaves neither its journal nor a staging tree behind.
+        journal = storage.InstallJournal(os.path.join(self.tmp, 'journal.json'))
+        journal.begin({'format': 'ipk'}, target, ipk)
+        worker = storage.InstallWorker(ipk, {'format': 'ipk'}, target, journal=journal)
+        worker.cancel()
+        self.assertRaises(storage.InstallCancelled, worker.run)
+        self.assertIsNone(storage.InstallJournal.load(journal.path))
+        self.assertEqual([x for x in os.listdir(self.tmp) if 'staging' in x], [])
+        broken = storage.InstallWorker(os.path.join(self.tmp, 'missing.ipk'), {'format': 'ipk'}, target)
+        self.assertRaises(IOError, broken.run)
+
+    def test_package_cache_reuse_integrity_and_lru(self):
+        root = os.path.join(self.tmp, 'cache')
+        cache = storage.PackageCache(root=root, limit=25)
+        payloads = [('a', b'x' * 10), ('b', b'y' * 10), ('c', b'z' * 10)]
+        items = []
+        for name, data in payloads:
+            item = {'name': name, 'size': len(data), 'digest': 'sha256:' + hashlib.sha256(data).hexdigest()}
+            path = cache.path_for(item)
+            with open(path, 'wb') as f:
+                f.write(data)
+            items.append(item)
+            os.utime(path, (len(items), len(items)))
+        self.assertEqual(cache.path_for({'name': 'nokey'}), '')
+        # A reused entry becomes most recently used and survives eviction.
+        self.assertEqual(cache.lookup(items[0]), cache.path_for(items[0]))
+        self.assertEqual(cache.evict(), 1)
+        self.assertEqual(cache.lookup(items[1]), '')
+        self.assertEqual(cache.usage(), (2, 20))
+        # Damaged content is rejected and dropped on lookup.
+        with open(cache.path_for(items[2]), 'wb') as f:
+            f.write(b'q' * 10)
+        self.assertEqual(cache.lookup(items[2]), '')
+        self.assertFalse(os.path.exists(cache.path_for(items[2])))
+        # An installed entry stays for reinstalls; room for the next download
+        # is made by dropping the least recently used one.
+        path = cache.path_for(items[1])
+        with open(path, 'wb') as f:
+            f.write(b'y' * 10)
+        cache.settle(path)
+        self.assertTrue(os.path.exists(path))
+        os.utime(cache.path_for(items[0]), (1, 1))
+        self.assertEqual(cache.evict(reserve=10), 1)
+        self.assertFalse(os.path.exists(cache.path_for(items[0])))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(cache.path_for({'name': 'big', 'size': 26, 'digest': 'sha256:00'}), '')
+        # A cache in /tmp keeps entries too, within its smaller limit.
+        ram = storage.PackageCache(root='/tmp/piconupdater-test-cache', limit=1 << 40)
+        self.assertEqual(ram.limit, storage.TMP_PACKAGE_CACHE_LIMIT)
+        self.assertEqual(cache.purge(), (1, 10))
+        self.assertFalse(os.path.exists(root))
+
     def test_clear_recursive(self):
         target_path = os.path.join(self.tmp, 'target')
         os.makedirs(os.path.join(target_path, 'logos'))
@@ -172,6 +983,146 @@ class StorageTests(unittest.TestCase):
         target = {'id':'flash','label':'test','path':target_path}
         self.assertEqual(storage.clear_picons(target), 2)
 
+    def test_move_to_trash_defers_deletion(self):
+        target_path = os.path.join(self.tmp, 'target')
+        os.makedirs(os.path.join(target_path, 'logos'))
+        for name in ('a.png', 'logos/b.png', 'keep.txt'):
+            with open(os.path.join(target_path, *name.split('/')), 'wb') as f:
+                f.write(b'xy')
+        target = {'id': 'flash', 'label': 'test', 'path': target_path}
+        trash = storage.move_to_trash(target)
+        self.assertTrue(trash.startswith(os.path.join(self.tmp, storage.TRASH_DIR)))
+        self.assertEqual(os.listdir(target_path), ['keep.txt'])
+        self.assertEqual(storage.trash_bytes(target_path), 4)
+        worker = storage.empty_trash(target_path, background=True)
+        worker.join(10)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, storage.TRASH_DIR)))
+        self.assertEqual(storage.remove_tree(os.path.join(self.tmp, 'missing')), 0)
+
+
+class JobTests(unittest.TestCase):
+    def test_job_locks_order_and_cancel_download(self):
+        manager = jobs.JobManager()
+        order = []
+        gate = threading.Event()
+
+        def step(name, wait=False):
+            def work(token):
+                if wait:
+                    gate.wait(10)
+                order.append(name)
+            return work
+        first = manager.submit('install', step('a1', wait=True), ['/a'])
+        second = manager.submit('install', step('a2'), ['/a'])
+        other = manager.submit('install', step('b'), ['/b'])
+        other.finished.wait(10)
+        # Another target proceeds; the same target waits for the running install.
+        self.assertEqual(order, ['b'])
+        self.assertEqual(second.state, 'queued')
+        gate.set()
+        second.finished.wait(10)
+        self.assertEqual(order, ['b', 'a1', 'a2'])
+        self.assertEqual(first.state, 'done')
+        self.assertFalse(manager.active())
+
+        payload = os.urandom(400 * 1024)
+        tmp = tempfile.mkdtemp(prefix='piconupdater-test-')
+        try:
+            dest = os.path.join(tmp, 'pkg.ipk')
+            with LocalServer({'/pkg.ipk': payload}, rate=40 * 1024) as server:
+                job = manager.submit('download', lambda token: catalog.download_file(
+                    server.url('/pkg.ipk'), dest, cancel=token), [jobs.DOWNLOAD_LOCK])
+                time.sleep(0.5)
+                started = time.time()
+                manager.cancel_all(('download',))
+                job.finished.wait(10)
+                elapsed = time.time() - started
+            self.assertEqual(job.state, 'cancelled')
+            self.assertLess(elapsed, 1.5)
+            self.assertFalse(os.path.exists(dest))
+            # The partial download is kept for a later resume.
+            self.assertTrue(0 < os.path.getsize(dest + '.part') < len(payload))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def test_progress_reporter_throttles_and_logs(self):
+        tmp = tempfile.mkdtemp(prefix='piconupdater-test-')
+        try:
+            now = [100.0]
+            seen = []
+            log = os.path.join(tmp, 'progress.jsonl')
+            reporter = jobs.ProgressReporter(sink=seen.append, interval=0.5, log=log, clock=lambda: now[0])
+            download = reporter.bytes_callback('download')
+            for step in range(1, 11):
+                now[0] += 0.125
+                download(step * 100, 1000)
+            # Phase start, one update per 0.5 s and the completed transfer.
+            self.assertEqual([s['bytes'] for s in seen], [0, 500, 900, 1000])
+            self.assertAlmostEqual(seen[1]['rate'], 1000.0)
+            self.assertAlmostEqual(seen[1]['avg_rate'], 1000.0)
+            self.assertAlmostEqual(seen[1]['eta'], 0.5)
+            self.assertEqual(seen[-1]['fraction'], 1.0)
+
+            ipk = os.path.join(tmp, 'test.ipk')
+            build_test_ipk(ipk)
+            target = {'id': 'flash', 'label': 'test', 'path': os.path.join(tmp, 'target')}
+            storage.install_package(ipk, {'format': 'ipk'}, target,
+                                    progress=reporter.members_callback('install'),
+                                    byte_progress=reporter.bytes_callback('install'))
+            reporter.finish()
+            last = seen[-1]
+            self.assertEqual((last['phase'], last['done']), ('install', True))
+            self.assertEqual(last['bytes'], len(b'PNGDATA'))
+            self.assertEqual(last['members'], last['members_total'])
+            with open(log) as f:
+                lines = [json.loads(line) for line in f]
+            self.assertEqual(len(lines), len(seen))
+            self.assertEqual([l['phase'] for l in lines if l['done']], ['download', 'install'])
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+class PerfTests(unittest.TestCase):
+    def test_spans_and_rotating_history(self):
+        tmp = tempfile.mkdtemp(prefix='piconupdater-test-')
+        try:
+            payload = os.urandom(64 * 1024)
+            ipk = os.path.join(tmp, 'test.ipk')
+            build_test_ipk(ipk)
+            run = perf.PerfRun('test')
+            self.assertIsNone(run.started)
+            run.start()
+            started = run.started
+            run.start()
+            self.assertEqual(run.started, started)
+            with perf.bind(run):
+                with LocalServer({'/pkg.ipk': payload}) as server:
+                    catalog.download_file(server.url('/pkg.ipk'), os.path.join(tmp, 'pkg.ipk'))
+                target = {'id': 'flash', 'label': 'test', 'path': os.path.join(tmp, 'target')}
+                result = storage.perform_install(ipk, {'format': 'ipk'}, target)
+            # Nothing is recorded without a bound run.
+            before = dict(run.spans)
+            with perf.span('write'):
+                pass
+            self.assertEqual(run.spans, before)
+            for name in ('connect', 'ttfb', 'body', 'ar', 'index', 'write', 'links'):
+                self.assertIn(name, run.spans)
+
+            history = os.path.join(tmp, 'perf.jsonl')
+            record = run.record(files=result['count'], package_bytes=os.path.getsize(ipk), target=tmp,
+                                version='9.9')
+            self.assertEqual(record['files'], result['count'])
+            self.assertGreater(record['files_per_s'], 0)
+            with mock.patch.object(perf, 'PERF_HISTORY_LIMIT', 1):
+                for _i in range(3):
+                    perf.append_history(record, history)
+            self.assertTrue(os.path.exists(history + '.1'))
+            loaded = perf.load_history(2, history)
+            self.assertEqual(len(loaded), 2)
+            self.assertEqual(loaded[-1]['spans'], record['spans'])
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,8 +2,7 @@
 from __future__ import print_function
 
 import os
-import tempfile
-import threading
+import re
 import time
 
 try:
@@ -22,19 +21,30 @@ from Components.ActionMap import ActionMap
 from Components.Label import Label
 from Components.MenuList import MenuList
 from Components.Pixmap import Pixmap
+from Components.ScrollLabel import ScrollLabel
 from Components.Language import language
 from enigma import eTimer, ePicLoad, getDesktop
 
 from .catalog import (
-    PLUGIN_VERSION, CACHE_FILE, get_catalog, load_state, save_state,
-    newest_published, item_flags, type_label, scope_label, background_label,
+    PLUGIN_VERSION, CACHE_FILE, get_catalog, local_catalog, catalog_diff, load_older_releases,
+    load_state, save_state,
+    newest_published, CatalogView, FilterIndex, type_label, scope_label, background_label,
     logo_label, remote_plugin_version, semver_tuple, download_file,
-    scope_satellites, satellite_label, item_supports_satellite,
+    satellite_label, satellite_set, join_satellites,
 )
-from .storage import storage_targets, target_by_id, free_space, validate_package, estimate_install_bytes, install_package, clear_picons
+from .storage import (
+    storage_targets, target_by_id, free_space, stream_install_package, stream_install_fits, StreamFallback,
+    clear_picons, PackageCache, PACKAGE_CACHE_LIMIT, move_to_trash, empty_trash, trash_bytes,
+    InstallJournal, InstallWorker, journal_path, _human_bytes,
+)
+from .jobs import JobManager, Cancelled, DOWNLOAD_LOCK, target_locks, ProgressReporter
+from . import perf
 
 PLUGIN_PATH = os.path.dirname(os.path.realpath(__file__))
 SITE_URL = "https://olioli2013.github.io/aio-iptv-projekt/"
+DOWNLOAD_SEGMENTS = 4
+PACKAGE_CACHE_CHOICES = (0, 128, 256, 512, 1024)
+PERF_HISTORY_RUNS = 10
 INSTALL_COMMAND = "wget -qO - https://raw.githubusercontent.com/OliOli2013/PiconUpdater/main/installer.sh | /bin/sh"
 
 TEXT = {
@@ -49,6 +59,8 @@ TEXT = {
         "filter_summary": "Filtry",
         "catalog_online": "Katalog GitHub: aktualny",
         "catalog_cache": "Katalog: pamięć podręczna",
+        "refreshing": "odświeżanie…",
+        "catalog_diff": "Katalog odświeżony: nowe %d, zaktualizowane %d",
         "catalog_fallback": "Katalog awaryjny",
         "catalog_changes": "nowe: %d • aktualizacje: %d",
         "plugin_update": "Nowa wersja wtyczki: %s",
@@ -73,9 +85,7 @@ TEXT = {
         "installed": "ZAINSTALOWANE",
         "normal": "Dostępne",
         "confirm_install": "Zainstalować wybrany zestaw piconów?\n\n%s\n\nLokalizacja: %s\n\nUWAGA: po poprawnym pobraniu i sprawdzeniu paczki obecne picony w tej lokalizacji zostaną usunięte, a następnie zainstalowany zostanie nowy zestaw.",
-        "clearing_old": "Usuwanie poprzednich piconów",
         "downloading": "Pobieranie: %s",
-        "installing": "Instalowanie piconów: %s",
         "installed_ok": "Zainstalowano %d piconów.\nLokalizacja: %s%s",
         "busy": "Operacja jest w toku. Poczekaj na jej zakończenie.",
         "error": "Błąd",
@@ -84,17 +94,47 @@ TEXT = {
         "tool_qr": "Strona projektu / kod QR",
         "tool_clear_cache": "Wyczyść cache katalogu",
         "tool_clear_picons": "Wyczyść picony w wybranej lokalizacji",
+        "tool_stream": "Instalacja strumieniowa (bez pliku w /tmp): %s",
+        "tool_segments": "Pobieranie równoległe (%d połączenia): %s",
+        "tool_history": "Wczytaj starsze wydania z GitHub",
+        "tool_package_cache": "Cache pakietów: %d plików, %s (limit %s)",
+        "package_cache_purge": "Wyczyść cache pakietów",
+        "package_cache_limit": "Limit cache pakietów: %s",
+        "package_cache_purged": "Usunięto pakiety z cache: %d (%s)",
+        "cache_hit": "Zweryfikowany pakiet z cache",
+        "delta_summary": "Aktualizacja różnicowa: nowe %d, zmienione %d, usunięte %d, bez zmian %d",
+        "history_ok": "Wczytano starsze wydania. Nowe warianty: %d",
+        "on": "wł.",
+        "off": "wył.",
         "clear_cache_ok": "Cache katalogu został usunięty.",
         "confirm_clear": "Usunąć wszystkie pliki PNG z lokalizacji?\n%s\n\nTa operacja nie ma cofnięcia.",
         "clear_ok": "Usunięto %d plików PNG.",
+        "clear_done": "Picony usunięte z lokalizacji.",
+        "resuming_install": "Wznawianie przerwanej instalacji: %s",
+        "phase_download": "Pobieranie",
+        "phase_validate": "Weryfikacja",
+        "phase_clear": "Usuwanie poprzednich",
+        "phase_install": "Instalowanie",
+        "files_per_s": "plików/s",
+        "average": "śr.",
+        "confirm_cancel_install": "Przerwać trwające zadania (%d)?",
+        "install_cancelled": "Operacja przerwana.",
+        "tool_update_all": "Aktualizuj wszystkie warianty UPDATE (%d)",
+        "update_all_none": "Brak wariantów do aktualizacji.",
+        "queued": "W kolejce…",
         "confirm_plugin_update": "Uruchomić bezpieczny instalator z Twojego repozytorium GitHub?\n\n%s",
         "filter_title": "Filtry katalogu piconów",
         "all": "Wszystkie",
         "apply": "Zastosuj",
         "reset": "Reset",
+        "toggle_extra": "Dodaj/usuń",
         "cancel": "Anuluj",
         "qr_title": "PiconUpdater – strona projektu",
         "qr_hint": "Zeskanuj kod QR telefonem lub wpisz adres w przeglądarce.",
+        "tool_perf": "Historia wydajności instalacji",
+        "perf_title": "Ostatnie instalacje (%d)",
+        "perf_empty": "Brak zapisanych instalacji.",
+        "perf_version": "Wersja %s: %d instalacji, śr. %.0f plików/s, %.2f MB/s",
         "legacy_note": "SNP jest trybem legacy; projekt picons nie aktualizuje już indeksów SNP.",
     },
     "en": {
@@ -108,6 +148,8 @@ TEXT = {
         "filter_summary": "Filters",
         "catalog_online": "GitHub catalog: current",
         "catalog_cache": "Catalog: cache",
+        "refreshing": "refreshing…",
+        "catalog_diff": "Catalog refreshed: new %d, updated %d",
         "catalog_fallback": "Fallback catalog",
         "catalog_changes": "new: %d • updates: %d",
         "plugin_update": "Plugin update available: %s",
@@ -132,9 +174,7 @@ TEXT = {
         "installed": "INSTALLED",
         "normal": "Available",
         "confirm_install": "Install the selected picon set?\n\n%s\n\nLocation: %s\n\nNOTE: after the package is downloaded and verified, current picons in this location will be removed before the new set is installed.",
-        "clearing_old": "Removing previous picons",
         "downloading": "Downloading: %s",
-        "installing": "Installing picons: %s",
         "installed_ok": "Installed %d picons.\nLocation: %s%s",
         "busy": "An operation is still running. Please wait.",
         "error": "Error",
@@ -143,17 +183,47 @@ TEXT = {
         "tool_qr": "Project website / QR code",
         "tool_clear_cache": "Clear catalog cache",
         "tool_clear_picons": "Clear picons in selected location",
+        "tool_stream": "Streaming install (no file in /tmp): %s",
+        "tool_segments": "Parallel download (%d connections): %s",
+        "tool_history": "Load older releases from GitHub",
+        "tool_package_cache": "Package cache: %d files, %s (limit %s)",
+        "package_cache_purge": "Purge package cache",
+        "package_cache_limit": "Package cache limit: %s",
+        "package_cache_purged": "Packages removed from cache: %d (%s)",
+        "cache_hit": "Verified package from cache",
+        "delta_summary": "Delta update: added %d, changed %d, removed %d, unchanged %d",
+        "history_ok": "Older releases loaded. New variants: %d",
+        "on": "on",
+        "off": "off",
         "clear_cache_ok": "Catalog cache removed.",
         "confirm_clear": "Delete all PNG files from this location?\n%s\n\nThis cannot be undone.",
         "clear_ok": "Removed %d PNG files.",
+        "clear_done": "Picons removed from this location.",
+        "resuming_install": "Resuming interrupted install: %s",
+        "phase_download": "Downloading",
+        "phase_validate": "Verifying",
+        "phase_clear": "Removing previous",
+        "phase_install": "Installing",
+        "files_per_s": "files/s",
+        "average": "avg",
+        "confirm_cancel_install": "Cancel the running jobs (%d)?",
+        "install_cancelled": "Operation cancelled.",
+        "tool_update_all": "Update all UPDATE variants (%d)",
+        "update_all_none": "No variants to update.",
+        "queued": "Queued…",
         "confirm_plugin_update": "Run the safe installer from your GitHub repository?\n\n%s",
         "filter_title": "Picon catalog filters",
         "all": "All",
         "apply": "Apply",
         "reset": "Reset",
+        "toggle_extra": "Add/remove",
         "cancel": "Cancel",
         "qr_title": "PiconUpdater – project website",
         "qr_hint": "Scan the QR code with your phone or enter the address in a browser.",
+        "tool_perf": "Install performance history",
+        "perf_title": "Recent installs (%d)",
+        "perf_empty": "No installs recorded yet.",
+        "perf_version": "Version %s: %d installs, avg %.0f files/s, %.2f MB/s",
         "legacy_note": "SNP is legacy; the picons project no longer updates SNP indexes.",
     },
 }
@@ -166,9 +236,12 @@ def _lang():
         return "en"
 
 
+def _texts():
+    return TEXT.get(_lang(), TEXT["en"])
+
+
 def _t(key):
-    lang = _lang()
-    return TEXT.get(lang, TEXT["en"]).get(key, key)
+    return _texts().get(key, key)
 
 
 def _desktop():
@@ -179,19 +252,55 @@ def _desktop():
         return 1280, 720
 
 
-def _human_bytes(value):
-    try:
-        value = float(value or 0)
-    except Exception:
-        return "—"
-    units = ["B", "KB", "MB", "GB"]
-    idx = 0
-    while value >= 1024.0 and idx < len(units) - 1:
-        value /= 1024.0
-        idx += 1
-    if idx == 0:
-        return "%d %s" % (int(value), units[idx])
-    return "%.1f %s" % (value, units[idx])
+# storage status() phases shown as reporter phases.
+_STATUS_PHASES = {"validating": "validate", "comparing_old": "validate", "clearing_old": "clear"}
+
+
+def _progress_text(snap):
+    """One line for the operation label from a ProgressReporter snapshot."""
+    parts = [_t("phase_" + snap["phase"])]
+    if snap.get("fraction") is not None:
+        parts[0] += " %d%%" % int(snap["fraction"] * 100.0)
+    elif snap.get("bytes"):
+        parts[0] += " %s" % _human_bytes(snap["bytes"])
+    elif snap.get("members"):
+        parts[0] += " %d" % snap["members"]
+    if snap.get("bytes"):
+        parts.append("%s/s (%s %s/s)" % (_human_bytes(snap["rate"]), _t("average"), _human_bytes(snap["avg_rate"])))
+    elif snap.get("members"):
+        parts.append("%d %s" % (snap["avg_member_rate"], _t("files_per_s")))
+    if snap.get("eta") is not None and not snap.get("done"):
+        eta = int(snap["eta"])
+        parts.append("ETA %d:%02d" % (eta // 60, eta % 60))
+    return " | ".join(parts)
+
+
+def _perf_summary(records):
+    """Text for PiconPerfScreen: averages per plugin version, then runs newest first."""
+    if not records:
+        return _t("perf_empty")
+    lines = []
+    versions = []
+    for record in records:
+        if record.get("version") not in versions:
+            versions.append(record.get("version"))
+    for version in versions:
+        runs = [r for r in records if r.get("version") == version and r.get("status") == "ok"]
+        if runs:
+            lines.append(_t("perf_version") % (version or "?", len(runs),
+                                                sum(r.get("files_per_s", 0) for r in runs) / len(runs),
+                                                sum(r.get("mb_per_s", 0) for r in runs) / len(runs)))
+    for record in reversed(records):
+        lines.append("")
+        lines.append("%s | %s | %s %s | %s | %s" % (
+            record.get("ts", "").replace("T", " ")[:16], record.get("version", ""), record.get("box") or "?",
+            record.get("fs") or "?", _human_bytes(record.get("package_bytes", 0)), record.get("status", "")))
+        lines.append("%s: %d, %.0f s, %.0f %s, %.2f MB/s" % (
+            record.get("label", ""), record.get("files", 0), record.get("seconds", 0),
+            record.get("files_per_s", 0), _t("files_per_s"), record.get("mb_per_s", 0)))
+        spans = record.get("spans") or {}
+        lines.append("  " + "  ".join("%s %.1f" % (name, spans[name]) for name in perf.SPANS if name in spans))
+    return "\n".join(lines)
 
 
 def _short_scope(scope):
@@ -296,11 +405,11 @@ def _filter_skin():
     if w <= 1280 or h <= 720:
         width, height = 760, 500
         list_y, list_h, hint_y, bar_y, key_y = 90, 272, 374, 430, 440
-        key_w, gaps = 150, (30, 200, 370)
+        key_w, gaps = 150, (30, 200, 370, 540)
     else:
         width, height = 840, 560
         list_y, list_h, hint_y, bar_y, key_y = 100, 300, 414, 490, 500
-        key_w, gaps = 160, (40, 220, 400)
+        key_w, gaps = 160, (40, 220, 400, 580)
     return """
     <screen position="center,center" size="{w},{h}" title="PiconUpdater" backgroundColor="#0B0F14">
         <eLabel position="0,0" size="{w},70" backgroundColor="#121824" />
@@ -315,10 +424,12 @@ def _filter_skin():
         <widget name="key_red" position="{x1},{key_y}" size="{key_w},30" font="Regular;18" halign="center" valign="center" transparent="1" zPosition="3" foregroundColor="#FFFFFF" />
         <widget name="key_green" position="{x2},{key_y}" size="{key_w},30" font="Regular;18" halign="center" valign="center" transparent="1" zPosition="3" foregroundColor="#FFFFFF" />
         <widget name="key_yellow" position="{x3},{key_y}" size="{key_w},30" font="Regular;18" halign="center" valign="center" transparent="1" zPosition="3" foregroundColor="#FFFFFF" />
+        <eLabel position="{x4},{key_y}" size="{key_w},30" backgroundColor="#1556A8" zPosition="1" />
+        <widget name="key_blue" position="{x4},{key_y}" size="{key_w},30" font="Regular;18" halign="center" valign="center" transparent="1" zPosition="3" foregroundColor="#FFFFFF" />
     </screen>""".format(
         w=width, h=height, tw=width-40, lw=width-60, list_y=list_y, list_h=list_h,
         hint_y=hint_y, bar_y=bar_y, bar_h=height-bar_y, key_y=key_y, key_w=key_w,
-        x1=gaps[0], x2=gaps[1], x3=gaps[2],
+        x1=gaps[0], x2=gaps[1], x3=gaps[2], x4=gaps[3],
     )
 
 
@@ -343,29 +454,52 @@ def _qr_skin():
     </screen>""".format(qr=os.path.join(PLUGIN_PATH, "assets", "qr_site.png"))
 
 
+def _perf_skin():
+    w, h = _desktop()
+    if w <= 1280 or h <= 720:
+        return """
+        <screen position="center,center" size="1000,600" title="PiconUpdater" backgroundColor="#0B0F14">
+            <eLabel position="0,0" size="1000,60" backgroundColor="#121824" />
+            <widget name="title" position="20,14" size="960,32" font="Regular;24" foregroundColor="#00C2FF" transparent="1" />
+            <widget name="text" position="20,76" size="960,504" font="Regular;17" foregroundColor="#D7DEE9" transparent="1" />
+        </screen>"""
+    return """
+    <screen position="center,center" size="1500,880" title="PiconUpdater" backgroundColor="#0B0F14">
+        <eLabel position="0,0" size="1500,80" backgroundColor="#121824" />
+        <widget name="title" position="30,20" size="1440,38" font="Regular;30" foregroundColor="#00C2FF" transparent="1" />
+        <widget name="text" position="30,100" size="1440,756" font="Regular;24" foregroundColor="#D7DEE9" transparent="1" />
+    </screen>"""
+
+
 class PiconFilterScreen(Screen):
     skin = _filter_skin()
 
-    def __init__(self, session, catalog, current_filters, location_id):
+    def __init__(self, session, index, current_filters, location_id, extra_locations=()):
         Screen.__init__(self, session)
-        self.catalog = list(catalog or [])
+        self.index = index
         self.filters = dict(current_filters or {})
         self.location_id = location_id
+        self.extra_locations = [x for x in extra_locations if x != location_id]
         self.targets = storage_targets()
         self.rows = ["type", "satellite", "scope", "canvas", "logotype", "background", "location"]
         self.options = self._build_options()
+        # Satellite under ←/→; Blue adds it to or removes it from the selection.
+        # On the location row Blue adds the shown location as an extra target.
+        self.sat_cursor = (satellite_set(self.filters.get("satellite")) or ["*"])[0]
         self["title"] = Label(_t("filter_title"))
         self["list"] = MenuList([])
-        self["hint"] = Label("← / → zmiana • wybierz Konkretny satelita dla małej paczki SRP • OK/Zielony zastosuj" if _lang() == "pl" else "← / → change • choose Specific satellite for a smaller SRP install • OK/Green apply")
+        self["hint"] = Label("← / → zmiana • Niebieski: kilka satelitów SRP lub lokalizacji w jednej instalacji • OK/Zielony zastosuj" if _lang() == "pl" else "← / → change • Blue: several SRP satellites or locations in one install • OK/Green apply")
         self["key_red"] = Label(_t("cancel"))
         self["key_green"] = Label(_t("apply"))
         self["key_yellow"] = Label(_t("reset"))
+        self["key_blue"] = Label(_t("toggle_extra"))
         self["actions"] = ActionMap(["OkCancelActions", "ColorActions", "DirectionActions"], {
             "cancel": self.close,
             "red": self.close,
             "green": self.apply,
             "ok": self.apply,
             "yellow": self.reset,
+            "blue": self.toggle,
             "left": lambda: self.cycle(-1),
             "right": lambda: self.cycle(1),
             "up": self["list"].up,
@@ -373,25 +507,16 @@ class PiconFilterScreen(Screen):
         }, -1)
         self.refresh()
 
-    def _unique(self, key):
-        vals = sorted(set([str(x.get(key) or "") for x in self.catalog if x.get(key)]))
-        return vals
-
     def _build_options(self):
         all_label = _t("all")
-        satellites = []
-        for item in self.catalog:
-            for sat in scope_satellites(item.get("scope")):
-                if sat not in satellites:
-                    satellites.append(sat)
-        satellites.sort()
+        options = self.index.options
         return {
-            "type": [("*", all_label)] + [(v, type_label(v)) for v in self._unique("type")],
-            "satellite": [("*", _t("satellite_all"))] + [(v, satellite_label(v)) for v in satellites],
-            "scope": [("*", all_label)] + [(v, scope_label(v)) for v in self._unique("scope")],
-            "canvas": [("*", all_label)] + [(v, v) for v in self._unique("canvas")],
-            "logotype": [("*", all_label)] + [(v, logo_label(v)) for v in self._unique("logotype")],
-            "background": [("*", all_label)] + [(v, background_label(v)) for v in self._unique("background")],
+            "type": [("*", all_label)] + [(v, type_label(v)) for v in options("type")],
+            "satellite": [("*", _t("satellite_all"))] + [(v, satellite_label(v)) for v in options("satellite")],
+            "scope": [("*", all_label)] + [(v, scope_label(v)) for v in options("scope")],
+            "canvas": [("*", all_label)] + [(v, v) for v in options("canvas")],
+            "logotype": [("*", all_label)] + [(v, logo_label(v)) for v in options("logotype")],
+            "background": [("*", all_label)] + [(v, background_label(v)) for v in options("background")],
             "location": [(x["id"], x["label"]) for x in self.targets],
         }
 
@@ -399,6 +524,13 @@ class PiconFilterScreen(Screen):
         return self.location_id if row == "location" else self.filters.get(row, "*")
 
     def _label_for(self, row, value):
+        if row == "satellite" and "," in value:
+            return satellite_label(value)
+        if row == "location" and self.extra_locations:
+            return " + ".join(self._option_label(row, x) for x in [value] + self.extra_locations)
+        return self._option_label(row, value)
+
+    def _option_label(self, row, value):
         for key, label in self.options.get(row, []):
             if key == value:
                 return label
@@ -412,7 +544,14 @@ class PiconFilterScreen(Screen):
         rows = []
         for row in self.rows:
             value = self._current_value(row)
-            rows.append("%-18s  %s" % ((names[row] + ":"), self._label_for(row, value)))
+            label = self._label_for(row, value)
+            if row == "satellite" and "," in value:
+                label = "%s (%d)  ‹%s›" % (label, len(self.index.match(self.filters)),
+                                           self._label_for(row, self.sat_cursor))
+            elif row != "location":
+                # Packages left with this option, so empty combinations show up before applying.
+                label = "%s (%d)" % (label, self.index.counts(self.filters, row).get(value, 0))
+            rows.append("%-18s  %s" % ((names[row] + ":"), label))
         idx = self["list"].getSelectionIndex()
         self["list"].setList(rows)
         if idx >= 0:
@@ -426,7 +565,7 @@ class PiconFilterScreen(Screen):
         opts = self.options.get(row, [])
         if not opts:
             return
-        current = self._current_value(row)
+        current = self.sat_cursor if row == "satellite" else self._current_value(row)
         pos = 0
         for i, (value, _label) in enumerate(opts):
             if value == current:
@@ -436,17 +575,41 @@ class PiconFilterScreen(Screen):
         value = opts[pos][0]
         if row == "location":
             self.location_id = value
+            self.extra_locations = [x for x in self.extra_locations if x != value]
+        elif row == "satellite":
+            self.sat_cursor = value
+            # With several satellites picked ←/→ only moves the cursor.
+            if len(satellite_set(self.filters.get(row))) <= 1:
+                self.filters[row] = value
         else:
             self.filters[row] = value
         self.refresh()
 
+    def toggle(self):
+        idx = self["list"].getSelectionIndex()
+        row = self.rows[idx] if 0 <= idx < len(self.rows) else ""
+        if row == "location":
+            # Blue keeps the shown location as an extra target and moves on to the
+            # next one; ←/→ onto an extra target makes it the primary one again.
+            ids = [x["id"] for x in self.targets]
+            self.extra_locations.append(self.location_id)
+            self.location_id = ids[(ids.index(self.location_id) + 1) % len(ids)]
+            self.extra_locations = [x for x in self.extra_locations if x != self.location_id]
+        elif row == "satellite" and self.sat_cursor != "*":
+            picked = set(satellite_set(self.filters.get("satellite")))
+            picked ^= set([self.sat_cursor])
+            self.filters["satellite"] = join_satellites(picked)
+        self.refresh()
+
     def reset(self):
         for row in ("type", "satellite", "scope", "canvas", "logotype", "background"):
             self.filters[row] = "*"
+        self.sat_cursor = "*"
+        self.extra_locations = []
         self.refresh()
 
     def apply(self):
-        self.close((self.filters, self.location_id))
+        self.close((self.filters, self.location_id, self.extra_locations))
 
 
 class PiconQRScreen(Screen):
@@ -463,6 +626,21 @@ class PiconQRScreen(Screen):
         }, -1)
 
 
+class PiconPerfScreen(Screen):
+    skin = _perf_skin()
+
+    def __init__(self, session):
+        Screen.__init__(self, session)
+        records = perf.load_history(PERF_HISTORY_RUNS)
+        self["title"] = Label(_t("perf_title") % len(records))
+        self["text"] = ScrollLabel(_perf_summary(records))
+        self["actions"] = ActionMap(["OkCancelActions", "DirectionActions"], {
+            "cancel": self.close, "ok": self.close,
+            "up": self["text"].pageUp, "down": self["text"].pageDown,
+            "left": self["text"].pageUp, "right": self["text"].pageDown,
+        }, -1)
+
+
 class PiconUpdaterMain(Screen):
     skin = _main_skin()
 
@@ -473,17 +651,24 @@ class PiconUpdaterMain(Screen):
         self.filtered = []
         self.catalog_meta = {}
         self.state = load_state()
+        # Strings resolved once per screen; the list and details are redrawn often.
+        self.text = _texts()
+        self.view = CatalogView([], self.state)
+        self.filter_index = FilterIndex([])
+        self.row_cache = {}
         self.remote_version = ""
         self.location_id = self.state.get("last_location", "flash")
         if self.location_id not in [x["id"] for x in storage_targets()]:
             self.location_id = "flash"
         self.filters = {"type": "*", "satellite": "*", "scope": "*", "canvas": "*", "logotype": "*", "background": "*"}
-        self.busy = False
+        self.jobs = JobManager()
+        self.refreshing = False
         self.started = False
         self.work_queue = queue.Queue()
+        # Polled only while jobs run or their messages are still queued.
+        self.polling = False
         self.worker_timer = eTimer()
         self.worker_timer.callback.append(self._poll_queue)
-        self.worker_timer.start(200, False)
         self.picload = ePicLoad()
         self.picload.PictureData.get().append(self._preview_ready)
 
@@ -526,30 +711,67 @@ class PiconUpdaterMain(Screen):
     def _on_show(self):
         if not self.started:
             self.started = True
-            self._start_catalog_worker(False)
-
-    def _set_busy(self, value):
-        self.busy = bool(value)
+            # Paint the cached (or bundled) catalog at once, then revalidate it.
+            items, meta = local_catalog(PLUGIN_PATH)
+            self._show_catalog(items, meta)
+            # Trash left behind by an interrupted session is removed at low priority.
+            for target in storage_targets():
+                try:
+                    if trash_bytes(target["path"]):
+                        empty_trash(target["path"], background=True)
+                except Exception:
+                    pass
+            self._start_catalog_worker(False, version=True)
+            self._resume_install()
+
+    @property
+    def busy(self):
+        return bool(self.jobs.active(("download", "install", "clear")))
+
+    def _submit(self, kind, work, locks=(), label=""):
+        job = self.jobs.submit(kind, work, locks, label)
+        if not self.polling:
+            self.polling = True
+            self.worker_timer.start(200, False)
+        return job
+
+    def _start_catalog_worker(self, force, version=False):
+        if self.refreshing:
+            return
+        self.refreshing = True
+        self._update_catalog_status()
 
-    def _start_catalog_worker(self, force):
-        if self.busy:
+        def refresh(token):
+            try:
+                items, meta = get_catalog(PLUGIN_PATH, force=force)
+                self.work_queue.put(("catalog_refresh", items, meta))
+            except Exception as e:
+                self.work_queue.put(("catalog_refresh", None, {}))
+                if force:
+                    self.work_queue.put(("error", str(e)))
+
+        def check_version(token):
+            self.work_queue.put(("version", remote_plugin_version()))
+        self._submit("refresh", refresh, label="catalog")
+        if version:
+            self._submit("refresh", check_version, label="version")
+
+    def _start_history_worker(self):
+        if [j for j in self.jobs.active(("refresh",)) if j.label == "history"]:
             return
-        self._set_busy(True)
         self["operation"].setText(_t("loading"))
 
-        def work():
+        def work(token):
             try:
-                items, meta = get_catalog(PLUGIN_PATH, force=force)
-                remote = remote_plugin_version()
-                self.work_queue.put(("catalog", items, meta, remote))
+                items, meta, added = load_older_releases(PLUGIN_PATH)
+                self.work_queue.put(("catalog", items, meta))
+                self.work_queue.put(("history_done", added))
             except Exception as e:
                 self.work_queue.put(("error", str(e)))
-        t = threading.Thread(target=work)
-        t.daemon = True
-        t.start()
+        self._submit("refresh", work, label="history")
 
     def refresh_catalog(self):
-        self._start_catalog_worker(True)
+        self._start_catalog_worker(True, version=True)
 
     def _poll_queue(self):
         while True:
@@ -559,11 +781,28 @@ class PiconUpdaterMain(Screen):
                 break
             kind = msg[0]
             if kind == "catalog":
-                self.catalog, self.catalog_meta, self.remote_version = msg[1], msg[2], msg[3]
-                self._set_busy(False)
                 self["operation"].setText("")
+                self._show_catalog(msg[1], msg[2])
+            elif kind == "catalog_refresh":
+                self.refreshing = False
+                if msg[1] is None:
+                    self._update_catalog_status()
+                else:
+                    self._show_catalog(msg[1], msg[2])
+            elif kind == "version":
+                self.remote_version = msg[1]
                 self._update_catalog_status()
-                self._apply_filters()
+            elif kind == "clear_done":
+                if not self.busy:
+                    self["operation"].setText("")
+                text = _t("clear_ok") % msg[1] if msg[1] is not None else _t("clear_done")
+                self.session.open(MessageBox, text, MessageBox.TYPE_INFO, timeout=6)
+            elif kind == "history_done":
+                self.session.open(MessageBox, _t("history_ok") % msg[1], MessageBox.TYPE_INFO, timeout=6)
+            elif kind == "stream_fallback":
+                self._start_install(msg[1], msg[2], stream=False)
+            elif kind == "report":
+                self["operation"].setText(_progress_text(msg[1]))
             elif kind == "progress":
                 _kind, phase, done, total = msg
                 if total:
@@ -573,14 +812,16 @@ class PiconUpdaterMain(Screen):
                     self["operation"].setText(phase if not done else "%s %s" % (phase, _human_bytes(done)))
             elif kind == "install_done":
                 item, result = msg[1], msg[2]
-                self._set_busy(False)
-                self["operation"].setText("")
+                if not self.busy:
+                    self["operation"].setText("")
                 key = item.get("variant_key")
                 self.state.setdefault("installed", {})[key] = {
                     "name": item.get("name"),
+                    "satellite": item.get("selected_satellite", "*"),
                     "published_at": item.get("published_at", ""),
                     "release_tag": item.get("release_tag", ""),
                     "path": result.get("path", ""),
+                    "manifest": result.get("manifest", ""),
                     "installed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
                 }
                 self.state["last_location"] = self.location_id
@@ -588,35 +829,65 @@ class PiconUpdaterMain(Screen):
                     save_state(self.state)
                 except Exception:
                     pass
+                self._rebuild_view()
                 self._apply_filters(keep_index=True)
                 extra = ""
-                if result.get("satellite") and result.get("satellite") != "*":
+                if result.get("orbitals"):
+                    extra += "\nSatelita: %s" % ", ".join(
+                        "%s (%d)" % (satellite_label(sat), n) for sat, n in sorted(result["orbitals"].items()))
+                elif result.get("satellite") and result.get("satellite") != "*":
                     extra += "\nSatelita: %s" % satellite_label(result.get("satellite"))
                 if result.get("symlink"):
                     extra += "\n%s" % result.get("symlink")
+                if len(result.get("targets") or []) > 1:
+                    extra += "".join("\n%s: %d" % (t["label"] or t["path"], t["count"]) for t in result["targets"])
+                if result.get("delta"):
+                    stats = result["delta"]
+                    extra += "\n" + _t("delta_summary") % (stats["added"], stats["changed"], stats["removed"], stats["unchanged"])
                 self.session.open(MessageBox, _t("installed_ok") % (result.get("count", 0), result.get("path", ""), extra), MessageBox.TYPE_INFO, timeout=8)
+            elif kind == "cancelled":
+                self["operation"].setText(_t("install_cancelled"))
             elif kind == "error":
-                self._set_busy(False)
-                self["operation"].setText("")
+                if not self.busy:
+                    self["operation"].setText("")
                 self.session.open(MessageBox, "%s: %s" % (_t("error"), msg[1]), MessageBox.TYPE_ERROR)
+        if not self.jobs.active() and self.work_queue.empty():
+            self.polling = False
+            self.worker_timer.stop()
+
+    def _show_catalog(self, items, meta):
+        """Swap in a new catalog snapshot, keeping the selected variant under the cursor."""
+        added, updated = catalog_diff(self.catalog, items)
+        first = not self.catalog
+        unchanged = not first and not added and not updated and len(items) == len(self.catalog)
+        self.catalog, self.catalog_meta = items, meta
+        if unchanged:
+            self._update_catalog_status()
+            return
+        self.filter_index = FilterIndex(items)
+        self._rebuild_view()
+        current = self.selected_item()
+        self._apply_filters(keep_key=current.get("variant_key") if current else None)
+        if not first and not self.busy:
+            self["operation"].setText(_t("catalog_diff") % (len(added), len(updated)))
+
+    def _rebuild_view(self):
+        """Recompute flags and drop cached rows after a catalog or state change."""
+        self.view = CatalogView(self.catalog, self.state)
+        self.row_cache = {}
+        self._update_catalog_status()
 
     def _update_catalog_status(self):
+        text_map = self.text
         if self.catalog_meta.get("online"):
-            text = _t("catalog_online")
+            text = text_map["catalog_online"]
         elif self.catalog_meta.get("cached"):
-            text = _t("catalog_cache")
+            text = text_map["catalog_cache"]
         else:
-            text = _t("catalog_fallback")
-        latest = newest_published(self.catalog)
-        new_count = 0
-        update_count = 0
-        for item in self.catalog:
-            flags = item_flags(item, self.state, latest)
-            if "NEW" in flags or "LATEST" in flags:
-                new_count += 1
-            if "UPDATE" in flags:
-                update_count += 1
-        text += " • %d • %s" % (len(self.catalog), _t("catalog_changes") % (new_count, update_count))
+            text = text_map["catalog_fallback"]
+        text += " • %d • %s" % (len(self.catalog), text_map["catalog_changes"] % (self.view.new_count, self.view.update_count))
+        if self.refreshing:
+            text += " • %s" % text_map["refreshing"]
         self["catalog_status"].setText(text)
         if self.remote_version:
             if semver_tuple(self.remote_version) > semver_tuple(PLUGIN_VERSION):
@@ -624,44 +895,41 @@ class PiconUpdaterMain(Screen):
             else:
                 self["plugin_status"].setText(_t("plugin_current") % PLUGIN_VERSION)
 
-    def _match(self, item):
-        for key in ("type", "scope", "canvas", "logotype", "background"):
-            wanted = self.filters.get(key, "*")
-            if wanted != "*" and item.get(key) != wanted:
-                return False
-        satellite = self.filters.get("satellite", "*")
-        if satellite != "*" and not item_supports_satellite(item, satellite):
-            return False
-        return True
-
-    def _item_prefix(self, item):
-        flags = item_flags(item, self.state, newest_published(self.catalog))
-        if "UPDATE" in flags:
-            return "[%s] " % _t("update")
-        if "NEW" in flags:
-            return "[%s] " % _t("new")
-        if "INSTALLED" in flags:
-            return "[%s] " % _t("installed")
-        if "LATEST" in flags:
-            return "[%s] " % _t("latest")
+    def _item_status(self, item):
+        flags = self.view.item_flags(item)
+        for key, label in (("UPDATE", "update"), ("NEW", "new"), ("INSTALLED", "installed"), ("LATEST", "latest")):
+            if key in flags:
+                return self.text[label]
         return ""
 
     def _row_text(self, item):
         satellite = self.filters.get("satellite", "*")
+        cache_key = (item.get("variant_key"), satellite)
+        row = self.row_cache.get(cache_key)
+        if row is not None:
+            return row
         scope_text = satellite_label(satellite) if satellite != "*" else _short_scope(item.get("scope"))
-        return "%s%s | %s | %s | %s | %s" % (
-            self._item_prefix(item),
+        status = self._item_status(item)
+        row = "%s%s | %s | %s | %s | %s" % (
+            "[%s] " % status if status else "",
             (item.get("type") or "—").upper(),
             scope_text,
             item.get("canvas") or "—",
             (item.get("logotype") or "—").upper(),
             (item.get("background") or "—").upper(),
         )
+        self.row_cache[cache_key] = row
+        return row
 
-    def _apply_filters(self, keep_index=False):
+    def _apply_filters(self, keep_index=False, keep_key=None):
         old_idx = self["picon_list"].getSelectionIndex() if keep_index else 0
-        self.filtered = [x for x in self.catalog if self._match(x)]
+        self.filtered = self.filter_index.match(self.filters)
         self["picon_list"].setList([self._row_text(x) for x in self.filtered])
+        if keep_key is not None:
+            for idx, item in enumerate(self.filtered):
+                if item.get("variant_key") == keep_key:
+                    old_idx = idx
+                    break
         if self.filtered:
             self["picon_list"].moveToIndex(min(max(old_idx, 0), len(self.filtered) - 1))
         self._update_filter_summary()
@@ -673,13 +941,13 @@ class PiconUpdaterMain(Screen):
             if value == "*":
                 return _t("all")
             return fn(value) if fn else value
-        loc = target_by_id(self.location_id)
+        loc_text = " + ".join(t.get("label", "") for t in self._install_targets())
         sat = self.filters.get("satellite", "*")
         sat_text = _t("satellite_all") if sat == "*" else satellite_label(sat)
         text = "%s: %s • %s • %s • %s • %s • %s    |    %s: %s" % (
             _t("filter_summary"), fv("type", type_label), sat_text, fv("scope", scope_label),
             fv("canvas"), fv("logotype", logo_label), fv("background", background_label),
-            _t("location"), loc.get("label", ""),
+            _t("location"), loc_text,
         )
         self["filters_summary"].setText(text)
 
@@ -691,31 +959,26 @@ class PiconUpdaterMain(Screen):
 
     def selection_changed(self):
         item = self.selected_item()
+        text = self.text
         if not item:
-            self["details"].setText(_t("empty"))
+            self["details"].setText(text["empty"])
             return
-        flags = item_flags(item, self.state, newest_published(self.catalog))
-        status_map = {"UPDATE": _t("update"), "NEW": _t("new"), "INSTALLED": _t("installed"), "LATEST": _t("latest")}
-        status = _t("normal")
-        for key in ("UPDATE", "NEW", "INSTALLED", "LATEST"):
-            if key in flags:
-                status = status_map[key]
-                break
+        status = self._item_status(item) or text["normal"]
         details = (
             "%s: %s\n%s: %s\n%s: %s\n%s: %s (%s)\n%s: %s\n%s: %s\n%s: %s\n%s: %s\n%s: %s" % (
-                _t("source"), item.get("source", "—"),
-                _t("ptype"), type_label(item.get("type")),
-                _t("scope"), (satellite_label(self.filters.get("satellite")) if self.filters.get("satellite", "*") != "*" else scope_label(item.get("scope"))),
-                _t("size"), item.get("canvas", "—"), item.get("padded", "—"),
-                _t("logo"), logo_label(item.get("logotype")),
-                _t("background"), background_label(item.get("background")),
-                _t("release"), item.get("release_tag") or "—",
-                _t("package_size"), _human_bytes(item.get("size")),
-                _t("status"), status,
+                text["source"], item.get("source", "—"),
+                text["ptype"], type_label(item.get("type")),
+                text["scope"], (satellite_label(self.filters.get("satellite")) if self.filters.get("satellite", "*") != "*" else scope_label(item.get("scope"))),
+                text["size"], item.get("canvas", "—"), item.get("padded", "—"),
+                text["logo"], logo_label(item.get("logotype")),
+                text["background"], background_label(item.get("background")),
+                text["release"], item.get("release_tag") or "—",
+                text["package_size"], _human_bytes(item.get("size")),
+                text["status"], status,
             )
         )
         if item.get("type") == "snp":
-            details += "\n" + _t("legacy_note")
+            details += "\n" + text["legacy_note"]
         self["details"].setText(details)
         self._load_preview(item)
 
@@ -748,13 +1011,15 @@ class PiconUpdaterMain(Screen):
         if self.busy:
             self.session.open(MessageBox, _t("busy"), MessageBox.TYPE_INFO, timeout=4)
             return
-        self.session.openWithCallback(self._filters_done, PiconFilterScreen, self.catalog, self.filters, self.location_id)
+        self.session.openWithCallback(self._filters_done, PiconFilterScreen, self.filter_index, self.filters,
+                                      self.location_id, self.state.get("extra_locations") or [])
 
     def _filters_done(self, result):
         if not result:
             return
-        self.filters, self.location_id = result
+        self.filters, self.location_id, extra = result
         self.state["last_location"] = self.location_id
+        self.state["extra_locations"] = extra
         try:
             save_state(self.state)
         except Exception:
@@ -762,62 +1027,202 @@ class PiconUpdaterMain(Screen):
         self._apply_filters()
 
     def install_selected(self):
-        if self.busy:
-            self.session.open(MessageBox, _t("busy"), MessageBox.TYPE_INFO, timeout=4)
-            return
         item = self.selected_item()
         if not item:
             return
         item = dict(item)
         item["selected_satellite"] = self.filters.get("satellite", "*")
-        target = target_by_id(self.location_id)
-        msg = _t("confirm_install") % (self._row_text(item), target.get("label", target.get("path", "")))
+        targets = self._install_targets()
+        # Extra locations are filled from the same download and decompression pass.
+        target = targets if len(targets) > 1 else targets[0]
+        labels = " + ".join(t.get("label", t.get("path", "")) for t in targets)
+        msg = _t("confirm_install") % (self._row_text(item), labels)
         self.session.openWithCallback(lambda ok: self._start_install(item, target) if ok else None, MessageBox, msg, MessageBox.TYPE_YESNO)
 
-    def _start_install(self, item, target):
-        self._set_busy(True)
-        self["operation"].setText(_t("downloading") % "0%")
+    def _install_targets(self):
+        available = dict((x["id"], x) for x in storage_targets())
+        targets = [target_by_id(self.location_id)]
+        for ident in self.state.get("extra_locations") or []:
+            if ident in available and ident != targets[0].get("id"):
+                targets.append(available[ident])
+        return targets
+
+    def _start_install(self, item, target, journal=None, stream=True):
+        """Queue the download of item and then its install into target.
+
+        Downloads run one at a time; the install waits for other jobs holding
+        the same target, so queued updates of one location never overlap.
+        """
+        if not self.busy:
+            self["operation"].setText(_t("queued") if self.jobs.active() else _t("downloading") % "0%")
+        multi = isinstance(target, list)
+        if stream and self.state.get("stream_install") and journal is None and not multi and \
+                stream_install_fits(item, target):
+            return self._start_stream_install(item, target)
+
+        cache = self._package_cache()
+        # Reinstalling or updating the variant already present at this location is
+        # done as a delta: only new or changed files are written.
+        previous = self.state.get("installed", {}).get(item.get("variant_key")) or {}
+        delta = not multi and bool(previous) and previous.get("path") == target.get("path") and os.path.isdir(target.get("path", ""))
+        run = journal or InstallJournal(journal_path(target))
+        label = item.get("name", "")
+        reporter = self._reporter(label)
+        timing = perf.PerfRun(label)
+
+        def discard(tmp):
+            if tmp.startswith(cache.root + os.sep):
+                # Kept for reinstalls; a complete but broken package was already
+                # rejected by download_file's digest check.
+                cache.settle(tmp)
+            else:
+                try:
+                    os.unlink(tmp)
+                except Exception:
+                    pass
 
-        def work():
+        def fetch(token):
+            # A stable name lets download_file resume the .part file left behind
+            # by an interrupted attempt of the same asset.
             suffix = ".tar.xz" if item.get("format") == "tar.xz" else ".ipk"
-            fd, tmp = tempfile.mkstemp(prefix="piconupdater-", suffix=suffix, dir="/tmp")
-            os.close(fd)
+            name = re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(item.get("name") or "") or "package")
+            tmp = os.path.join("/tmp", "piconupdater-" + name)
+            if not tmp.endswith(suffix):
+                tmp += suffix
+            need = int(item.get("size") or 0)
+            left = (run.record.get("package") or "") if run.record else ""
+            try:
+                if left and os.path.isfile(left) and (not need or os.path.getsize(left) == need):
+                    # The package an interrupted install was reading survived
+                    # (cache or a GUI restart without reboot).
+                    tmp = left
+                else:
+                    tmp = cache.lookup(item) or tmp
+                if tmp == left or tmp.startswith(cache.root + os.sep):
+                    self.work_queue.put(("progress", _t("cache_hit"), 0, 0))
+                else:
+                    try:
+                        cached = cache.path_for(item)
+                    except OSError:
+                        cached = ""
+                    if cached:
+                        # Make room first, so the cache never exceeds its limit.
+                        cache.evict(reserve=need)
+                    free = free_space(os.path.dirname(cached)) if cached else 0
+                    if cached and (not need or free > need * 1.05):
+                        tmp = cached
+                    # data.tar is read in place from the .ipk, so the download
+                    # directory only has to hold the package itself.
+                    free = free_space(os.path.dirname(tmp))
+                    if need and free and free < int(need * 1.05):
+                        raise IOError("Za mało miejsca w %s: potrzeba ok. %s, wolne %s" % (os.path.dirname(tmp), _human_bytes(need * 1.05), _human_bytes(free)))
+
+                    segments = DOWNLOAD_SEGMENTS if self.state.get("segmented_download") else 1
+                    download_file(item.get("download_url"), tmp, progress=reporter.bytes_callback("download"),
+                                  timeout=120,
+                                  expected_digest=item.get("digest", ""), segments=segments, cancel=token)
+                token.check()
+            except Cancelled:
+                discard(tmp)
+                self.work_queue.put(("cancelled",))
+                return
+            except Exception as e:
+                run.finish()
+                discard(tmp)
+                self.work_queue.put(("error", str(e)))
+                return
+            self._submit("install", self._timed(timing, lambda token: install(tmp, token)), target_locks(target), label)
+
+        def install(tmp, token):
             try:
-                need = int(item.get("size") or 0)
-                free = free_space("/tmp")
-                if need and free and free < int(need * 1.35):
-                    raise IOError("Za mało miejsca w /tmp: potrzeba ok. %s, wolne %s" % (_human_bytes(need * 1.35), _human_bytes(free)))
-
-                def dprog(done, total):
-                    self.work_queue.put(("progress", _t("downloading").split(":")[0], done, total))
-                download_file(item.get("download_url"), tmp, progress=dprog, timeout=120, expected_digest=item.get("digest", ""))
-
-                # Fully validate the downloaded archive before touching existing picons.
-                # Only after successful validation do we remove the old set. This gives
-                # the update access to the space occupied by previous picons without
-                # risking deletion because of a corrupt/incomplete download.
-                validate_package(tmp, item)
-                self.work_queue.put(("progress", _t("clearing_old"), 0, 0))
-                clear_picons(target)
-                required = estimate_install_bytes(tmp, item, target)
-                target_free = free_space(target.get("path", "/"))
-                if required and target_free and target_free < required:
-                    raise IOError("Za mało miejsca po usunięciu poprzednich piconów: potrzeba ok. %s, wolne %s" % (_human_bytes(required), _human_bytes(target_free)))
-
-                def iprog(done, total):
-                    self.work_queue.put(("progress", _t("installing").split(":")[0], done, total))
-                result = install_package(tmp, item, target, progress=iprog)
+                # Only now does this job hold the target, so no other install
+                # to it is running and the journal file is ours.
+                if run.record is None:
+                    run.begin(item, target, tmp)
+
+                def status(phase, done):
+                    reporter.phase(_STATUS_PHASES.get(phase, "install"))
+                    if done:
+                        reporter.update(members=done)
+                # Archive work runs in a low-priority child process so the GUI
+                # keeps its share of the interpreter; cancelling the job stops it.
+                worker = InstallWorker(tmp, item, target, delta=delta, journal=run, cancel=token)
+                result = worker.run(progress=reporter.members_callback("install"), status=status,
+                                    byte_progress=reporter.bytes_callback("install"))
+                reporter.finish()
+                run.finish()
+                self._save_timing(timing, item, result["path"], files=result.get("count", 0))
                 self.work_queue.put(("install_done", item, result))
+            except Cancelled:
+                self._save_timing(timing, item, (target[0] if multi else target)["path"], status="cancelled")
+                self.work_queue.put(("cancelled",))
             except Exception as e:
+                run.finish()
+                self._save_timing(timing, item, (target[0] if multi else target)["path"], status="error")
                 self.work_queue.put(("error", str(e)))
             finally:
-                try:
-                    os.unlink(tmp)
-                except Exception:
-                    pass
-        t = threading.Thread(target=work)
-        t.daemon = True
-        t.start()
+                discard(tmp)
+        self._submit("download", self._timed(timing, fetch), (DOWNLOAD_LOCK,), label)
+
+    def _resume_install(self):
+        """Continue installs that enigma2 or the box did not survive."""
+        resumed = False
+        for journal in InstallJournal.load_all():
+            item, target = journal.record["item"], journal.record.get("target") or {}
+            if [each for each in (target if isinstance(target, list) else [target])
+                    if not os.path.isdir(os.path.dirname(each.get("path") or "") or "/nonexistent")]:
+                # The medium is gone; nothing to continue on.
+                journal.finish()
+                continue
+            self.session.open(MessageBox, _t("resuming_install") % item.get("name", ""), MessageBox.TYPE_INFO, timeout=5)
+            self._start_install(item, target, journal=journal)
+            resumed = True
+        return resumed
+
+    def _start_stream_install(self, item, target):
+        def work(token):
+            try:
+                # Download, verification and unpacking overlap; the live picons are
+                # replaced only after the digest of the complete stream matched.
+                reporter = self._reporter(item.get("name", ""))
+                result = stream_install_package(item.get("download_url"), item, target,
+                                                progress=reporter.bytes_callback("install"), timeout=120, cancel=token)
+                reporter.finish()
+                self._save_timing(timing, item, result["path"], files=result.get("count", 0))
+                self.work_queue.put(("install_done", item, result))
+            except StreamFallback:
+                self.work_queue.put(("stream_fallback", item, target))
+            except Cancelled:
+                self._save_timing(timing, item, target["path"], status="cancelled")
+                self.work_queue.put(("cancelled",))
+            except Exception as e:
+                self._save_timing(timing, item, target["path"], status="error")
+                self.work_queue.put(("error", str(e)))
+        timing = perf.PerfRun(item.get("name", ""))
+        self._submit("install", self._timed(timing, work), [DOWNLOAD_LOCK] + target_locks(target), item.get("name", ""))
+
+    @staticmethod
+    def _timed(timing, work):
+        """Job work function whose catalog/storage spans go to timing."""
+        def bound(token):
+            timing.start()
+            with perf.bind(timing):
+                return work(token)
+        return bound
+
+    @staticmethod
+    def _save_timing(timing, item, target_path, files=0, status="ok"):
+        perf.append_history(timing.record(files=files, package_bytes=int(item.get("size") or 0),
+                                          target=target_path, version=PLUGIN_VERSION, status=status))
+
+    def _reporter(self, label):
+        """Progress of one job: throttled snapshots to the queue and the progress log."""
+        return ProgressReporter(sink=lambda snap: self.work_queue.put(("report", snap)), label=label)
+
+    def _package_cache(self):
+        limit = self.state.get("package_cache_mb")
+        limit = PACKAGE_CACHE_LIMIT if limit is None else int(limit) * 1024 * 1024
+        return PackageCache(limit=limit)
 
     def open_qr(self):
         self.session.open(PiconQRScreen)
@@ -828,9 +1233,15 @@ class PiconUpdaterMain(Screen):
             return
         choices = [
             (_t("tool_update"), "update"),
+            (_t("tool_update_all") % len(self._pending_updates()), "update_all"),
             (_t("tool_qr"), "qr"),
+            (_t("tool_perf"), "perf"),
+            (_t("tool_history"), "history"),
             (_t("tool_clear_cache"), "cache"),
+            (_t("tool_package_cache") % self._package_cache_usage(), "packages"),
             (_t("tool_clear_picons"), "clear"),
+            (_t("tool_stream") % (_t("on") if self.state.get("stream_install") else _t("off")), "stream"),
+            (_t("tool_segments") % (DOWNLOAD_SEGMENTS, _t("on") if self.state.get("segmented_download") else _t("off")), "segments"),
         ]
         self.session.openWithCallback(self._tool_selected, ChoiceBox, title=_t("tools"), list=choices)
 
@@ -840,6 +1251,17 @@ class PiconUpdaterMain(Screen):
         action = choice[1]
         if action == "qr":
             self.open_qr()
+        elif action == "perf":
+            self.session.open(PiconPerfScreen)
+        elif action == "history":
+            self._start_history_worker()
+        elif action == "update_all":
+            self._update_all()
+        elif action == "packages":
+            choices = [(_t("package_cache_purge"), "purge")]
+            for mb in PACKAGE_CACHE_CHOICES:
+                choices.append((_t("package_cache_limit") % (_human_bytes(mb * 1024 * 1024) if mb else _t("off")), mb))
+            self.session.openWithCallback(self._package_cache_selected, ChoiceBox, title=_t("tool_package_cache") % self._package_cache_usage(), list=choices)
         elif action == "cache":
             try:
                 if os.path.exists(CACHE_FILE):
@@ -851,16 +1273,83 @@ class PiconUpdaterMain(Screen):
             target = target_by_id(self.location_id)
             msg = _t("confirm_clear") % target.get("path", "")
             self.session.openWithCallback(lambda ok: self._do_clear(target) if ok else None, MessageBox, msg, MessageBox.TYPE_YESNO)
+        elif action in ("stream", "segments"):
+            key = "stream_install" if action == "stream" else "segmented_download"
+            self.state[key] = not self.state.get(key)
+            try:
+                save_state(self.state)
+            except Exception:
+                pass
         elif action == "update":
             msg = _t("confirm_plugin_update") % INSTALL_COMMAND
             self.session.openWithCallback(self._run_plugin_installer, MessageBox, msg, MessageBox.TYPE_YESNO)
 
-    def _do_clear(self, target):
+    def _pending_updates(self):
+        """Newest release of every installed variant flagged UPDATE."""
+        newest = {}
+        for item in self.catalog:
+            key = item.get("variant_key")
+            if "UPDATE" in self.view.item_flags(item):
+                if key not in newest or item.get("published_at", "") > newest[key].get("published_at", ""):
+                    newest[key] = item
+        return [newest[key] for key in sorted(newest)]
+
+    def _update_all(self):
+        updates = self._pending_updates()
+        if not updates:
+            self.session.open(MessageBox, _t("update_all_none"), MessageBox.TYPE_INFO, timeout=4)
+            return
+        targets = dict((os.path.realpath(x["path"]), x) for x in storage_targets())
+        for item in updates:
+            installed = self.state.get("installed", {}).get(item.get("variant_key")) or {}
+            # Each variant goes back where it is installed, with the same satellites.
+            target = targets.get(os.path.realpath(installed.get("path") or "/")) or target_by_id(self.location_id)
+            item = dict(item)
+            item["selected_satellite"] = installed.get("satellite", "*")
+            self._start_install(item, target)
+
+    def _package_cache_usage(self):
+        cache = self._package_cache()
+        count, total = cache.usage()
+        return count, _human_bytes(total), _human_bytes(cache.limit) if cache.limit else _t("off")
+
+    def _package_cache_selected(self, choice):
+        if not choice:
+            return
+        if choice[1] == "purge":
+            count, total = self._package_cache().purge()
+            self.session.open(MessageBox, _t("package_cache_purged") % (count, _human_bytes(total)), MessageBox.TYPE_INFO, timeout=6)
+            return
+        self.state["package_cache_mb"] = choice[1]
         try:
-            count = clear_picons(target)
-            self.session.open(MessageBox, _t("clear_ok") % count, MessageBox.TYPE_INFO, timeout=6)
-        except Exception as e:
-            self.session.open(MessageBox, "%s: %s" % (_t("error"), e), MessageBox.TYPE_ERROR)
+            save_state(self.state)
+        except Exception:
+            pass
+        self._package_cache().evict()
+
+    def _do_clear(self, target):
+        def work(token):
+            try:
+                # The rename empties the location at once; deletion runs at low
+                # priority and reports its progress.
+                path = target.get("path", "/")
+                if not move_to_trash(target):
+                    self.work_queue.put(("clear_done", clear_picons(target)))
+                    return
+
+                reporter = self._reporter(path)
+                worker = empty_trash(path, progress=reporter.members_callback("clear"), background=True)
+                while worker.is_alive():
+                    if token.wait(0.5):
+                        # The location is already empty; the trash is finished
+                        # off at the next start.
+                        self.work_queue.put(("cancelled",))
+                        return
+                reporter.finish()
+                self.work_queue.put(("clear_done", None))
+            except Exception as e:
+                self.work_queue.put(("error", str(e)))
+        self._submit("clear", work, target_locks(target), target.get("path", ""))
 
     def _run_plugin_installer(self, confirmed):
         if not confirmed:
@@ -872,7 +1361,10 @@ class PiconUpdaterMain(Screen):
 
     def exit(self):
         if self.busy:
-            self.session.open(MessageBox, _t("busy"), MessageBox.TYPE_INFO, timeout=4)
+            kinds = ("download", "install", "clear")
+            self.session.openWithCallback(lambda ok: self.jobs.cancel_all(kinds) if ok else None, MessageBox,
+                                          _t("confirm_cancel_install") % len(self.jobs.active(kinds)),
+                                          MessageBox.TYPE_YESNO)
             return
         latest = newest_published(self.catalog)
         if latest: